@@ -9,12 +9,18 @@ output            :Nagios/Icinga2 format
 
 
 import argparse
-import urllib3
-import kubernetes
 import datetime
+import sys
 from pprint import pprint
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'common'))
+import monitor_shim  # noqa: E402,F401
+import urllib3  # noqa: E402
+import kube_client  # noqa: E402
+import kube_list_cache  # noqa: E402
+import monitor_timings  # noqa: E402
+
 ###
 #   Constants
 ###
@@ -24,19 +30,16 @@ parser = argparse.ArgumentParser(description='Monitor for Anarchy Run data-integ
 parser.add_argument('-a', '--apiurl', help='address of the API e.g. "https://host.localdomain.com/api:4321"', required=True, type=str, dest='apiurl')
 parser.add_argument('-s', '--secret-file', help='file path containing the k8s secret for the API', required=True, type=str, dest='secret_path')
 parser.add_argument('-c', '--cacert', help='file path containing CA Cert for API', required=True, type=str, dest='cacert')
+parser.add_argument('--list-cache-ttl', help='seconds a LIST may be shared with other monitors asking for the same one (0 disables)', required=False, type=int, dest='list_cache_ttl', default=kube_list_cache.default_ttl)
+monitor_timings.add_arguments(parser)
 args = parser.parse_args()
+monitor_timings.start(args)
 
 # setup the client
-apikey = Path(args.secret_path).read_text()
-aConfig = kubernetes.client.Configuration()
-aConfig.api_key = {"authorization": "Bearer " + apikey}
-aConfig.host = args.apiurl
-aConfig.ssl_ca_cert = args.cacert
-aApiClient = kubernetes.client.ApiClient(aConfig)
+aApiClient = kube_client.api_client(args.apiurl, args.secret_path, args.cacert)
 # ocp_client = DynamicClient(aApiClient)
-custom_objects_api = kubernetes.client.CustomObjectsApi(aApiClient)
-v1 = kubernetes.client.CoreV1Api(aApiClient)
-anarchyruns = custom_objects_api.list_cluster_custom_object('anarchy.gpte.redhat.com', 'v1', 'anarchyruns')['items']
+monitor_timings.phase('evaluate')
+anarchyruns = kube_list_cache.list_objects(aApiClient, 'anarchy.gpte.redhat.com', 'v1', 'anarchyruns', ttl=args.list_cache_ttl)['items']
 
 anarchyruns_in_error = {}
 
@@ -90,6 +93,7 @@ for anarchyrun in anarchyruns:
 anarchyrun_count = len(anarchyruns)
 anarchyrun_errorcount = len(anarchyruns_in_error)
 
+monitor_timings.phase('render')
 if anarchyrun_errorcount == 0:
     exitstring = "[OK] No Anarchy Runs in Error found; | countruns=" + str(anarchyrun_count) + ";;;;; errorruns=" + str(anarchyrun_errorcount) + ";;;;;"
     print(exitstring)
@@ -8,29 +8,32 @@ output            :Nagios/Icinga2 format
 """
 
 import argparse
-import kubernetes
 import datetime
+import sys
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'common'))
+import monitor_shim  # noqa: E402,F401
+import kube_client  # noqa: E402
+import kube_list_cache  # noqa: E402
+import monitor_timings  # noqa: E402
+
 parser = argparse.ArgumentParser(description='Monitor for Anarchy Subject data-integrity ')
 parser.add_argument('-a', '--apiurl', help='address of the API e.g. "https://host.localdomain.com/api:4321"', required=True, type=str, dest='apiurl')
 parser.add_argument('-s', '--secret-file', help='file path containing the k8s secret for the API', required=True, type=str, dest='secret_path')
 parser.add_argument('-c', '--cacert', help='file path containing CA Cert for API', required=True, type=str, dest='cacert')
+parser.add_argument('--list-cache-ttl', help='seconds a LIST may be shared with other monitors asking for the same one (0 disables)', required=False, type=int, dest='list_cache_ttl', default=kube_list_cache.default_ttl)
 parser.add_argument('-d', '--deeplink', help='where to link the output', required=False, type=str, dest='deeplink',
                     default="https://my.babylonui.example.com/admin/anarchysubjects/")
+monitor_timings.add_arguments(parser)
 args = parser.parse_args()
+monitor_timings.start(args)
 
 # setup the client
-apikey = Path(args.secret_path).read_text()
-aConfig = kubernetes.client.Configuration()
-aConfig.api_key = {"authorization": "Bearer " + apikey}
-aConfig.host = args.apiurl
-aConfig.ssl_ca_cert = args.cacert
-aApiClient = kubernetes.client.ApiClient(aConfig)
+aApiClient = kube_client.api_client(args.apiurl, args.secret_path, args.cacert)
 # ocp_client = DynamicClient(aApiClient)
-custom_objects_api = kubernetes.client.CustomObjectsApi(aApiClient)
-v1 = kubernetes.client.CoreV1Api(aApiClient)
-anarchysubjects = custom_objects_api.list_cluster_custom_object('anarchy.gpte.redhat.com', 'v1', 'anarchysubjects')['items']
+monitor_timings.phase('evaluate')
+anarchysubjects = kube_list_cache.list_objects(aApiClient, 'anarchy.gpte.redhat.com', 'v1', 'anarchysubjects', ttl=args.list_cache_ttl)['items']
 
 good_statuses = ['provision-pending', 'provisioning', 'started', 'start-pending', 'starting', 'stopped', 'stop-pending', 'stopping', 'destroying']
 bad_statuses = ['provision-failed', 'start-failed', 'stop-failed', 'destroy-failed']
@@ -50,8 +53,8 @@ for anarchysubject in anarchysubjects:
         anarchysubject["status"]["towerJobs"]["provision"]
     except Exception:
         if seconds_since_creation > (60 + 1800):  # 30 minutes added at request of prutledge
-        entryJob = True
-        mon_status.append("provisionJobMissing")
+            entryJob = True
+            mon_status.append("provisionJobMissing")
   
     try:
         anarchysubject["status"]["kopf"]["progress"]
@@ -85,6 +88,7 @@ for anarchysubject in anarchysubjects:
         anarchysubject["mon_status"] = mon_status
         anarchysubjects_in_error.append(anarchysubject)
 
+monitor_timings.phase('render')
 if len(anarchysubjects_in_error) == 0:
     exitstring = "[OK] No Anarchy Subjects in Error found; | countsubjects={};;;;; errorsubjects={};;;;; recovered={};;;;; ".format(
                len(anarchysubjects), len(anarchysubjects_in_error), len(recovered))
@@ -8,9 +8,30 @@ output            :Nagios/Icinga2 format
 """
 
 import argparse
-import requests
+import concurrent.futures
+import os
+import re
+import sys
+import time
+from datetime import datetime, timezone
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'common'))
+import monitor_shim  # noqa: E402,F401
+import requests  # noqa: E402
+from requests.adapters import HTTPAdapter  # noqa: E402
+import monitor_timings  # noqa: E402
+import ring_file  # noqa: E402
+
+# Job states after which created/started/finished no longer change
+finished_aap2_job_states = "successful,failed,error,canceled"
+# Jobs asked for per page when catching up on recently modified jobs
+latency_page_size = 200
+# Objects asked for per page when listing instance groups, instances and active jobs
+bulk_page_size = 200
+# Job states which hold or are waiting for capacity in an instance group
+active_aap2_job_states = "running,pending,waiting"
+
 parser = argparse.ArgumentParser(description='Monitor for AAP2 Job status - using api/v2/jobs ')
 parser.add_argument('-a', '--apiurl', help='address of the API e.g. "https://host.localdomain.com/api/v2/jobs"', required=True, type=str, dest='apiurl')
 parser.add_argument('-s', '--secret-file', help='file path containing the secret for the API', required=True, type=str, dest='secret_path')
@@ -21,15 +42,244 @@ parser.add_argument('-r', '--running-warning', help='count of running jobs that
 parser.add_argument('-t', '--running-critical', help='count of running jobs that constitutes critical', required=True, type=str, dest='level_crit_running')
 parser.add_argument('-w', '--waiting-warning', help='count of waiting jobs that constitutes warning', required=True, type=str, dest='level_warn_waiting')
 parser.add_argument('-v', '--waiting-critical', help='count of waiting jobs that constitutes critical', required=True, type=str, dest='level_crit_waiting')
+parser.add_argument('-m', '--metrics', help='read job counts and capacity from a single request to /api/v2/metrics/', required=False, action='store_true', dest='use_metrics', default=False)
+parser.add_argument('-L', '--latency-file', help='file to keep recent job latencies and the modified cursor in, enables queue wait and run duration tracking', required=False, type=str, dest='latency_file')
+parser.add_argument('--latency-samples', help='number of most recently finished jobs to compute latency percentiles over', required=False, type=int, dest='latency_samples', default=500)
+parser.add_argument('--latency-window', help='seconds of finished jobs to compute latency percentiles over, and to catch up on in the first run', required=False, type=int, dest='latency_window', default=3600)
+parser.add_argument('--latency-max-pages', help='most pages of modified jobs to read in one run, the rest are picked up by the next run', required=False, type=int, dest='latency_max_pages', default=20)
+parser.add_argument('--queue-wait-warning', help='p95 seconds from created to started that constitutes warning', required=False, type=float, dest='level_warn_queue_wait')
+parser.add_argument('--queue-wait-critical', help='p95 seconds from created to started that constitutes critical', required=False, type=float, dest='level_crit_queue_wait')
+parser.add_argument('--run-duration-warning', help='p95 seconds from started to finished that constitutes warning', required=False, type=float, dest='level_warn_run_duration')
+parser.add_argument('--run-duration-critical', help='p95 seconds from started to finished that constitutes critical', required=False, type=float, dest='level_crit_run_duration')
+parser.add_argument('-g', '--instance-groups', help='report capacity and running jobs per instance group, and jobs not yet placed in one (AWX only sets a job\'s instance group once it schedules it, so pending jobs have none)', required=False, action='store_true', dest='instance_groups', default=False)
+parser.add_argument('--group-remaining-warning', help='percent of capacity remaining in any instance group that constitutes warning', required=False, type=float, dest='level_warn_group_remaining', default=20)
+parser.add_argument('--group-remaining-critical', help='percent of capacity remaining in any instance group that constitutes critical', required=False, type=float, dest='level_crit_group_remaining', default=5)
+parser.add_argument('-T', '--timeout', help='seconds to wait for the controller before reporting UNKNOWN', required=False, type=float, dest='timeout', default=10)
+monitor_timings.add_arguments(parser)
 args = parser.parse_args()
+monitor_timings.start(args)
 
 api_password = Path(args.secret_path).read_text().strip()
 valid_aap2_job_states = {"pending", "running", "waiting", "failed", "new", "successful"}
+metrics_of_interest = {"awx_status_total", "awx_instance_capacity", "awx_instance_consumed_capacity"}
+metrics_label_re = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+# One keep-alive session for every request, with a connection for each state so they can all run at once
+session = requests.Session()
+session.auth = (args.username, api_password)
+session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=len(valid_aap2_job_states)))
+# With --timings, open the first connection with a ping so the TLS handshake counts as connect time.
+# It carries the session's credentials like every other request (auth=None would still fall back to them), AWX just doesn't need them for /ping/
+if monitor_timings.enabled:
+    try:
+        session.get('https://' + args.apiurl + '/api/v2/ping/', timeout=args.timeout).close()
+    except requests.exceptions.RequestException:
+        pass
+
+
+# Pull the count of jobs in a state - page_size=1 as we only need the count of the result
+def get_job_count(state):
+    response = session.get('https://' + args.apiurl + '/api/v2/jobs/', params={'status': state, 'page_size': '1'}, timeout=args.timeout)
+    response.raise_for_status()
+    return(response.json()["count"])
+
+
+# Walk Prometheus text exposition line by line, yielding (name, labels, value) for the wanted metrics only
+# Comment lines and uninteresting series are skipped on the metric name alone, before any label parsing
+def parse_metrics_lines(lines, wanted):
+    for line in lines:
+        if not line or line[0] == '#':
+            continue
+        name_end = 0
+        while name_end < len(line) and line[name_end] not in '{ ':
+            name_end += 1
+        name = line[:name_end]
+        if name not in wanted:
+            continue
+        labels = {}
+        rest = line[name_end:]
+        if rest.startswith('{'):
+            labels_end = rest.rindex('}')
+            labels = dict(metrics_label_re.findall(rest[1:labels_end]))
+            rest = rest[labels_end + 1:]
+        # Value may be followed by an optional timestamp
+        yield name, labels, float(rest.split()[0])
+
+
+# Fetch /api/v2/metrics/ once and stream it through the parser, collecting job counts and capacity totals
+def get_metrics_counts():
+    counts = {state: 0 for state in valid_aap2_job_states}
+    capacity = {"capacity": 0, "consumed_capacity": 0}
+    with session.get('https://' + args.apiurl + '/api/v2/metrics/', timeout=args.timeout, stream=True) as response:
+        response.raise_for_status()
+        for name, labels, value in parse_metrics_lines(response.iter_lines(decode_unicode=True), metrics_of_interest):
+            if name == "awx_status_total":
+                if labels.get("status") in counts:
+                    counts[labels["status"]] = int(value)
+            elif name == "awx_instance_capacity":
+                capacity["capacity"] += int(value)
+            else:
+                capacity["consumed_capacity"] += int(value)
+    return(counts, capacity)
+
+
+# Read every page of a list endpoint, following "next" which the controller gives as a path on the same host
+def get_all_results(path, params):
+    results = []
+    url, params = 'https://' + args.apiurl + path, dict(params, page_size=bulk_page_size)
+    while url:
+        response = session.get(url, params=params, timeout=args.timeout)
+        response.raise_for_status()
+        page = response.json()
+        results.extend(page["results"])
+        url, params = ('https://' + args.apiurl + page["next"]) if page.get("next") else None, None
+    return(results)
+
+
+# Fetch instance groups, instances and active jobs concurrently, one bulk listing each, and
+# summarise capacity and running jobs per instance group.
+# Instances do not say which groups they belong to, so they are only used for the enabled/erroring totals.
+def get_instance_group_usage():
+    with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+        groups_future = executor.submit(get_all_results, '/api/v2/instance_groups/', {})
+        instances_future = executor.submit(get_all_results, '/api/v2/instances/', {})
+        jobs_future = executor.submit(get_all_results, '/api/v2/jobs/', {'status__in': active_aap2_job_states})
+        groups, instances, jobs = groups_future.result(), instances_future.result(), jobs_future.result()
+    usage = {}
+    group_names = {}
+    for group in groups:
+        group_names[group["id"]] = group["name"]
+        capacity, consumed = group["capacity"] or 0, group["consumed_capacity"] or 0
+        usage[group["name"]] = {
+            "capacity": capacity,
+            "consumed_capacity": consumed,
+            "remaining_percent": 100.0 * (capacity - consumed) / capacity if capacity else 0.0,
+            # Container groups have no fixed capacity to run out of
+            "thresholds_apply": not group.get("is_container_group", False),
+            "running": 0,
+        }
+    for job in jobs:
+        name = group_names.get(job.get("instance_group"))
+        if name is not None and job["status"] == "running":
+            usage[name]["running"] += 1
+    instance_totals = {
+        "instances_enabled": sum(1 for instance in instances if instance.get("enabled")),
+        "instances_erroring": sum(1 for instance in instances if instance.get("errors")),
+        # AWX only sets instance_group when it schedules a job, so this is the queue still waiting for capacity somewhere
+        "unassigned_pending": sum(1 for job in jobs if job.get("instance_group") not in group_names),
+    }
+    return(usage, instance_totals)
+
+
+# Controller timestamps look like 2023-11-14T22:14:20.123456Z, the fraction is left out when it is zero
+def parse_aap_time(value):
+    for time_format in ('%Y-%m-%dT%H:%M:%S.%fZ', '%Y-%m-%dT%H:%M:%SZ'):
+        try:
+            return(datetime.strptime(value, time_format).replace(tzinfo=timezone.utc).timestamp())
+        except ValueError:
+            pass
+    raise ValueError(f"unexpected timestamp {value!r}")
+
+
+def format_aap_time(timestamp):
+    return(datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ'))
+
+
+# Read finished jobs modified since the cursor, oldest modification first, and record their queue wait and run duration.
+# Each page asks again from the last modified time seen rather than following the page number in "next",
+# so jobs being modified while we read cannot shift the remaining pages and make us skip any.
+# The cursor time itself is asked for again, as other jobs can share it; recorded_ids skips the ones already recorded.
+# Returns the new cursor, which the caller persists only once everything up to it has been recorded.
+def collect_job_latencies(history, cursor):
+    recorded_ids = {record[1] for record in history.read()}
+    for page in range(args.latency_max_pages):
+        monitor_timings.phase('fetch')
+        response = session.get('https://' + args.apiurl + '/api/v2/jobs/', params={'modified__gte': cursor, 'status__in': finished_aap2_job_states, 'order_by': 'modified', 'page_size': latency_page_size}, timeout=args.timeout)
+        response.raise_for_status()
+        monitor_timings.phase('decode')
+        jobs = response.json()["results"]
+        monitor_timings.phase('evaluate')
+        for job in jobs:
+            cursor = job["modified"]
+            if job["id"] in recorded_ids or not job["started"] or not job["finished"]:
+                continue
+            created, started, finished = parse_aap_time(job["created"]), parse_aap_time(job["started"]), parse_aap_time(job["finished"])
+            history.append((finished, job["id"], max(started - created, 0), max(finished - started, 0)))
+            recorded_ids.add(job["id"])
+        if len(jobs) < latency_page_size:
+            break
+    return(cursor)
+
+
+# Nearest-rank percentile of an already sorted list
+def percentile(sorted_values, fraction):
+    return(sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))])
+
+
+# True when a p95 latency is at or over a threshold which was given
+def latency_over(key, level):
+    return(latency is not None and level is not None and latency[key] >= level)
+
+
+# Stage count variables - either one metrics request or all states requested concurrently
+# The requests run on worker threads, so their parsing counts as fetch time rather than decode time
 count = {}
-# Stage count variables
-for state in valid_aap2_job_states:
-    response = requests.get('https://' + args.apiurl + '/api/v2/jobs/', params={'status': state, 'page_size': '1'}, auth=(args.username, api_password))
-    count[state] = response.json()["count"]
+capacity = None
+monitor_timings.phase('fetch')
+try:
+    if args.use_metrics:
+        count, capacity = get_metrics_counts()
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(valid_aap2_job_states)) as executor:
+            count_futures = {state: executor.submit(get_job_count, state) for state in valid_aap2_job_states}
+            for state in count_futures:
+                count[state] = count_futures[state].result()
+except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+    print(f"[UNKNOWN] Could not get Ansible Controller jobs status: {e};")
+    exit(3)
+
+monitor_timings.phase('evaluate')
+
+# Catch up on recently finished jobs and summarise their latencies
+latency = None
+if args.latency_file:
+    now = time.time()
+    cursor_path = args.latency_file + '.cursor'
+    # finished time, job id, queue wait seconds, run duration seconds
+    latency_history = ring_file.RingFile(args.latency_file, '<dQdd', args.latency_samples)
+    try:
+        cursor = Path(cursor_path).read_text().strip()
+    except FileNotFoundError:
+        cursor = format_aap_time(now - args.latency_window)
+    try:
+        cursor = collect_job_latencies(latency_history, cursor)
+    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+        print(f"[UNKNOWN] Could not get Ansible Controller job latencies: {e};")
+        exit(3)
+    Path(cursor_path + '.tmp').write_text(cursor + '\n')
+    os.replace(cursor_path + '.tmp', cursor_path)
+    recent = [record for record in latency_history.read() if record[0] >= now - args.latency_window]
+    if recent:
+        queue_waits = sorted(record[2] for record in recent)
+        run_durations = sorted(record[3] for record in recent)
+        latency = {
+            "jobs": len(recent),
+            "queue_wait_p50": percentile(queue_waits, 0.50),
+            "queue_wait_p95": percentile(queue_waits, 0.95),
+            "run_duration_p50": percentile(run_durations, 0.50),
+            "run_duration_p95": percentile(run_durations, 0.95),
+        }
+
+# Per instance group capacity
+group_usage = None
+if args.instance_groups:
+    monitor_timings.phase('fetch')
+    try:
+        group_usage, instance_totals = get_instance_group_usage()
+    except (requests.exceptions.RequestException, ValueError, KeyError, TypeError) as e:
+        print(f"[UNKNOWN] Could not get Ansible Controller instance group capacity: {e};")
+        exit(3)
+    monitor_timings.phase('evaluate')
 
 # pprint(count)
 # {'failed': 731,
@@ -47,11 +297,42 @@ is_critical = False
 is_warning = False
 
 perfdata_string = "; | running={};;;;; new={};;;;; pending={};;;;; waiting={};;;;; successful={};;;;; failed={};;;;; ".format(count["running"], count["new"], count["pending"], count["waiting"], count["successful"], count["failed"])
+if capacity is not None:
+    perfdata_string += "capacity={};;;;; consumed_capacity={};;;;; ".format(capacity["capacity"], capacity["consumed_capacity"])
+latency_string = ""
+if latency is not None:
+    perfdata_string += "queue_wait_p50={:.0f}s;;;0;; queue_wait_p95={:.0f}s;{};{};0;; run_duration_p50={:.0f}s;;;0;; run_duration_p95={:.0f}s;{};{};0;; finished_jobs={};;;0;; ".format(
+        latency["queue_wait_p50"], latency["queue_wait_p95"], args.level_warn_queue_wait or "", args.level_crit_queue_wait or "",
+        latency["run_duration_p50"], latency["run_duration_p95"], args.level_warn_run_duration or "", args.level_crit_run_duration or "",
+        latency["jobs"])
+    latency_string = " p95 queue wait {:.0f}s, p95 run duration {:.0f}s over {} finished jobs;".format(latency["queue_wait_p95"], latency["run_duration_p95"], latency["jobs"])
+elif args.latency_file:
+    latency_string = " no jobs finished in the latency window;"
+group_string = ""
+groups_critical = []
+groups_warning = []
+if group_usage is not None:
+    for name in sorted(group_usage):
+        group = group_usage[name]
+        label = re.sub(r'[^a-zA-Z0-9_]', '_', name)
+        group_thresholds = "{:g}:;{:g}:".format(args.level_warn_group_remaining, args.level_crit_group_remaining) if group["thresholds_apply"] else ";"
+        perfdata_string += "group_{0}_remaining={1:.1f}%;{2};0;100 group_{0}_consumed_capacity={3};;;0;{4} group_{0}_running={5};;;0;; ".format(
+            label, group["remaining_percent"], group_thresholds, group["consumed_capacity"], group["capacity"], group["running"])
+        if not group["thresholds_apply"]:
+            continue
+        if group["remaining_percent"] <= args.level_crit_group_remaining:
+            groups_critical.append(f"{name} {group['remaining_percent']:.0f}% remaining")
+        elif group["remaining_percent"] <= args.level_warn_group_remaining:
+            groups_warning.append(f"{name} {group['remaining_percent']:.0f}% remaining")
+    perfdata_string += "instances_enabled={};;;0;; instances_erroring={};;;0;; unassigned_pending={};;;0;; ".format(
+        instance_totals["instances_enabled"], instance_totals["instances_erroring"], instance_totals["unassigned_pending"])
+    if groups_critical or groups_warning:
+        group_string = " instance groups low on capacity: " + ", ".join(groups_critical + groups_warning) + ";"
 
-if int(count["running"]) >= int(args.level_crit_running) or int(count["pending"]) >= int(args.level_crit_pending) or int(count["waiting"]) >= int(args.level_crit_waiting):
+if int(count["running"]) >= int(args.level_crit_running) or int(count["pending"]) >= int(args.level_crit_pending) or int(count["waiting"]) >= int(args.level_crit_waiting) or latency_over("queue_wait_p95", args.level_crit_queue_wait) or latency_over("run_duration_p95", args.level_crit_run_duration) or groups_critical:
     is_critical = True
     is_warning = False
-elif int(count["running"]) >= int(args.level_warn_running) or int(count["pending"]) >= int(args.level_warn_pending) or int(count["waiting"]) >= int(args.level_warn_waiting):
+elif int(count["running"]) >= int(args.level_warn_running) or int(count["pending"]) >= int(args.level_warn_pending) or int(count["waiting"]) >= int(args.level_warn_waiting) or latency_over("queue_wait_p95", args.level_warn_queue_wait) or latency_over("run_duration_p95", args.level_warn_run_duration) or groups_warning:
     is_critical = False
     is_warning = True
 else:
@@ -61,15 +342,16 @@ else:
 ###
 # Provide the exit code
 ###
+monitor_timings.phase('render')
 if is_critical is True:
     exitstring = "[CRITICAL] Ansible Controller jobs status is in critical state;"
-    print(exitstring + perfdata_string)
+    print(exitstring + latency_string + group_string + perfdata_string)
     exit(2)
 elif is_warning is True:
     exitstring = "[WARNING] Ansible Controller jobs status is in warning state;"
-    print(exitstring + perfdata_string)
+    print(exitstring + latency_string + group_string + perfdata_string)
     exit(1)
 else:
     exitstring = "[OK] Ansible Controller jobs status is ok;"
-    print(exitstring + perfdata_string)
+    print(exitstring + latency_string + group_string + perfdata_string)
     exit(0)
@@ -36,7 +36,11 @@ done
 [ -n "${HOST}" ] && [ -n "${USER}" ] || usage
 
 
-pending_runs_count="$(ssh "${USER}"@"${HOST}" -C "oc get anarchyrun -n anarchy-operator -l 'anarchy.gpte.redhat.com/runner==pending' | wc -l" 2>/dev/null)"
+# Count names only: the server sends the list in 500-item chunks and oc prints one short line per run,
+# so neither side ever holds the whole table. This is not constant-time: every pending run is still
+# listed and counted, so the time taken grows with the queue. The API can't report a remaining item
+# count for a label-selected list, so nothing cheaper is possible with a selector.
+pending_runs_count="$(ssh "${USER}"@"${HOST}" -C "oc get anarchyrun -n anarchy-operator -l 'anarchy.gpte.redhat.com/runner==pending' -o name --chunk-size=500 | wc -l" 2>/dev/null)"
 
 if [[ ${pending_runs_count} -gt 100 ]]
 then
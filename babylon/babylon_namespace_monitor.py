@@ -8,9 +8,15 @@ output            :Nagios/Icinga2 format
 """
 
 import argparse
-import kubernetes
+import sys
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'common'))
+import monitor_shim  # noqa: E402,F401
+import kube_client  # noqa: E402
+import kube_protobuf  # noqa: E402
+import monitor_timings  # noqa: E402
+
 # Set Limits for our checks
 max_namespaces = 10000
 
@@ -30,22 +36,21 @@ parser = argparse.ArgumentParser(description='Monitor for Babylon Namespace data
 parser.add_argument('-a', '--apiurl', help='address of the API e.g. "https://host.localdomain.com/api:4321"', required=True, type=str, dest='apiurl')
 parser.add_argument('-s', '--secret-file', help='file path containing the k8s secret for the API', required=True, type=str, dest='secret_path')
 parser.add_argument('-c', '--cacert', help='file path containing CA Cert for API', required=True, type=str, dest='cacert')
+parser.add_argument('--protobuf', help='LIST core resources as protobuf instead of JSON', required=False, action='store_true', dest='protobuf')
+monitor_timings.add_arguments(parser)
 args = parser.parse_args()
+monitor_timings.start(args)
 
 # setup the client
-apikey = Path(args.secret_path).read_text()
-aConfig = kubernetes.client.Configuration()
-aConfig.api_key = {"authorization": "Bearer " + apikey}
-aConfig.host = args.apiurl
-aConfig.ssl_ca_cert = args.cacert
-aApiClient = kubernetes.client.ApiClient(aConfig)
+aApiClient = kube_client.api_client(args.apiurl, args.secret_path, args.cacert)
 # ocp_client = DynamicClient(aApiClient)
-custom_objects_api = kubernetes.client.CustomObjectsApi(aApiClient)
-v1 = kubernetes.client.CoreV1Api(aApiClient)
+monitor_timings.phase('evaluate')
+core_accept = kube_protobuf.protobuf_accept if args.protobuf else 'application/json'
 
 # Pull all resources required
 #
-namespaces = v1.list_namespace(label_selector='app.kubernetes.io/name=anarchy').to_dict()["items"]
+namespaces = kube_protobuf.get_list(aApiClient, '/api/v1/namespaces', kube_protobuf.phase_schema,
+                                    [('labelSelector', 'app.kubernetes.io/name=anarchy')], accept=core_accept)["items"]
 
 
 # Setup primary check namespace list
@@ -55,7 +60,7 @@ for name in namespaces:
     my_name = name["metadata"]["name"]
     if my_name == "anarchy":
         continue
-    pod_list = v1.list_namespaced_pod(my_name).to_dict()["items"]
+    pod_list = kube_protobuf.get_list(aApiClient, f'/api/v1/namespaces/{my_name}/pods', kube_protobuf.phase_schema, accept=core_accept)["items"]
     pods_state[my_name] = {}
     for pod in pod_list:
         pods_state[my_name][pod["metadata"]["name"]] = pod["status"]["phase"]
@@ -90,6 +95,7 @@ for namespace in pods_state:
             errorfound = True
 
 
+monitor_timings.phase('render')
 if errorfound is False:
     exitstring = "[OK] Anarchy Namespaces are good;"
     print(exitstring)
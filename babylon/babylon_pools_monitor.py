@@ -7,13 +7,20 @@ license           :Apache License v2
 output            :Nagios/Icinga2 format
 """
 
-import kubernetes
 import logging
 import argparse
-import urllib3
-from tabulate import tabulate
+import sys
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'common'))
+import monitor_shim  # noqa: E402,F401
+import urllib3  # noqa: E402
+from tabulate import tabulate  # noqa: E402
+import kube_client  # noqa: E402
+import kube_list_cache  # noqa: E402
+import monitor_metrics  # noqa: E402
+import monitor_timings  # noqa: E402
+
 urllib3.disable_warnings()
 
 parser = argparse.ArgumentParser(description='Monitor for Babylon Pools - note ignores pools with max value of 0')
@@ -26,26 +33,32 @@ parser.add_argument('-f', '--format', help='output format for tabulate', require
 parser.add_argument('-w', '--warning', help='% number pool members that counts as a warning', required=False, type=int, dest='warning_percentage', default=50)
 parser.add_argument('-r', '--critical', help='% number of pool members that counts as a critical', required=False, type=int, dest='critical_percentage', default=10)
 parser.add_argument('-z', '--skipzero', help='skip printing pools with a min_desired of 0', required=False, type=bool, dest='skipzero', default=True)
+parser.add_argument('--list-cache-ttl', help='seconds a LIST may be shared with other monitors asking for the same one (0 disables)', required=False, type=int, dest='list_cache_ttl', default=kube_list_cache.default_ttl)
+monitor_timings.add_arguments(parser)
 args = parser.parse_args()
+monitor_timings.start(args)
 
 # setup the client
-apikey = Path(args.secret_path).read_text()
-aConfig = kubernetes.client.Configuration()
-aConfig.api_key = {"authorization": "Bearer " + apikey}
-aConfig.host = args.apiurl
-aConfig.ssl_ca_cert = args.cacert
-aApiClient = kubernetes.client.ApiClient(aConfig)
-core_v1_api = kubernetes.client.CoreV1Api(aApiClient)
-custom_objects_api = kubernetes.client.CustomObjectsApi(aApiClient)
+aApiClient = kube_client.api_client(args.apiurl, args.secret_path, args.cacert)
+monitor_timings.phase('evaluate')
 logger = logging.getLogger()
 
-response_pools = custom_objects_api.list_namespaced_custom_object(
-    'poolboy.gpte.redhat.com',
-    'v1',
-    'poolboy',
-    'resourcepools')
+pools = kube_list_cache.list_objects(aApiClient, 'poolboy.gpte.redhat.com', 'v1', 'resourcepools', namespace='poolboy', ttl=args.list_cache_ttl)['items']
+
+# Group the pool handles by pool from the same cluster wide LIST resourcehandle_monitor.py makes, instead of a LIST per pool,
+# so concurrent checks share it
+handles_by_pool = {}
+for handle in kube_list_cache.list_objects(aApiClient, 'poolboy.gpte.redhat.com', 'v1', 'resourcehandles', ttl=args.list_cache_ttl)['items']:
+    if handle['metadata'].get('namespace') == 'poolboy':
+        pool_name = handle['metadata'].get('labels', {}).get('poolboy.gpte.redhat.com/resource-pool-name')
+        handles_by_pool.setdefault(pool_name, []).append(handle)
+# AnarchySubjects by (namespace, name), from the LIST anarchysubject_monitor.py makes, instead of a GET per handle resource.
+# Only fetched if a handle refers to one, and fetched here so a failed LIST is reported rather than read as no subjects.
+subjects = {}
+if any(resource.get('reference', {}).get('kind') == 'AnarchySubject' for handles in handles_by_pool.values() for handle in handles for resource in handle['spec'].get('resources') or []):
+    subjects = {(item['metadata']['namespace'], item['metadata']['name']): item for item in
+                kube_list_cache.list_objects(aApiClient, 'anarchy.gpte.redhat.com', 'v1', 'anarchysubjects', ttl=args.list_cache_ttl)['items']}
 
-pools = response_pools['items']
 output = [["POOL", "MIN", "AVAILABLE", "TAKEN", "TOTAL", "STATUS"]]
 outputerror = [["POOL", "MIN", "AVAILABLE", "TAKEN", "TOTAL", "STATUS"]]
 ttotal = 0
@@ -61,14 +74,7 @@ for pool in pools:
         continue
     if args.pool_ignore_pattern and args.pool_ignore_pattern in pool['metadata']['name']:
         continue
-    label = 'poolboy.gpte.redhat.com/resource-pool-name=' + pool['metadata']['name']
-    handles_resp = custom_objects_api.list_namespaced_custom_object(
-        'poolboy.gpte.redhat.com',
-        'v1',
-        'poolboy',
-        'resourcehandles',
-        label_selector=label)
-    handles = handles_resp['items']
+    handles = handles_by_pool.get(pool['metadata']['name'], [])
     min_available = pool['spec']['minAvailable']
     total = 0
     available = 0
@@ -87,8 +93,7 @@ for pool in pools:
         for resource in handle['spec']['resources']:
             try:
                 if resource['reference']['kind'] == 'AnarchySubject':
-                    subject = custom_objects_api.get_namespaced_custom_object(
-                        'anarchy.gpte.redhat.com', 'v1', resource['reference']['namespace'], 'anarchysubjects', resource['reference']['name'])
+                    subject = subjects[(resource['reference']['namespace'], resource['reference']['name'])]
                     try:
                         if subject['spec']['vars']['desired_state'] == subject['spec']['vars']['current_state']:
                             if subject['spec']['vars']['healthy'] is True:
@@ -100,6 +105,11 @@ for pool in pools:
         if resourcecompleted == len(handle['spec']['resources']):
             available = available + 1
             tavailable = tavailable + 1
+    # Per pool gauges for monitor_exporter.py, too many for the perfdata
+    monitor_metrics.gauge('babylon_pool_min_available', min_available, pool=pool['metadata']['name'])
+    monitor_metrics.gauge('babylon_pool_available', available, pool=pool['metadata']['name'])
+    monitor_metrics.gauge('babylon_pool_taken', taken, pool=pool['metadata']['name'])
+    monitor_metrics.gauge('babylon_pool_total', total, pool=pool['metadata']['name'])
     # Setup warning/critical threshold values per pool based on value of total poolsize, and test against available.
     if total == 0:
         my_warn_value = -1
@@ -124,6 +134,7 @@ for pool in pools:
         # print("Is ok")
         output.append([pool['metadata']['name'], str(min_available), str(available), str(taken), str(total), str("---")])
 
+monitor_timings.phase('render')
 if output:
     if is_crit > 0:
         print('[CRITICAL] Pools list (warning {}%, critical {}%): | in-Use={};;;0;{} available={};;;0;{}'.format(args.warning_percentage, args.critical_percentage, ttaken, ttotal, tavailable, ttotal))
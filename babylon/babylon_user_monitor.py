@@ -8,11 +8,17 @@ output            :Nagios/Icinga2 format
 """
 
 import argparse
-import kubernetes
 import os
 import datetime
+import sys
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'common'))
+import monitor_shim  # noqa: E402,F401
+import kube_client  # noqa: E402
+import kube_protobuf  # noqa: E402
+import monitor_timings  # noqa: E402
+
 # Create the base Datastructure for our monitor
 # [{ username: {
 #    project: projectname,
@@ -34,26 +40,20 @@ parser = argparse.ArgumentParser(description='Monitor for Babylon User data-inte
 parser.add_argument('-a', '--apiurl', help='address of the API e.g. "https://host.localdomain.com/api:4321"', required=True, type=str, dest='apiurl')
 parser.add_argument('-s', '--secret-file', help='file path containing the k8s secret for the API', required=True, type=str, dest='secret_path')
 parser.add_argument('-c', '--cacert', help='file path containing CA Cert for API', required=True, type=str, dest='cacert')
+parser.add_argument('--protobuf', help='LIST core resources as protobuf instead of JSON', required=False, action='store_true', dest='protobuf')
 parser.add_argument('-p', '--isprimary', help='Defaults to false, but add this flag if this is the the primary cluster running babylon and babylon-ui', required=False, action='store_true', dest='isprimary')
+monitor_timings.add_arguments(parser)
 args = parser.parse_args()
+monitor_timings.start(args)
 
 # setup the client
-# apikey = Path('/path/to/my/secret/token').read_text()
-apikey = Path(args.secret_path).read_text()
-aConfig = kubernetes.client.Configuration()
-aConfig.api_key = {"authorization": "Bearer " + apikey}
-aConfig.host = args.apiurl
-# aConfig.host = "https://my.ocp.babylon.cluster:6443"
-# aConfig.ssl_ca_cert = '/path/to/my/cluster.crt'
-aConfig.ssl_ca_cert = args.cacert
-aApiClient = kubernetes.client.ApiClient(aConfig)
+aApiClient = kube_client.api_client(args.apiurl, args.secret_path, args.cacert)
 # ocp_client = DynamicClient(aApiClient)
-custom_objects_api = kubernetes.client.CustomObjectsApi(aApiClient)
-v1 = kubernetes.client.CoreV1Api(aApiClient)
+monitor_timings.phase('evaluate')
 
 # Pull all resources required
 # custom_resources = ocp_client.resources.get(api_version='apiextensions.k8s.io/v1beta1', kind='CustomResourceDefinition')
-# usergroupmembers = custom_objects_api.list_cluster_custom_object('usergroup.pfe.redhat.com', 'v1', 'usergroupmembers')['items']
+# usergroupmembers = kube_client.get_json(aApiClient, '/apis/usergroup.pfe.redhat.com/v1/usergroupmembers')['items']
 # projects = ocp_client.resources.get(api_version='project.openshift.io/v1', kind='Project')
 # project_list = projects.get().to_dict()
 namespace_dict = {}
@@ -63,22 +63,23 @@ identity_dict = {}
 rolebinding_dict = {}
 group_dict = {}
 #
-usernamespaces = custom_objects_api.list_cluster_custom_object('usernamespace.gpte.redhat.com', 'v1', 'usernamespaces')['items']
+usernamespaces = kube_client.get_json(aApiClient, '/apis/usernamespace.gpte.redhat.com/v1/usernamespaces')['items']
 ###
 # Process namespaces, rolebindings, users, identities, and groups into dicts
 ###
-namespaces = v1.list_namespace().to_dict()["items"]
+namespaces = kube_protobuf.get_list(aApiClient, '/api/v1/namespaces', kube_protobuf.phase_schema,
+                                    accept=kube_protobuf.protobuf_accept if args.protobuf else 'application/json')["items"]
 namespacecount = len(namespaces)
 for namespace in namespaces:
     namespace_dict[namespace["metadata"]["name"]] = ""
 del(namespaces)
 #
-rolebindings = custom_objects_api.list_cluster_custom_object('rbac.authorization.k8s.io', 'v1', 'rolebindings')['items']
+rolebindings = kube_client.get_json(aApiClient, '/apis/rbac.authorization.k8s.io/v1/rolebindings')['items']
 for rolebinding in rolebindings:
     rolebinding_dict[rolebinding["metadata"]["name"]] = ""
 del(rolebindings)
 #
-users = custom_objects_api.list_cluster_custom_object('user.openshift.io', 'v1', 'users')['items']
+users = kube_client.get_json(aApiClient, '/apis/user.openshift.io/v1/users')['items']
 for user in users:
     user_dict[user["metadata"]["name"]] = {}
     try:
@@ -97,7 +98,7 @@ for user in users:
         user_last_login_list.append(user["metadata"]["annotations"]['<annotation>/last-login'])
 del(users)
 #
-identities = custom_objects_api.list_cluster_custom_object('user.openshift.io', 'v1', 'identities')['items']
+identities = kube_client.get_json(aApiClient, '/apis/user.openshift.io/v1/identities')['items']
 for identity in identities:
     identity_dict[identity["metadata"]["name"]] = {}
     try:
@@ -108,7 +109,7 @@ for identity in identities:
         identity_dict[identity["metadata"]["name"]]["email"] = identity["extra"]["email"]
 del(identities)
 #
-groups = custom_objects_api.list_cluster_custom_object('user.openshift.io', 'v1', 'groups')['items']
+groups = kube_client.get_json(aApiClient, '/apis/user.openshift.io/v1/groups')['items']
 for group in groups:
     group_dict[group["metadata"]["name"]] = {}
     group_dict[group["metadata"]["name"]]["users"] = group["users"]
@@ -308,6 +309,7 @@ for user in userDS:
 if not args.isprimary:
     lastloginerror = False
 
+monitor_timings.phase('render')
 if errorcount == 0 and not lastloginerror:
     exitstring = "[OK] No Babylon Users in Error found; | namespaces=" + str(namespacecount) + ";;;;; users=" + str(usercount) + ";;;;; errors=" + str(errorcount) + ";;;;; "
     exitstring += os.linesep + last_login_error_string
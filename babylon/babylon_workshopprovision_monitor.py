@@ -8,9 +8,14 @@ output            :Nagios/Icinga2 format
 """
 
 import argparse
-import kubernetes
+import sys
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'common'))
+import monitor_shim  # noqa: E402,F401
+import kube_client  # noqa: E402
+import monitor_timings  # noqa: E402
+
 # Create the base Datastructure for our monitor
 # [{ username: {
 #    project: projectname,
@@ -27,22 +32,18 @@ parser = argparse.ArgumentParser(description='Monitor for Babylon WorkshopProvis
 parser.add_argument('-a', '--apiurl', help='address of the API e.g. "https://host.localdomain.com/api:4321"', required=True, type=str, dest='apiurl')
 parser.add_argument('-s', '--secret-file', help='file path containing the k8s secret for the API', required=True, type=str, dest='secret_path')
 parser.add_argument('-c', '--cacert', help='file path containing CA Cert for API', required=True, type=str, dest='cacert')
+monitor_timings.add_arguments(parser)
 args = parser.parse_args()
+monitor_timings.start(args)
 
 # setup the client
-apikey = Path(args.secret_path).read_text()
-aConfig = kubernetes.client.Configuration()
-aConfig.api_key = {"authorization": "Bearer " + apikey}
-aConfig.host = args.apiurl
-aConfig.ssl_ca_cert = args.cacert
-aApiClient = kubernetes.client.ApiClient(aConfig)
+aApiClient = kube_client.api_client(args.apiurl, args.secret_path, args.cacert)
 # ocp_client = DynamicClient(aApiClient)
-custom_objects_api = kubernetes.client.CustomObjectsApi(aApiClient)
-v1 = kubernetes.client.CoreV1Api(aApiClient)
+monitor_timings.phase('evaluate')
 
 
 workshopprovisions_in_error = []
-workshopprovisions = custom_objects_api.list_cluster_custom_object('babylon.gpte.redhat.com', 'v1', 'workshopprovisions')['items']
+workshopprovisions = kube_client.get_json(aApiClient, '/apis/babylon.gpte.redhat.com/v1/workshopprovisions')['items']
 
 for workshopprovision in workshopprovisions:
     try:
@@ -57,6 +58,7 @@ for workshopprovision in workshopprovisions:
 
 errorcount = len(workshopprovisions_in_error)
 
+monitor_timings.phase('render')
 if errorcount == 0:
     exitstring = "[OK] No Workshops in Error found; | workshops=" + str(len(workshopprovisions)) + ";;;;; errorworkshops=" + str(errorcount) + ";;;;; "
     print(exitstring)
@@ -0,0 +1,144 @@
+#! /usr/bin/python3
+
+"""
+description       :Compares kube_protobuf.py against JSON for LISTs of synthetic pods shaped like real ones (env vars,
+                   annotations, labels, volumes, managed fields). Builds the same list in both encodings and reports
+                   the bytes each puts on the wire and the time each takes to decode into the fields
+                   ocp_pod_limit_monitor.py reads: json.loads plus pruning for JSON, kube_protobuf.decode_list for protobuf.
+license           :Apache License v2
+usage             :benchmark_kube_protobuf.py --pods 1000,10000,50000
+"""
+
+import argparse
+import gzip
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import kube_protobuf  # noqa: E402
+
+parser = argparse.ArgumentParser(description='Benchmark protobuf against JSON decoding of pod LISTs')
+parser.add_argument('-p', '--pods', help='comma separated pod counts to run at', required=False, type=str, dest='pods', default='1000,10000,50000')
+parser.add_argument('-r', '--runs', help='decodes at each size, the best one is reported', required=False, type=int, dest='runs', default=3)
+args = parser.parse_args()
+
+
+def varint(value):
+    encoded = bytearray()
+    while value > 0x7f:
+        encoded.append((value & 0x7f) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return(bytes(encoded))
+
+
+# A length delimited field: strings, bytes and embedded messages
+def field(number, payload):
+    if isinstance(payload, str):
+        payload = payload.encode()
+    return(varint(number << 3 | 2) + varint(len(payload)) + payload)
+
+
+def varint_field(number, value):
+    return(varint(number << 3) + varint(value))
+
+
+def map_fields(number, mapping, quantity=False):
+    return(b''.join(field(number, field(1, key) + field(2, field(1, value) if quantity else value)) for key, value in mapping.items()))
+
+
+def timestamp(seconds):
+    return(time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(seconds)))
+
+
+# One pod as the API server would send it, as a JSON-ready dict and as protobuf bytes
+def synthetic_pod(index):
+    namespace = f"sandbox-{index % 700}-user"
+    name = f"workload-{index}-{random.randrange(16 ** 5):05x}"
+    created = 1700000000 + index
+    labels = {'app': f"workload-{index % 50}", 'pod-template-hash': f"{random.randrange(16 ** 8):08x}"}
+    annotations = {'openshift.io/scc': 'restricted-v2', 'k8s.v1.cni.cncf.io/network-status': '[{"name":"ovn-kubernetes","ips":["10.128.4.17"],"default":true}]' * 2}
+    containers = []
+    container_statuses = []
+    for number in range(2):
+        resources = {'limits': {'cpu': random.choice(['500m', '1', '2']), 'memory': random.choice(['512Mi', '1Gi', '2G'])},
+                     'requests': {'cpu': '100m', 'memory': '256Mi'}}
+        env = [{'name': f"SETTING_{variable}", 'value': 'x' * 24} for variable in range(12)]
+        containers.append({'name': f"c{number}", 'image': 'quay.io/example/workload:v1.2.3', 'env': env, 'resources': resources,
+                           'volumeMounts': [{'name': 'data', 'mountPath': '/data'}], 'terminationMessagePath': '/dev/termination-log'})
+        container_statuses.append({'name': f"c{number}", 'ready': True, 'restartCount': random.choice([0, 0, 0, 3, 250]),
+                                   'image': 'quay.io/example/workload:v1.2.3', 'imageID': 'quay.io/example/workload@sha256:' + 'a' * 64,
+                                   'containerID': 'cri-o://' + 'b' * 64, 'state': {'running': {'startedAt': timestamp(created + 30)}}})
+    pod = {'metadata': {'name': name, 'namespace': namespace, 'uid': f"{random.randrange(16 ** 32):032x}", 'resourceVersion': str(index),
+                        'creationTimestamp': timestamp(created), 'labels': labels, 'annotations': annotations,
+                        'managedFields': [{'manager': 'kubelet', 'operation': 'Update', 'fieldsV1': {'f:status': {'f:phase': {}}}}]},
+           'spec': {'containers': containers, 'nodeName': f"worker-{index % 60}", 'serviceAccountName': 'default',
+                    'volumes': [{'name': 'data', 'emptyDir': {}}]},
+           'status': {'phase': 'Running', 'podIP': '10.128.4.17', 'startTime': timestamp(created + 5), 'containerStatuses': container_statuses}}
+
+    def container_bytes(container):
+        return(field(1, container['name']) + field(2, container['image'])
+               + b''.join(field(7, field(1, variable['name']) + field(2, variable['value'])) for variable in container['env'])
+               + field(8, map_fields(1, container['resources']['limits'], True) + map_fields(2, container['resources']['requests'], True))
+               + field(9, field(1, 'data') + field(3, '/data')) + field(13, container['terminationMessagePath']))
+
+    def status_bytes(status):
+        return(field(1, status['name']) + field(2, field(2, field(1, varint_field(1, created + 30)))) + varint_field(4, 1)
+               + varint_field(5, status['restartCount']) + field(6, status['image']) + field(7, status['imageID']) + field(8, status['containerID']))
+
+    metadata = (field(1, name) + field(3, namespace) + field(5, pod['metadata']['uid']) + field(6, str(index))
+                + field(8, varint_field(1, created)) + map_fields(11, labels) + map_fields(12, annotations)
+                + field(17, field(1, 'kubelet') + field(2, 'Update') + field(7, json.dumps({'f:status': {'f:phase': {}}}))))
+    spec = (field(1, field(1, 'data') + field(2, field(2, b''))) + b''.join(field(2, container_bytes(container)) for container in containers)
+            + field(8, 'default') + field(10, pod['spec']['nodeName']))
+    status = (field(1, 'Running') + field(6, '10.128.4.17') + field(7, varint_field(1, created + 5))
+              + b''.join(field(8, status_bytes(container_status)) for container_status in container_statuses))
+    return(pod, field(1, metadata) + field(2, spec) + field(3, status))
+
+
+# The JSON path of ocp_pod_limit_monitor.py: decode everything, keep the fields the check reads
+def decode_json(data):
+    pods = []
+    for item in json.loads(data)['items']:
+        containers = [(container['name'], container.get('resources', {})) for container in item['spec']['containers']]
+        restarts = {status['name']: status.get('restartCount', 0) for status in item.get('status', {}).get('containerStatuses', [])}
+        pods.append((item['metadata']['namespace'], item['metadata']['name'], item['spec'].get('nodeName', ''), containers, restarts))
+    return(pods)
+
+
+# The protobuf path, pruned the same way
+def decode_protobuf(data):
+    pods = []
+    for item in kube_protobuf.decode_list(data, kube_protobuf.pod_resources_schema)['items']:
+        containers = [(container['name'], container.get('resources', {})) for container in item['spec']['containers']]
+        restarts = {status['name']: status.get('restartCount', 0) for status in item.get('status', {}).get('containerStatuses', [])}
+        pods.append((item['metadata']['namespace'], item['metadata']['name'], item['spec'].get('nodeName', ''), containers, restarts))
+    return(pods)
+
+
+def best_time(decoder, data):
+    best = None
+    for run in range(args.runs):
+        started = time.perf_counter()
+        result = decoder(data)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return(best, result)
+
+
+random.seed(1)
+print(f"{'pods':>7} {'json MB':>8} {'gzip MB':>8} {'pb MB':>8} {'pb gz MB':>8} {'json s':>8} {'pb s':>8}")
+for count in (int(pods) for pods in args.pods.split(',')):
+    items, encoded = zip(*(synthetic_pod(index) for index in range(count)))
+    json_data = json.dumps({'kind': 'PodList', 'apiVersion': 'v1', 'metadata': {'resourceVersion': '1'}, 'items': list(items)}).encode()
+    pod_list = field(1, field(2, '1')) + b''.join(field(2, pod) for pod in encoded)
+    protobuf_data = kube_protobuf.magic + field(1, field(1, 'v1') + field(2, 'PodList')) + field(2, pod_list) + field(4, 'application/vnd.kubernetes.protobuf')
+    json_time, json_pods = best_time(decode_json, json_data)
+    protobuf_time, protobuf_pods = best_time(decode_protobuf, protobuf_data)
+    if json_pods != protobuf_pods:
+        sys.exit(f"protobuf and JSON decodes of {count} pods differ")
+    print(f"{count:>7} {len(json_data) / 1048576:>8.1f} {len(gzip.compress(json_data, 1)) / 1048576:>8.1f} {len(protobuf_data) / 1048576:>8.1f} "
+          f"{len(gzip.compress(protobuf_data, 1)) / 1048576:>8.1f} {json_time:>8.2f} {protobuf_time:>8.2f}")
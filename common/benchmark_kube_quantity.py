@@ -0,0 +1,85 @@
+#! /usr/bin/python3
+
+"""
+description       :Compares kube_quantity.py against the regex and if/elif converters ocp_pod_limit_monitor.py used
+                   before it, on conversions drawn from quantity strings common in pod specs. Only strings both can
+                   parse are used: the old converters reject fractional CPUs, nanocores and most suffixes.
+license           :Apache License v2
+usage             :benchmark_kube_quantity.py --conversions 400000
+"""
+
+import argparse
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import kube_quantity  # noqa: E402
+
+parser = argparse.ArgumentParser(description='Benchmark the quantity parser against the converters it replaced')
+parser.add_argument('-n', '--conversions', help='number of conversions to time', required=False, type=int, dest='conversions', default=400000)
+parser.add_argument('-r', '--runs', help='timed runs of each, the best one is reported', required=False, type=int, dest='runs', default=3)
+args = parser.parse_args()
+
+memory_strings = ['128Mi', '256Mi', '1Gi', '512M', '2G']
+cpu_strings = ['100m', '500m', '1', '2']
+
+# The converters as they were before kube_quantity.py
+old_unit_split_re = re.compile(r'^(\d+(?:\.\d+)?)([iA-Z]+)$')
+
+
+def old_memory_to_bytes(memory_string):
+    my_conversion_ratio = 1
+    my_re_result = old_unit_split_re.match(str(memory_string))
+    if my_re_result:
+        my_unit_tuple = my_re_result.groups()
+        if my_unit_tuple[1] == "Ki":
+            my_conversion_ratio = 1024
+        elif my_unit_tuple[1] == "K":
+            my_conversion_ratio = 1000
+        elif my_unit_tuple[1] == "Mi":
+            my_conversion_ratio = 1048576
+        elif my_unit_tuple[1] == "M":
+            my_conversion_ratio = 1000000
+        elif my_unit_tuple[1] == "Gi":
+            my_conversion_ratio = 1073741824
+        elif my_unit_tuple[1] == "G":
+            my_conversion_ratio = 1000000000
+        elif my_unit_tuple[1] == "Ti":
+            my_conversion_ratio = 1099511627776
+        elif my_unit_tuple[1] == "T":
+            my_conversion_ratio = 1000000000000
+        my_return_value = float(my_unit_tuple[0]) * float(my_conversion_ratio)
+    else:
+        my_return_value = int(memory_string)
+    return(int(my_return_value))
+
+
+def old_cpu_to_milli(cpu_string):
+    unit_string = str(cpu_string)
+    if unit_string[-1] == "m":
+        return(int(unit_string[:-1]))
+    return(int(int(unit_string) * 1000))
+
+
+def best_time(memory_converter, cpu_converter, work):
+    best = None
+    for run in range(args.runs):
+        started = time.perf_counter()
+        results = [memory_converter(quantity) if is_memory else cpu_converter(quantity) for is_memory, quantity in work]
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return(best, results)
+
+
+random.seed(1)
+work = [(True, random.choice(memory_strings)) if random.random() < 0.5 else (False, random.choice(cpu_strings)) for conversion in range(args.conversions)]
+old_time, old_results = best_time(old_memory_to_bytes, old_cpu_to_milli, work)
+new_time, new_results = best_time(kube_quantity.convert_ocp_container_memory_units_to_bytes, kube_quantity.convert_ocp_container_cpu_units_to_milli, work)
+if old_results != new_results:
+    sys.exit("old and new converters disagree")
+print(f"{args.conversions} conversions of {len(memory_strings) + len(cpu_strings)} strings")
+print(f"  before: {old_time * 1000:.0f} ms")
+print(f"  after:  {new_time * 1000:.0f} ms")
@@ -0,0 +1,75 @@
+#! /usr/bin/python3
+
+"""
+description       :Kubernetes API clients for the monitors, built once per API URL, token and CA cert.
+                   Every monitor reads its token, sets up TLS and sizes its connection pool the same way here, and asks
+                   for gzip compressed responses. A monitor run in-process by monitor_daemon.py gets back the client,
+                   and the kept-alive TLS connections, of the previous run against the same cluster.
+license           :Apache License v2
+usage             :import kube_client; aApiClient = kube_client.api_client(args.apiurl, args.secret_path, args.cacert)
+"""
+
+import json
+from pathlib import Path
+
+import kubernetes
+import urllib3
+
+import monitor_timings
+
+# Connections kept open per client. The monitors make their calls one after another, a few at most run in parallel.
+default_pool_size = 4
+
+# ApiClients built so far, keyed by (apiurl, token, cacert, verify_ssl)
+clients = {}
+
+
+# Read a service account token, without the trailing newline most secret files end with
+def read_token(secret_path):
+    return(Path(secret_path).read_text().strip())
+
+
+# Open the first connection to the API, TLS handshake included, before any request goes out on it.
+# Only done for --timings, so the handshake shows up as connect time instead of in the first fetch.
+def connect(client):
+    pool = client.rest_client.pool_manager.connection_from_url(client.configuration.host)
+    connection = pool._get_conn()
+    connection.connect()
+    pool._put_conn(connection)
+
+
+# Return the ApiClient for this cluster and token, building it on first use.
+# The CA cert is always used to verify the API's certificate, unless verify_ssl is False.
+def api_client(apiurl, secret_path, cacert, verify_ssl=True, pool_size=default_pool_size):
+    token = read_token(secret_path)
+    key = (apiurl, token, cacert, verify_ssl)
+    client = clients.get(key)
+    if client is None:
+        aConfig = kubernetes.client.Configuration()
+        aConfig.api_key = {"authorization": "Bearer " + token}
+        aConfig.host = apiurl
+        aConfig.ssl_ca_cert = cacert
+        aConfig.verify_ssl = verify_ssl
+        aConfig.connection_pool_maxsize = pool_size
+        if not verify_ssl:
+            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        client = kubernetes.client.ApiClient(aConfig)
+        # The API server only compresses responses big enough to be worth it, in practice the LISTs.
+        # urllib3 decompresses them transparently, for _preload_content=False responses too.
+        client.set_default_header('Accept-Encoding', 'gzip')
+        clients[key] = client
+        if monitor_timings.enabled:
+            connect(client)
+    return(client)
+
+
+# GET path (e.g. a LIST of custom objects) as a decoded dict, without building any kubernetes model objects
+# The body is read in the fetch phase and decoded in the decode phase.
+def get_json(api_client, path, query_params=None):
+    previous = monitor_timings.phase('fetch')
+    data = api_client.call_api(path, 'GET', query_params=query_params or [], header_params={'Accept': 'application/json'},
+                               auth_settings=['BearerToken'], _preload_content=False, _return_http_data_only=True).data
+    monitor_timings.phase('decode')
+    decoded = json.loads(data)
+    monitor_timings.phase(previous)
+    return(decoded)
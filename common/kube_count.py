@@ -0,0 +1,70 @@
+#! /usr/bin/python3
+
+"""
+description       :Count-only sizing of Kubernetes collections for monitors which only need to know how many objects a LIST would return.
+                   Asks the API for a single item and reads metadata.remainingItemCount, falling back to paging through metadata-only lists.
+license           :Apache License v2
+usage             :import kube_count; kube_count.count_objects(api_client, '/api/v1/namespaces')
+"""
+
+import json
+
+import kube_protobuf
+import monitor_timings
+
+# Page size used when the server does not report remainingItemCount and we have to page
+fallback_page_size = 500
+
+# Accept header asking the server for object metadata only, with plain JSON as the fallback
+metadata_only_accept = 'application/json;as=PartialObjectMetadataList;g=meta.k8s.io;v=v1,application/json'
+
+
+# Pull one page of a LIST as a decoded dict, without building any kubernetes model objects
+# A protobuf page only has its list metadata decoded, the items are just counted.
+def get_page(api_client, path, query_params, accept):
+    if accept.startswith('application/vnd.kubernetes.protobuf'):
+        return(kube_protobuf.get_list(api_client, path, kube_protobuf.count_schema, query_params, accept))
+    previous = monitor_timings.phase('fetch')
+    response = api_client.call_api(path, 'GET', query_params=query_params, header_params={'Accept': accept},
+                                   auth_settings=['BearerToken'], _preload_content=False, _return_http_data_only=True)
+    data = response.data
+    monitor_timings.phase('decode')
+    page = json.loads(data)
+    monitor_timings.phase(previous)
+    return(page)
+
+
+# Count from the first page alone, if it can be known from it
+# Returns None if the rest of the list has to be paged through
+def count_from_first_page(page):
+    count = len(page["items"])
+    if not page["metadata"].get("continue"):
+        return(count)
+    if page["metadata"].get("remainingItemCount") is not None:
+        return(count + int(page["metadata"]["remainingItemCount"]))
+    return(None)
+
+
+# Count the objects a LIST of path (e.g. '/api/v1/namespaces') would return.
+# The server never sets remainingItemCount for lists with a label or field selector
+# (and older servers may not set it at all), in which case we page through
+# metadata-only lists and count the items.
+# With protobuf the pages are asked for as protobuf, which the server encodes and sends more cheaply.
+def count_objects(api_client, path, label_selector=None, protobuf=False):
+    if not label_selector:
+        count = count_from_first_page(get_page(api_client, path, [('limit', 1)], kube_protobuf.protobuf_accept if protobuf else 'application/json'))
+        if count is not None:
+            return(count)
+    count = 0
+    continue_token = None
+    while True:
+        query_params = [('limit', fallback_page_size)]
+        if label_selector:
+            query_params.append(('labelSelector', label_selector))
+        if continue_token:
+            query_params.append(('continue', continue_token))
+        page = get_page(api_client, path, query_params, kube_protobuf.metadata_only_accept if protobuf else metadata_only_accept)
+        count += len(page["items"])
+        continue_token = page["metadata"].get("continue")
+        if not continue_token:
+            return(count)
@@ -0,0 +1,97 @@
+#! /usr/bin/python3
+
+"""
+description       :Coalesces identical LISTs made by monitors running at the same time. The first monitor to ask for a
+                   collection fetches it while holding a file lock, and saves the response. Monitors asking for the same
+                   collection (same API URL, token, group, version, namespace, plural and label selector) wait on that
+                   lock and then read the saved response for as long as it is younger than the TTL, so the API server
+                   sees one LIST per collection per TTL however many checks Icinga starts in the same second.
+                   Saved responses live in a directory only the monitoring user can read, by default under /tmp,
+                   or in RHDP_MONITOR_CACHE_DIR if that is set.
+license           :Apache License v2
+usage             :import kube_list_cache
+                   kube_list_cache.list_objects(aApiClient, 'poolboy.gpte.redhat.com', 'v1', 'resourcehandles', ttl=10)['items']
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import monitor_timings
+
+# Seconds a saved LIST is shared for, unless a monitor asks otherwise
+default_ttl = 10
+
+# Environment variable overriding where saved LISTs are kept
+cache_dir_variable = 'RHDP_MONITOR_CACHE_DIR'
+
+
+# The directory saved LISTs are kept in, created private to us if need be
+# Returns None if it exists but is not ours alone, so we never read or write responses someone else can change
+def cache_dir():
+    path = os.environ.get(cache_dir_variable) or os.path.join(tempfile.gettempdir(), f'rhdp-monitoring-{os.getuid()}')
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    except OSError:
+        return(None)
+    status = os.lstat(path)
+    if status.st_uid != os.getuid() or status.st_mode & 0o077 or not os.path.isdir(path) or os.path.islink(path):
+        return(None)
+    return(path)
+
+
+# API path of a LIST, core group ('') included
+def list_path(group, version, plural, namespace=None):
+    path = f'/apis/{group}/{version}' if group else f'/api/{version}'
+    if namespace:
+        path += f'/namespaces/{namespace}'
+    return(f'{path}/{plural}')
+
+
+# Fetch a LIST from the API server as the raw JSON body
+def fetch(api_client, path, label_selector):
+    query_params = [('labelSelector', label_selector)] if label_selector else []
+    response = api_client.call_api(path, 'GET', query_params=query_params, header_params={'Accept': 'application/json'},
+                                   auth_settings=['BearerToken'], _preload_content=False, _return_http_data_only=True)
+    return(response.data)
+
+
+# LIST a collection, sharing the response with other monitors asking for the same one within ttl seconds
+# Returns the decoded list, as CustomObjectsApi.list_cluster_custom_object would. A ttl of 0 always fetches.
+def list_objects(api_client, group, version, plural, namespace=None, label_selector=None, ttl=default_ttl):
+    path = list_path(group, version, plural, namespace)
+    directory = cache_dir() if ttl > 0 else None
+    previous = monitor_timings.phase('fetch')
+    if directory is None:
+        data = fetch(api_client, path, label_selector)
+    else:
+        data = fetch_shared(api_client, path, label_selector, ttl, directory)
+    monitor_timings.phase('decode')
+    decoded = json.loads(data)
+    monitor_timings.phase(previous)
+    return(decoded)
+
+
+# The raw JSON body of a LIST, from a response saved by another monitor within ttl seconds or fetched and saved for them
+def fetch_shared(api_client, path, label_selector, ttl, directory):
+    # The token is part of the key, different service accounts may be allowed to see different objects
+    key = json.dumps([api_client.configuration.host, api_client.configuration.api_key.get('authorization'), path, label_selector])
+    base = os.path.join(directory, hashlib.sha256(key.encode()).hexdigest())
+    with open(base + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if time.time() - os.stat(base + '.json').st_mtime < ttl:
+                with open(base + '.json', 'rb') as saved:
+                    return(saved.read())
+        except OSError:
+            pass
+        data = fetch(api_client, path, label_selector)
+        with tempfile.NamedTemporaryFile(dir=directory, delete=False) as saved:
+            saved.write(data)
+        os.replace(saved.name, base + '.json')
+        return(data)
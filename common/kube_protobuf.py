@@ -0,0 +1,152 @@
+#! /usr/bin/python3
+
+"""
+description       :LISTs of core Kubernetes types (pods, namespaces, PVCs, PVs) in the API server's protobuf encoding
+                   (application/vnd.kubernetes.protobuf), which is smaller on the wire and cheaper for the server to
+                   encode than JSON. Only the fields a monitor names in its schema are decoded, everything else is
+                   skipped by length without being looked at. The result has the same shape as the JSON list
+                   (camelCase keys, RFC 3339 timestamps), holding just those fields, so monitors can use either.
+                   Written against the protobuf wire format directly, so no protobuf library or generated code is needed.
+license           :Apache License v2
+usage             :import kube_protobuf
+                   kube_protobuf.get_list(aApiClient, '/api/v1/namespaces', kube_protobuf.phase_schema)['items']
+"""
+
+import json
+import time
+
+import monitor_timings
+
+# Accept header for protobuf, with JSON as the fallback for servers or types which can't do it
+protobuf_accept = 'application/vnd.kubernetes.protobuf,application/json'
+
+# Accept header for metadata-only protobuf lists (PartialObjectMetadataList), with JSON as the fallback
+metadata_only_accept = 'application/vnd.kubernetes.protobuf;as=PartialObjectMetadataList;g=meta.k8s.io;v=v1,application/json'
+
+# Every protobuf response starts with these four bytes, followed by a runtime.Unknown holding the object
+magic = b'k8s\x00'
+
+# Field kinds a schema can ask for
+STRING = 0
+VARINT = 1
+MESSAGE = 2
+REPEATED = 3
+TIME = 4
+QUANTITY_MAP = 5
+RAW = 6
+
+# Schemas map protobuf field numbers (from k8s.io/api/core/v1/generated.proto and
+# k8s.io/apimachinery/pkg/apis/meta/v1/generated.proto) to (JSON name, kind, schema of a message field)
+time_schema = {1: ('seconds', VARINT, None)}
+quantity_map_entry_schema = {1: ('key', STRING, None), 2: ('value', MESSAGE, {1: ('string', STRING, None)})}
+unknown_schema = {2: ('raw', RAW, None)}
+list_meta_schema = {3: ('continue', STRING, None), 4: ('remainingItemCount', VARINT, None)}
+object_meta_schema = {1: ('name', STRING, None), 3: ('namespace', STRING, None), 8: ('creationTimestamp', TIME, None)}
+
+# Name, namespace, creation time and status.phase, for Namespaces, PersistentVolumeClaims, PersistentVolumes and Pods
+phase_schema = {1: ('metadata', MESSAGE, object_meta_schema), 3: ('status', MESSAGE, {1: ('phase', STRING, None)})}
+
+# What ocp_pod_limit_monitor.py reads of a Pod: the containers' resources and restart counts
+resource_requirements_schema = {1: ('limits', QUANTITY_MAP, None), 2: ('requests', QUANTITY_MAP, None)}
+pod_resources_schema = {
+    1: ('metadata', MESSAGE, object_meta_schema),
+    2: ('spec', MESSAGE, {2: ('containers', REPEATED, {1: ('name', STRING, None), 8: ('resources', MESSAGE, resource_requirements_schema)}),
+                          10: ('nodeName', STRING, None)}),
+    3: ('status', MESSAGE, {8: ('containerStatuses', REPEATED, {1: ('name', STRING, None), 5: ('restartCount', VARINT, None)})}),
+}
+
+# Nothing of the items, for counting them
+count_schema = {}
+
+
+# Read a base 128 varint at pos, returning its value and the position after it
+def read_varint(data, pos):
+    result = data[pos]
+    pos += 1
+    if result < 0x80:
+        return(result, pos)
+    result &= 0x7f
+    shift = 7
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return(result, pos)
+        shift += 7
+
+
+# Decode the fields of the message in data[pos:end] which schema names into a dict, skipping the rest
+def decode(data, pos, end, schema):
+    decoded = {}
+    while pos < end:
+        # Keys and lengths almost always fit in one byte, so only call read_varint when they don't
+        key = data[pos]
+        pos += 1
+        if key >= 0x80:
+            key, pos = read_varint(data, pos - 1)
+        wire_type = key & 7
+        if wire_type == 2:
+            length = data[pos]
+            pos += 1
+            if length >= 0x80:
+                length, pos = read_varint(data, pos - 1)
+            start = pos
+            pos += length
+        elif wire_type == 0:
+            value, pos = read_varint(data, pos)
+        elif wire_type == 1:
+            pos += 8
+            continue
+        elif wire_type == 5:
+            pos += 4
+            continue
+        else:
+            raise ValueError(f"unsupported protobuf wire type {wire_type}")
+        field = schema.get(key >> 3)
+        if field is None:
+            continue
+        name, kind, field_schema = field
+        if kind == VARINT:
+            decoded[name] = value
+        elif kind == STRING:
+            decoded[name] = data[start:pos].decode()
+        elif kind == MESSAGE:
+            decoded[name] = decode(data, start, pos, field_schema)
+        elif kind == REPEATED:
+            decoded.setdefault(name, []).append(decode(data, start, pos, field_schema))
+        elif kind == TIME:
+            decoded[name] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(decode(data, start, pos, time_schema).get('seconds', 0)))
+        elif kind == QUANTITY_MAP:
+            entry = decode(data, start, pos, quantity_map_entry_schema)
+            decoded.setdefault(name, {})[entry.get('key', '')] = entry.get('value', {}).get('string', '')
+        elif kind == RAW:
+            decoded[name] = (start, pos)
+    return(decoded)
+
+
+# Decode a protobuf LIST response body, items reduced to item_schema
+def decode_list(data, item_schema):
+    if not data.startswith(magic):
+        raise ValueError("response is not a Kubernetes protobuf object")
+    start, end = decode(data, len(magic), len(data), unknown_schema).get('raw', (0, 0))
+    page = decode(data, start, end, {1: ('metadata', MESSAGE, list_meta_schema), 2: ('items', REPEATED, item_schema)})
+    page.setdefault('metadata', {})
+    page.setdefault('items', [])
+    return(page)
+
+
+# LIST path (e.g. '/api/v1/pods') asking for protobuf, as a dict shaped like the JSON list
+# The server answers in JSON for types it has no protobuf encoding for, which is returned whole.
+def get_list(api_client, path, item_schema, query_params=None, accept=protobuf_accept):
+    previous = monitor_timings.phase('fetch')
+    response = api_client.call_api(path, 'GET', query_params=query_params or [], header_params={'Accept': accept},
+                                   auth_settings=['BearerToken'], _preload_content=False, _return_http_data_only=True)
+    data = response.data
+    monitor_timings.phase('decode')
+    if response.headers.get('Content-Type', '').startswith('application/json'):
+        page = json.loads(data)
+    else:
+        page = decode_list(data, item_schema)
+    monitor_timings.phase(previous)
+    return(page)
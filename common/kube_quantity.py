@@ -0,0 +1,75 @@
+#! /usr/bin/python3
+
+"""
+description       :Kubernetes resource quantities ("1.5Gi", "250m", "1e3", "250000000n") as exact numbers, following the
+                   quantity grammar of k8s.io/apimachinery/pkg/api/resource. The byte and millicore conversions round up
+                   as Kubernetes does, and are cached since the same few quantity strings repeat across every container.
+license           :Apache License v2
+usage             :import kube_quantity
+                   kube_quantity.convert_ocp_container_memory_units_to_bytes('1.5Gi')
+                   kube_quantity.convert_ocp_container_cpu_units_to_milli('250m')
+"""
+
+import functools
+import re
+from decimal import Decimal, ROUND_CEILING
+
+# Size of the quantity caches below. The same few hundred quantity strings repeat
+# across every container in the cluster, so this comfortably holds all of them.
+quantity_cache_size = 4096
+
+# Pre-compile our quantity splitter for OCP, following the Kubernetes quantity grammar:
+#   <quantity>        ::= <signedNumber><suffix>
+#   <number>          ::= <digits> | <digits>.<digits> | <digits>. | .<digits>
+#   <suffix>          ::= <binarySI> | <decimalExponent> | <decimalSI>
+#   <decimalExponent> ::= "e" <signedNumber> | "E" <signedNumber>
+# This matches "1.1Gi", "500m", "0.5", ".5", "1e3", "12E" (exa) and "-1k",
+# but not "1,000Gi" or "1.1.1Gi"
+# Kubernetes itself rejects "1K", but ocp_pod_limit_monitor.py always read it as 1000, so it still does
+quantity_split_re = re.compile(r'^([+-]?(?:\d+(?:\.\d*)?|\.\d+))(?:(Ki|Mi|Gi|Ti|Pi|Ei|n|u|m|k|K|M|G|T|P|E)|[eE]([+-]?\d+))?$')
+
+# Multiplier for every suffix the grammar allows (an empty suffix is a plain number)
+quantity_suffix_multipliers = {
+    "": Decimal(1),
+    "n": Decimal("1e-9"),
+    "u": Decimal("1e-6"),
+    "m": Decimal("1e-3"),
+    "k": Decimal("1e3"),
+    "K": Decimal("1e3"),
+    "M": Decimal("1e6"),
+    "G": Decimal("1e9"),
+    "T": Decimal("1e12"),
+    "P": Decimal("1e15"),
+    "E": Decimal("1e18"),
+    "Ki": Decimal(2 ** 10),
+    "Mi": Decimal(2 ** 20),
+    "Gi": Decimal(2 ** 30),
+    "Ti": Decimal(2 ** 40),
+    "Pi": Decimal(2 ** 50),
+    "Ei": Decimal(2 ** 60),
+}
+
+
+# Parse a Kubernetes quantity string (e.g. "1.5Gi", "250m", "1e3") into an exact Decimal
+# Raises ValueError for anything outside of the quantity grammar
+@functools.lru_cache(maxsize=quantity_cache_size)
+def parse_ocp_quantity(quantity_string):
+    my_re_result = quantity_split_re.match(str(quantity_string))
+    if not my_re_result:
+        raise ValueError(f'Invalid quantity: {quantity_string}')
+    number, suffix, exponent = my_re_result.groups()
+    if exponent is not None:
+        return(Decimal(number).scaleb(int(exponent)))
+    return(Decimal(number) * quantity_suffix_multipliers[suffix or ""])
+
+
+# Memory quantities in bytes, rounded up to a whole byte as Kubernetes does
+@functools.lru_cache(maxsize=quantity_cache_size)
+def convert_ocp_container_memory_units_to_bytes(memory_string):
+    return(int(parse_ocp_quantity(memory_string).to_integral_value(rounding=ROUND_CEILING)))
+
+
+# CPU quantities in millicores (1000th of a CPU unit), rounded up as Kubernetes does
+@functools.lru_cache(maxsize=quantity_cache_size)
+def convert_ocp_container_cpu_units_to_milli(cpu_string):
+    return(int((parse_ocp_quantity(cpu_string) * 1000).to_integral_value(rounding=ROUND_CEILING)))
@@ -0,0 +1,191 @@
+#! /usr/bin/python3
+
+"""
+description       :Resident runner for the Python monitors. Imports kubernetes and the other heavy modules once, then
+                   forks a pool of workers which run monitors in-process on request from monitor_shim.py, each worker
+                   keeping its kube_client clients (and their TLS connections) warm between runs.
+                   Only the monitors in this repository's monitor directories are run, and the socket is only open to
+                   its owner and group.
+license           :Apache License v2
+usage             :monitor_daemon.py --socket /run/rhdp-monitoring/monitor.sock --workers 4
+                   with RHDP_MONITOR_SOCKET=/run/rhdp-monitoring/monitor.sock in the environment Icinga runs checks with
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import runpy
+import signal
+import socket
+import sys
+import traceback
+from pathlib import Path
+
+# Monitors run here must not relay to a daemon again
+os.environ.pop('RHDP_MONITOR_SOCKET', None)
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import monitor_shim  # noqa: E402,F401
+import monitor_timings  # noqa: E402
+
+parser = argparse.ArgumentParser(description='Run the Python monitors in warm worker processes for monitor_shim.py')
+parser.add_argument('-S', '--socket', help='path of the Unix socket to listen on', required=True, type=str, dest='socket')
+parser.add_argument('-w', '--workers', help='number of worker processes, i.e. monitors run at once', required=False, type=int, default=4, dest='workers')
+parser.add_argument('-t', '--timeout', help='seconds a monitor may run before it is reported UNKNOWN, keep it below the shim\'s answer timeout', required=False, type=int, default=50, dest='timeout')
+parser.add_argument('-m', '--max-requests', help='monitor runs after which a worker is replaced with a fresh one', required=False, type=int, default=1000, dest='max_requests')
+args = parser.parse_args()
+
+# The repository this daemon is part of, the only place monitors are run from
+repository = Path(__file__).resolve().parent.parent
+
+# Directories of the repository monitors are run from. Daemons, benchmarks and fakes live next to some of them,
+# so a script must also import monitor_shim to count as a monitor.
+monitor_directories = ('anarchy', 'babylon', 'poolboy', 'openshift', 'ansible', 'vmware')
+
+# Imported before forking so every worker shares them. Missing ones are left to the monitors to report.
+preload_modules = ['kubernetes', 'urllib3', 'requests', 'numpy', 'tabulate', 'kube_client', 'kube_count', 'kube_list_cache', 'kube_protobuf', 'kube_quantity', 'ring_file']
+
+
+# Not an Exception, so a monitor's own "except Exception" can't swallow it and run on past the timeout
+class MonitorTimeout(BaseException):
+    pass
+
+
+def alarm(signum, frame):
+    raise MonitorTimeout()
+
+
+# True if script (a resolved path) is one of the monitors, which are the only scripts run for a shim
+def is_monitor(script):
+    path = Path(script)
+    if path.suffix != '.py' or path.parent.parent != repository or path.parent.name not in monitor_directories or not path.is_file():
+        return(False)
+    return(any(line.startswith('import monitor_shim') for line in path.read_text(errors='replace').splitlines()))
+
+
+# Read the one-line JSON request a shim sends
+def read_request(connection):
+    chunks = []
+    while True:
+        chunk = connection.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        if chunk.endswith(b'\n'):
+            break
+    return(json.loads(b''.join(chunks)))
+
+
+# Run one monitor as __main__ with the shim's arguments and working directory
+# Returns its exit code, stdout and stderr as the monitor would have produced them standalone
+def run_monitor(script, argv, cwd):
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    saved_argv = sys.argv
+    saved_path = list(sys.path)
+    saved_cwd = os.getcwd()
+    sys.argv = [script] + argv
+    try:
+        os.chdir(cwd)
+        signal.alarm(args.timeout)
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            try:
+                runpy.run_path(script, run_name='__main__')
+                exit_code = 0
+            except SystemExit as e:
+                if e.code is None:
+                    exit_code = 0
+                elif isinstance(e.code, int):
+                    exit_code = e.code
+                else:
+                    print(e.code, file=sys.stderr)
+                    exit_code = 1
+            except MonitorTimeout:
+                print(f"[UNKNOWN] {os.path.basename(script)} did not finish within {args.timeout}s")
+                exit_code = 3
+            except Exception:
+                traceback.print_exc()
+                exit_code = 1
+            # Workers never exit between runs, so --timings and --profile are finished here rather than at exit
+            monitor_timings.finish()
+    finally:
+        signal.alarm(0)
+        sys.argv = saved_argv
+        sys.path[:] = saved_path
+        os.chdir(saved_cwd)
+    return(exit_code, stdout.getvalue(), stderr.getvalue())
+
+
+# Answer one shim connection
+def serve(connection):
+    with connection:
+        try:
+            request = read_request(connection)
+            script = os.path.realpath(request['script'])
+            if not is_monitor(script):
+                raise ValueError(f"{request['script']} is not a monitor in {repository}")
+            exit_code, stdout, stderr = run_monitor(script, list(request['argv']), request['cwd'])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            exit_code, stdout, stderr = 3, f"[UNKNOWN] monitor_daemon.py could not run the request: {e}\n", ''
+        try:
+            connection.sendall(json.dumps({'exit': exit_code, 'stdout': stdout, 'stderr': stderr}).encode())
+        except OSError:
+            pass
+
+
+# Serve shims until max_requests monitors have run, then exit for the parent to replace us
+def worker(listener):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGALRM, alarm)
+    sys.stdin = open(os.devnull)
+    for request_count in range(args.max_requests):
+        connection, address = listener.accept()
+        serve(connection)
+    os._exit(0)
+
+
+def start_worker(listener):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            worker(listener)
+        finally:
+            os._exit(1)
+    return(pid)
+
+
+def stop(signum, frame):
+    sys.exit(0)
+
+
+for module in preload_modules:
+    try:
+        __import__(module)
+    except ImportError:
+        pass
+
+if os.path.exists(args.socket):
+    os.unlink(args.socket)
+# Only the owner and group (the monitoring user) may connect
+os.umask(0o117)
+listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+listener.bind(args.socket)
+listener.listen(128)
+signal.signal(signal.SIGTERM, stop)
+
+workers = set()
+try:
+    while True:
+        while len(workers) < args.workers:
+            workers.add(start_worker(listener))
+        pid, status = os.wait()
+        workers.discard(pid)
+finally:
+    for pid in workers:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    listener.close()
+    os.unlink(args.socket)
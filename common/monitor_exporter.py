@@ -0,0 +1,197 @@
+#! /usr/bin/python3
+
+"""
+description       :Prometheus exporter for the monitors. Runs each configured check in the background on its own
+                   interval, and serves what its last run found on /metrics: its Nagios state, every value in its
+                   perfdata (error counts, totals, capacity) and the gauges it reports through monitor_metrics.py
+                   (availability per pool, utilisation per host). Scrapes are answered with the page rendered when the
+                   last run finished, so how long they take does not depend on the size of the clusters being checked.
+license           :Apache License v2
+usage             :monitor_exporter.py --config /etc/rhdp-monitoring/exporter.json --port 9469
+                   with checks configured as
+                   {"checks": [{"name": "pools", "script": "babylon/babylon_pools_monitor.py", "interval": 120,
+                                "args": ["-a", "https://api.cluster:6443", "-s", "/etc/rhdp/token", "-c", "/etc/rhdp/ca.crt"]}]}
+                   where script is relative to this repository, and interval and timeout are optional seconds
+"""
+
+import argparse
+import http.server
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+parser = argparse.ArgumentParser(description='Serve the results of the Python monitors as Prometheus metrics')
+parser.add_argument('-c', '--config', help='JSON file listing the checks to run', required=True, type=str, dest='config')
+parser.add_argument('-b', '--bind', help='address to listen on', required=False, type=str, default='', dest='bind')
+parser.add_argument('-p', '--port', help='port to listen on', required=False, type=int, default=9469, dest='port')
+parser.add_argument('-i', '--interval', help='seconds between runs of checks which do not set their own interval', required=False, type=int, default=60, dest='interval')
+args = parser.parse_args()
+
+# The repository this exporter is part of, check scripts are relative to it
+repository = Path(__file__).resolve().parent.parent
+
+# Prefix of every metric served
+prefix = 'rhdp_'
+
+# HELP text of the metrics every check has
+help_texts = {
+    'rhdp_monitor_up': '1 if the last run of the check gave a Nagios state other than UNKNOWN',
+    'rhdp_monitor_state': 'Nagios exit code of the last run of the check (0 OK, 1 WARNING, 2 CRITICAL, 3 UNKNOWN)',
+    'rhdp_monitor_perfdata': 'Perfdata values of the last run of the check, by perfdata label, times and sizes in seconds and bytes',
+    'rhdp_monitor_run_duration_seconds': 'Seconds the last run of the check took',
+    'rhdp_monitor_last_run_timestamp_seconds': 'Unix time the last run of the check finished',
+}
+
+# One perfdata value, 'label'=value[UOM];warn;crit;min;max, of which only the label, value and UOM are used
+perfdata_re = re.compile(r"('(?:[^']|'')+'|[^\s=']+)=(-?[0-9]*\.?[0-9]+(?:[eE][-+]?[0-9]+)?)([a-zA-Z%]*)")
+
+# Perfdata units scaled to the base units Prometheus expects, anything else is served as it is
+unit_scales = {'ms': 0.001, 'us': 0.000001, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4}
+
+# Per check {metric name: [sample lines]} from its last run, and the page rendered from all of them
+results = {}
+page = b''
+results_lock = threading.Lock()
+
+
+# Escape a label value for the exposition format
+def label_value(value):
+    return(value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+
+
+def sample(name, labels, value):
+    return('{}{{{}}} {!r}'.format(name, ','.join(f'{key}="{label_value(label)}"' for key, label in labels.items()), float(value)))
+
+
+# Perfdata of a plugin's output: after the | on the first line, and on any later line starting with one
+def parse_perfdata(output):
+    values = []
+    for number, line in enumerate(output.splitlines()):
+        if '|' not in line or (number > 0 and not line.startswith('|')):
+            continue
+        for label, value, unit in perfdata_re.findall(line.split('|', 1)[1]):
+            if label.startswith("'"):
+                label = label[1:-1].replace("''", "'")
+            values.append((label, float(value) * unit_scales.get(unit, 1)))
+    return(values)
+
+
+# Run a check once, returning its samples by metric name
+def run_check(check):
+    started = time.monotonic()
+    with tempfile.TemporaryDirectory() as directory:
+        metrics_path = os.path.join(directory, 'metrics.json')
+        # Run standalone rather than through monitor_daemon.py, which would not pass the metrics file on
+        env = dict(os.environ, RHDP_MONITOR_METRICS_FILE=metrics_path)
+        env.pop('RHDP_MONITOR_SOCKET', None)
+        try:
+            completed = subprocess.run([sys.executable, check['script']] + check['args'], cwd=repository, env=env, stdin=subprocess.DEVNULL,
+                                       stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=check['timeout'])
+            output = completed.stdout.decode(errors='replace')
+            # A check which printed nothing never got as far as a state, whatever it exited with (argparse errors exit 2)
+            exit_code = completed.returncode if completed.returncode in (0, 1, 2) and output.strip() else 3
+        except (OSError, subprocess.TimeoutExpired):
+            exit_code = 3
+            output = ''
+        try:
+            with open(metrics_path) as f:
+                gauges = json.load(f)
+        except (OSError, ValueError):
+            gauges = {}
+    check_labels = {'check': check['name']}
+    samples = {
+        'rhdp_monitor_up': [sample('rhdp_monitor_up', check_labels, exit_code != 3)],
+        'rhdp_monitor_state': [sample('rhdp_monitor_state', check_labels, exit_code)],
+        'rhdp_monitor_run_duration_seconds': [sample('rhdp_monitor_run_duration_seconds', check_labels, time.monotonic() - started)],
+        'rhdp_monitor_last_run_timestamp_seconds': [sample('rhdp_monitor_last_run_timestamp_seconds', check_labels, time.time())],
+        'rhdp_monitor_perfdata': [sample('rhdp_monitor_perfdata', dict(check_labels, label=label), value) for label, value in parse_perfdata(output)],
+    }
+    for name, gauge_samples in gauges.items():
+        samples[prefix + name] = [sample(prefix + name, dict(check_labels, **labels), value) for labels, value in gauge_samples]
+    return(samples)
+
+
+# The /metrics page, each metric's samples from every check together under its one HELP and TYPE
+def render_page():
+    metrics = {}
+    for name in sorted(results):
+        for metric, lines in results[name].items():
+            metrics.setdefault(metric, []).extend(lines)
+    page_lines = []
+    for metric in sorted(metrics):
+        if metric in help_texts:
+            page_lines.append(f'# HELP {metric} {help_texts[metric]}')
+        page_lines.append(f'# TYPE {metric} gauge')
+        page_lines.extend(metrics[metric])
+    return(('\n'.join(page_lines) + '\n').encode())
+
+
+# Run a check every interval seconds, from the start of one run to the start of the next, for as long as we run
+def refresh(check):
+    global page
+    while True:
+        started = time.monotonic()
+        samples = run_check(check)
+        with results_lock:
+            results[check['name']] = samples
+            page = render_page()
+        time.sleep(max(check['interval'] - (time.monotonic() - started), 0))
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = page
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Scrapes come every few seconds, don't log them
+    def log_message(self, format, *log_args):
+        pass
+
+
+# Read the checks to run, filling in the defaults
+def read_config(path):
+    checks = []
+    names = set()
+    for check in json.loads(Path(path).read_text())['checks']:
+        if check['name'] in names:
+            raise ValueError(f"more than one check is named {check['name']}")
+        names.add(check['name'])
+        interval = check.get('interval', args.interval)
+        checks.append({
+            'name': check['name'],
+            'script': str(repository / check['script']),
+            'args': [str(arg) for arg in check.get('args', [])],
+            'interval': interval,
+            # A run still going when the next is due is given up on
+            'timeout': check.get('timeout', interval),
+        })
+    return(checks)
+
+
+try:
+    checks = read_config(args.config)
+except (OSError, ValueError, KeyError, TypeError) as e:
+    parser.error(f"could not read {args.config}: {e}")
+
+for check in checks:
+    threading.Thread(target=refresh, args=(check,), name=check['name'], daemon=True).start()
+
+server = http.server.ThreadingHTTPServer((args.bind, args.port), MetricsHandler)
+server.daemon_threads = True
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    pass
@@ -0,0 +1,41 @@
+#! /usr/bin/python3
+
+"""
+description       :Gauges a monitor reports to monitor_exporter.py on top of its Nagios perfdata, for values there are too
+                   many of to put in the perfdata, such as one per pool or one per host. A monitor run by the exporter
+                   finds the file to write them to in RHDP_MONITOR_METRICS_FILE, and writes them there as JSON when it
+                   exits. Run any other way, recording a gauge returns straight away.
+license           :Apache License v2
+usage             :import monitor_metrics
+                   monitor_metrics.gauge('babylon_pool_available', available, pool=pool_name)
+"""
+
+import atexit
+import json
+import os
+
+# Environment variable monitor_exporter.py passes the file to write the gauges to in
+metrics_file_variable = 'RHDP_MONITOR_METRICS_FILE'
+
+metrics_file = os.environ.get(metrics_file_variable)
+enabled = bool(metrics_file)
+
+# Gauges recorded so far, {name: [[labels, value], ...]}
+gauges = {}
+
+
+# Record one sample of the gauge name, labelled with labels
+def gauge(name, value, **labels):
+    if not enabled:
+        return
+    gauges.setdefault(name, []).append([{key: str(label) for key, label in labels.items()}, float(value)])
+
+
+# Write the gauges recorded for the exporter to read once the monitor has exited
+def write():
+    with open(metrics_file, 'w') as f:
+        json.dump(gauges, f)
+
+
+if enabled:
+    atexit.register(write)
@@ -0,0 +1,63 @@
+#! /usr/bin/python3
+
+"""
+description       :Hands a monitor run over to monitor_daemon.py when one is listening, so the monitor runs in a process
+                   that already has kubernetes imported and a warm client for the cluster.
+                   Imported at the top of each monitor, before its heavy imports. When RHDP_MONITOR_SOCKET names the
+                   daemon's socket, the monitor's arguments are sent there and this process prints the daemon's output
+                   and exits with its exit code. Without the variable, or with no daemon taking the request, the import
+                   does nothing and the monitor runs as it always has, so Icinga command definitions stay the same either
+                   way. Once the daemon has the request the monitor is never run a second time here: a daemon that
+                   doesn't answer in time is reported as UNKNOWN.
+license           :Apache License v2
+usage             :sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'common'))
+                   import monitor_shim  # noqa: E402
+"""
+
+import json
+import os
+import socket
+import sys
+
+# Environment variable naming the daemon's Unix socket
+socket_variable = 'RHDP_MONITOR_SOCKET'
+
+# Seconds to wait for the daemon's answer, below Icinga's default 60s check timeout so we can still report.
+# The daemon times monitors out (--timeout, 50s by default) before this.
+answer_timeout = 55
+
+
+# Ask the daemon at socket_path to run script with argv from our working directory
+# Returns the daemon's answer, or None if no daemon took the request
+def relay(socket_path, script, argv):
+    request = json.dumps({'script': script, 'argv': argv, 'cwd': os.getcwd()}).encode() + b'\n'
+    sent = False
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.settimeout(answer_timeout)
+            connection.connect(socket_path)
+            connection.sendall(request)
+            sent = True
+            connection.shutdown(socket.SHUT_WR)
+            chunks = []
+            while True:
+                chunk = connection.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        return(json.loads(b''.join(chunks)))
+    except (OSError, ValueError) as e:
+        # The daemon may already have run the monitor, so running it again here could act twice
+        if sent:
+            return({'exit': 3, 'stdout': f"[UNKNOWN] monitor_daemon.py took the request but gave no answer: {e}\n", 'stderr': ''})
+        return(None)
+
+
+socket_path = os.environ.get(socket_variable)
+if socket_path:
+    answer = relay(socket_path, os.path.abspath(sys.argv[0]), sys.argv[1:])
+    if answer is not None:
+        sys.stdout.write(answer['stdout'])
+        sys.stderr.write(answer['stderr'])
+        sys.stdout.flush()
+        sys.exit(answer['exit'])
@@ -0,0 +1,84 @@
+#! /usr/bin/python3
+
+"""
+description       :Per-phase timings and profiling for the monitors. With --timings a monitor appends how long it spent
+                   connecting, fetching, decoding, evaluating and rendering its output as Nagios perfdata, on a last
+                   "| timing_connect=...s ..." line after its own output. With --profile FILE it also writes a
+                   cProfile/pstats dump of the run for offline analysis (python3 -m pstats FILE).
+                   Monitors mark where their phases start. The shared fetch helpers mark fetch and decode themselves and
+                   switch back to whichever phase the caller was in. Without either flag nothing is timed, and marking a
+                   phase returns straight away.
+license           :Apache License v2
+usage             :monitor_timings.add_arguments(parser); args = parser.parse_args(); monitor_timings.start(args)
+                   ...; monitor_timings.phase('evaluate'); ...; monitor_timings.phase('render'); print(...)
+"""
+
+import atexit
+import sys
+import time
+
+# Phases reported, in order. All of them are always reported, so the perfdata labels don't come and go.
+phase_names = ('connect', 'fetch', 'decode', 'evaluate', 'render')
+
+enabled = False
+timings = {}
+current = None
+current_started = 0.0
+profiler = None
+profile_path = None
+exit_hook_registered = False
+
+
+def add_arguments(parser):
+    parser.add_argument('--timings', help='append per-phase durations (connect, fetch, decode, evaluate, render) as perfdata', required=False, action='store_true', dest='timings')
+    parser.add_argument('--profile', help='write a cProfile/pstats dump of the run to this file', required=False, type=str, dest='profile')
+
+
+# Start timing (and profiling) this run if asked to, in the connect phase
+def start(args):
+    global enabled, timings, current, current_started, profiler, profile_path, exit_hook_registered
+    if not (args.timings or args.profile):
+        return
+    enabled = args.timings
+    timings = dict.fromkeys(phase_names, 0.0)
+    current = 'connect'
+    current_started = time.perf_counter()
+    if args.profile:
+        import cProfile
+        profile_path = args.profile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    # monitor_daemon.py calls finish() itself after each run, standalone runs finish on the way out
+    if not exit_hook_registered:
+        atexit.register(finish)
+        exit_hook_registered = True
+
+
+# Switch to phase name, returning the phase we were in so helpers can switch back to it
+def phase(name):
+    global current, current_started
+    if not enabled or name is None:
+        return(None)
+    now = time.perf_counter()
+    timings[current] += now - current_started
+    previous = current
+    current = name
+    current_started = now
+    return(previous)
+
+
+# Print the timings perfdata and write the profile, once per run
+def finish():
+    global enabled, current, profiler, profile_path
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(profile_path)
+        profiler = None
+        profile_path = None
+    if not enabled:
+        return
+    phase(current)
+    enabled = False
+    current = None
+    print("| " + " ".join(f"timing_{name}={timings[name]:.3f}s;;;0;" for name in phase_names))
+    sys.stdout.flush()
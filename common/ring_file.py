@@ -0,0 +1,65 @@
+#! /usr/bin/python3
+
+"""
+description       :Fixed-size ring of fixed-size binary records kept in a small local file, for monitors which need a short history between runs.
+                   Reading and appending always touch the same number of bytes, however long the monitor has been running.
+license           :Apache License v2
+usage             :ring = ring_file.RingFile('/var/tmp/namespaces.ring', '<dI', 256); ring.append((time.time(), count)); ring.read()
+"""
+
+import fcntl
+import os
+import struct
+
+# magic, record format length, slot count, records written so far
+ring_header = struct.Struct('<4sIIQ')
+ring_magic = b'RNG1'
+
+
+class RingFile(object):
+    def __init__(self, path, record_format, slots):
+        self.path = path
+        self.record = struct.Struct(record_format)
+        self.format_bytes = record_format.encode()
+        self.slots = slots
+
+    # Open (creating if needed) the ring file, locked for the caller, and return the
+    # file descriptor and the count of records written so far.
+    # A file written with a different record format or slot count is started over.
+    def _open(self, lock):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, lock)
+        header = os.pread(fd, ring_header.size + len(self.format_bytes), 0)
+        written = 0
+        if len(header) == ring_header.size + len(self.format_bytes):
+            magic, format_length, slots, written = ring_header.unpack(header[:ring_header.size])
+            if magic != ring_magic or format_length != len(self.format_bytes) or slots != self.slots or header[ring_header.size:] != self.format_bytes:
+                written = 0
+        return(fd, written)
+
+    def _record_offset(self, slot):
+        return(ring_header.size + len(self.format_bytes) + slot * self.record.size)
+
+    # Return the records in the ring, oldest first
+    def read(self):
+        fd, written = self._open(fcntl.LOCK_SH)
+        try:
+            count = min(written, self.slots)
+            data = os.pread(fd, count * self.record.size, self._record_offset(0))
+        finally:
+            os.close(fd)
+        if len(data) < count * self.record.size:
+            return([])
+        records = [self.record.unpack_from(data, slot * self.record.size) for slot in range(count)]
+        # Once the ring has wrapped, the oldest record is the one in the next slot to be written
+        start = written % self.slots if written > self.slots else 0
+        return(records[start:] + records[:start])
+
+    # Add a record, overwriting the oldest one once the ring is full
+    def append(self, values):
+        fd, written = self._open(fcntl.LOCK_EX)
+        try:
+            os.pwrite(fd, self.record.pack(*values), self._record_offset(written % self.slots))
+            os.pwrite(fd, ring_header.pack(ring_magic, len(self.format_bytes), self.slots, written + 1) + self.format_bytes, 0)
+        finally:
+            os.close(fd)
@@ -0,0 +1,66 @@
+#! /usr/bin/python3
+
+"""
+description       :Tests kube_quantity.py against the Kubernetes quantity grammar, valid and invalid forms.
+license           :Apache License v2
+usage             :python3 -m unittest common/test_kube_quantity.py, or python3 -m pytest common
+"""
+
+import sys
+import unittest
+from decimal import Decimal
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import kube_quantity  # noqa: E402
+
+
+class ParseQuantityTest(unittest.TestCase):
+    def test_valid_forms(self):
+        for quantity, expected in [
+            ('1.5Gi', Decimal(3 * 2 ** 29)),
+            ('.5Ki', Decimal(512)),
+            ('5.', Decimal(5)),
+            ('+5', Decimal(5)),
+            ('-1k', Decimal(-1000)),
+            ('1K', Decimal(1000)),
+            ('0.5', Decimal('0.5')),
+            ('1e-3', Decimal('0.001')),
+            ('1E3', Decimal(1000)),
+            ('1E', Decimal(10 ** 18)),
+            ('12E', Decimal(12 * 10 ** 18)),
+            ('250000000n', Decimal('0.25')),
+            ('1500u', Decimal('0.0015')),
+            ('500m', Decimal('0.5')),
+            ('2Ei', Decimal(2 ** 61)),
+            ('1Pi', Decimal(2 ** 50)),
+            ('3T', Decimal(3 * 10 ** 12)),
+            ('1073741824', Decimal(2 ** 30)),
+        ]:
+            with self.subTest(quantity=quantity):
+                self.assertEqual(kube_quantity.parse_ocp_quantity(quantity), expected)
+
+    def test_invalid_forms(self):
+        for quantity in ['1,000Gi', '1.1.1Gi', '1 Gi', '1Kib', '1e', '1e3.5', 'Gi', '', '.', '1mi', '0x10']:
+            with self.subTest(quantity=quantity):
+                with self.assertRaises(ValueError):
+                    kube_quantity.parse_ocp_quantity(quantity)
+
+
+class ConvertQuantityTest(unittest.TestCase):
+    def test_memory_bytes(self):
+        self.assertEqual(kube_quantity.convert_ocp_container_memory_units_to_bytes('128Mi'), 128 * 2 ** 20)
+        self.assertEqual(kube_quantity.convert_ocp_container_memory_units_to_bytes('2G'), 2 * 10 ** 9)
+        # Fractions of a byte round up
+        self.assertEqual(kube_quantity.convert_ocp_container_memory_units_to_bytes('1500m'), 2)
+
+    def test_cpu_millicores(self):
+        self.assertEqual(kube_quantity.convert_ocp_container_cpu_units_to_milli('250m'), 250)
+        self.assertEqual(kube_quantity.convert_ocp_container_cpu_units_to_milli('2'), 2000)
+        self.assertEqual(kube_quantity.convert_ocp_container_cpu_units_to_milli('0.5'), 500)
+        # Nanocores from the metrics API round up to the next millicore
+        self.assertEqual(kube_quantity.convert_ocp_container_cpu_units_to_milli('250000001n'), 251)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+#! /usr/bin/python3
+
+"""
+description       :Runs ocp_pod_limit_monitor.py against fake_kube_pods_api.py at several cluster sizes and reports wall time,
+                   CPU time, peak RSS and the requests and megabytes the check asked the API for at each size.
+                   --monitor runs another copy of the check instead, e.g. the version before pod LIST streaming:
+                   git show 0bbe240~1:openshift/ocp_pod_limit_monitor.py > /tmp/ocp_pod_limit_monitor_before.py
+license           :Apache License v2
+usage             :benchmark_ocp_pod_limit_monitor.py --pods 2000,20000 [--monitor /tmp/ocp_pod_limit_monitor_before.py]
+"""
+
+import argparse
+import json
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+here = Path(__file__).resolve().parent
+
+parser = argparse.ArgumentParser(description="Benchmark ocp_pod_limit_monitor.py against a fake Kubernetes API.")
+parser.add_argument('--pods', type=str, required=False, default='2000,20000', help="Comma separated pod counts to run at.")
+parser.add_argument('--runs', type=int, required=False, default=3, help="Runs of the check at each size, the best one is reported.")
+parser.add_argument('--port', type=int, required=False, default=18081, help="Port for the fake API.")
+parser.add_argument('--monitor', type=str, required=False, default=str(here / 'ocp_pod_limit_monitor.py'), help="Path of the check to run.")
+parser.add_argument('--check_args', type=str, required=False, default='', help="Extra arguments for the check, e.g. \"--protobuf\".")
+args = parser.parse_args()
+
+
+def fake_stats():
+    with urllib.request.urlopen(f'http://127.0.0.1:{args.port}/stats') as response:
+        return json.load(response)
+
+
+# Run the check once, returning its exit code, wall seconds, CPU seconds and peak RSS in MB from wait4
+def run_check(token_path, cacert_path):
+    command = [sys.executable, args.monitor, '-a', f'http://127.0.0.1:{args.port}', '-s', token_path, '-c', cacert_path] + shlex.split(args.check_args)
+    # Run standalone, a monitor_daemon.py worker would answer for it
+    environment = {name: value for name, value in os.environ.items() if name != 'RHDP_MONITOR_SOCKET'}
+    started = time.monotonic()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=environment)
+    pid, status, usage = os.wait4(process.pid, 0)
+    wall = time.monotonic() - started
+    return os.WEXITSTATUS(status), wall, usage.ru_utime + usage.ru_stime, usage.ru_maxrss / 1024
+
+
+with tempfile.TemporaryDirectory() as work_directory:
+    token_path = os.path.join(work_directory, 'token')
+    cacert_path = os.path.join(work_directory, 'ca.crt')
+    # No trailing newline, versions of the check before kube_client.py send the file as it is
+    Path(token_path).write_text('benchmark')
+    # Not read over plain http, but the check requires one
+    Path(cacert_path).write_text('')
+    print(f"{'pods':>7} {'exit':>4} {'wall s':>8} {'cpu s':>8} {'rss MB':>8} {'requests':>8} {'MB sent':>8}")
+    for pod_count in (int(count) for count in args.pods.split(',')):
+        fake = subprocess.Popen([sys.executable, str(here / 'fake_kube_pods_api.py'), '--port', str(args.port), '--pods', str(pod_count)],
+                                stdout=subprocess.PIPE, universal_newlines=True)
+        try:
+            # The fake prints one line once it is listening
+            if not fake.stdout.readline():
+                sys.exit(f"fake_kube_pods_api.py did not start on port {args.port}")
+            best = None
+            for run in range(args.runs):
+                before = fake_stats()
+                exit_code, wall, cpu, rss = run_check(token_path, cacert_path)
+                after = fake_stats()
+                result = (wall, exit_code, cpu, rss, after['requests'] - before['requests'], (after['bytes_sent'] - before['bytes_sent']) / 1048576)
+                if best is None or result < best:
+                    best = result
+            wall, exit_code, cpu, rss, requests_made, sent = best
+            print(f"{pod_count:>7} {exit_code:>4} {wall:>8.2f} {cpu:>8.2f} {rss:>8.1f} {requests_made:>8} {sent:>8.1f}")
+        finally:
+            fake.terminate()
+            fake.wait()
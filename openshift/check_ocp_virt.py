@@ -7,24 +7,30 @@ license           :Apache License v2
 output            :Nagios/Icinga2 format
 """
 
-import urllib3
 import argparse
-import kubernetes
+import sys
 from pathlib import Path
 from datetime import datetime, timezone
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'common'))
+import monitor_shim  # noqa: E402,F401
+import kube_client  # noqa: E402
+import kube_protobuf  # noqa: E402
+import monitor_timings  # noqa: E402
+
 # Setup the date object for now for future checks
 time_now = datetime.now(timezone.utc)
 
-# Suppress only the InsecureRequestWarning from urllib3 since python doesn't like OCP/K8s' self-signed cluster certs
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
 # Initialize argument parser
 parser = argparse.ArgumentParser(description='Monitor for OCP Virt and Volumes')
 parser.add_argument('-a', '--apiurl', help='address of the API e.g. "https://host.localdomain.com/api:4321"', required=True, type=str, dest='apiurl')
 parser.add_argument('-s', '--secret-file', help='file path containing the k8s secret for the API', required=True, type=str, dest='secret_path')
 parser.add_argument('-c', '--cacert', help='file path containing CA Cert for API', required=True, type=str, dest='cacert')
+parser.add_argument('--protobuf', help='LIST core resources as protobuf instead of JSON', required=False, action='store_true', dest='protobuf')
+parser.add_argument('--insecure', help='do not verify the API certificate against --cacert', required=False, action='store_true', dest='insecure')
+monitor_timings.add_arguments(parser)
 args = parser.parse_args()
+monitor_timings.start(args)
 
 # Function to fetch and store the SSL certificate
 # import ssl
@@ -44,21 +50,15 @@ args = parser.parse_args()
 # fetch_and_store_cert(args.apiurl, args.caceron.total_seconds(t)
 
 # Setup the Kubernetes client
-apikey = Path(args.secret_path).read_text().strip()
-aConfig = kubernetes.client.Configuration()
-aConfig.api_key = {"authorization": "Bearer " + apikey}
-aConfig.host = args.apiurl
-aConfig.ssl_ca_cert = args.cacert
-aConfig.verify_ssl = False
-aApiClient = kubernetes.client.ApiClient(aConfig)
-custom_objects_api = kubernetes.client.CustomObjectsApi(aApiClient)
-v1 = kubernetes.client.CoreV1Api(aApiClient)
+aApiClient = kube_client.api_client(args.apiurl, args.secret_path, args.cacert, verify_ssl=not args.insecure)
+monitor_timings.phase('evaluate')
+core_accept = kube_protobuf.protobuf_accept if args.protobuf else 'application/json'
 
 
 # Pull and return the list of Namespaces in the cluster
 def get_namespaces():
-    namespaces = v1.list_namespace().items
-    return [ns.metadata.name for ns in namespaces]
+    namespaces = kube_protobuf.get_list(aApiClient, '/api/v1/namespaces', kube_protobuf.phase_schema, accept=core_accept)['items']
+    return [ns['metadata']['name'] for ns in namespaces]
 
 
 # Pull and return the list of Virtual machines in a specific namespace
@@ -67,21 +67,21 @@ def get_virtual_machines(namespace):
     group = 'kubevirt.io'
     version = 'v1'
     plural = 'virtualmachines'
-    vms = custom_objects_api.list_namespaced_custom_object(group, version, namespace, plural)['items']
+    vms = kube_client.get_json(aApiClient, f'/apis/{group}/{version}/namespaces/{namespace}/{plural}')['items']
     return vms
 
 
 # Pull all PVCs in a namespace
 # Return the PVC objects
 def get_pvcs(namespace):
-    pvcs = v1.list_namespaced_persistent_volume_claim(namespace).items
+    pvcs = kube_protobuf.get_list(aApiClient, f'/api/v1/namespaces/{namespace}/persistentvolumeclaims', kube_protobuf.phase_schema, accept=core_accept)['items']
     return pvcs
 
 
 # Pull all PVs in the cluster
 # Return the PV objects
 def get_pvs():
-    pvs = v1.list_persistent_volume().items
+    pvs = kube_protobuf.get_list(aApiClient, '/api/v1/persistentvolumes', kube_protobuf.phase_schema, accept=core_accept)['items']
     return pvs
 
 
@@ -102,8 +102,8 @@ def check_vm_status(vm):
 # Get a PVC Object, obtain it's status, the last date for a change known as datetime, and age as timedelta from now
 # Return a string, datetime object, and timedelta
 def check_pvc_status(pvc):
-    status = pvc.status.phase
-    last_transition_time = pvc.metadata.creation_timestamp
+    status = pvc.get('status', {}).get('phase')
+    last_transition_time = datetime.strptime(pvc['metadata']['creationTimestamp'].replace('Z', '+0000'), '%Y-%m-%dT%H:%M:%S%z')
     age = time_now - last_transition_time
     return status, last_transition_time, age
 
@@ -111,8 +111,8 @@ def check_pvc_status(pvc):
 # Get a PV Object, obtain it's status, the last date for a change known as datetime, and age as timedelta from now
 # Return a string, datetime object, and timedelta
 def check_pv_status(pv):
-    status = pv.status.phase
-    last_transition_time = pv.metadata.creation_timestamp
+    status = pv.get('status', {}).get('phase')
+    last_transition_time = datetime.strptime(pv['metadata']['creationTimestamp'].replace('Z', '+0000'), '%Y-%m-%dT%H:%M:%S%z')
     age = time_now - last_transition_time
     return status, last_transition_time, age
 
@@ -177,7 +177,7 @@ def main():
                 vm_aged.append((vm_name, namespace, vm_status, age, format_age(age)))
 
         for pvc in pvcs[namespace]:
-            pvc_name = pvc.metadata.name
+            pvc_name = pvc['metadata']['name']
             pvc_status, last_transition_time, age = check_pvc_status(pvc)
             pvc_total += 1
             if pvc_status != "Bound" and age.total_seconds() > 1800:
@@ -185,7 +185,7 @@ def main():
                 pvc_errors.append((pvc_name, namespace, pvc_status, age, format_age(age)))
 
     for pv in pvs:
-        pv_name = pv.metadata.name
+        pv_name = pv['metadata']['name']
         pv_status, last_transition_time, age = check_pv_status(pv)
         pv_total += 1
         if pv_status != "Bound" and age.total_seconds() > 1800:
@@ -198,6 +198,7 @@ def main():
     pvc_errors.sort(key=lambda x: x[3], reverse=True)
     pv_errors.sort(key=lambda x: x[2], reverse=True)
 
+    monitor_timings.phase('render')
     if not vm_errors and not pvc_errors and not pv_errors:
         print("[OK] - All VMs, PVCs, and PVs are in a healthy state")
         exit(0)
@@ -0,0 +1,115 @@
+#! /usr/bin/python3
+
+"""
+description       :Local stand-in for the parts of the Kubernetes API ocp_pod_limit_monitor.py reads, serving a generated
+                   cluster of pods shaped like real ones (env vars, annotations, two containers each) and their metrics,
+                   so the check can be tried and benchmarked without a real cluster. Answers the pod LIST, cluster wide
+                   or as list_namespaced_pod("") asks for it, and the metrics.k8s.io pod LIST, in JSON with limit/continue
+                   paging and gzip when asked for, and counts requests at GET /stats. Any token is accepted.
+                   Quantities stick to the forms the check's converters understood before kube_quantity.py (usage in
+                   millicores rather than the nanocores real metrics carry), so older versions of the check run too.
+license           :Apache License v2
+usage             :fake_kube_pods_api.py --port 8080 --pods 20000 ; then run the check with -a http://127.0.0.1:8080
+"""
+
+import argparse
+import gzip
+import json
+import random
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+parser = argparse.ArgumentParser(description="Fake Kubernetes API serving generated pods and pod metrics.")
+parser.add_argument('--port', type=int, required=False, default=8080, help="Port to listen on, on 127.0.0.1.")
+parser.add_argument('--pods', type=int, required=False, default=2000, help="Number of pods.")
+parser.add_argument('--namespaces', type=int, required=False, default=300, help="Number of namespaces the pods are spread over.")
+args = parser.parse_args()
+
+# The API server only compresses responses bigger than this
+gzip_min_bytes = 131072
+
+stats = {'requests': 0, 'bytes_sent': 0}
+stats_lock = threading.Lock()
+
+
+def generate(pod_count):
+    random.seed(1)
+    pods = []
+    metrics = []
+    for index in range(pod_count):
+        namespace = f"ns-{index % args.namespaces}"
+        name = f"pod-{index}"
+        containers = []
+        statuses = []
+        usage = []
+        for number in range(2):
+            containers.append({'name': f"c{number}", 'image': 'quay.io/example/workload:latest',
+                               'env': [{'name': f"SETTING_{variable}", 'value': 'v' * 30} for variable in range(10)],
+                               'resources': {'limits': {'cpu': random.choice(['500m', '1', '2']), 'memory': random.choice(['512Mi', '1Gi', '2G'])},
+                                             'requests': {'cpu': '100m', 'memory': '256Mi'}}})
+            statuses.append({'name': f"c{number}", 'restartCount': random.choice([0, 0, 0, 250]), 'ready': True, 'image': 'quay.io/example/workload:latest',
+                             'imageID': 'quay.io/example/workload@sha256:' + 'a' * 64, 'state': {'running': {'startedAt': '2024-01-01T00:00:00Z'}}})
+            usage.append({'name': f"c{number}", 'usage': {'cpu': f"{random.randint(1, 3000)}m", 'memory': f"{random.randint(1000, 3000000)}Ki"}})
+        pods.append({'metadata': {'namespace': namespace, 'name': name, 'uid': f"{index:036d}", 'creationTimestamp': '2024-01-01T00:00:00Z',
+                                  'labels': {'app': f"workload-{index % 50}"}, 'annotations': {'openshift.io/scc': 'restricted-v2', 'note': 'x' * 200}},
+                     'spec': {'containers': containers, 'nodeName': f"node-{index % 50}", 'volumes': [{'name': 'data', 'emptyDir': {}}]},
+                     'status': {'phase': 'Running', 'containerStatuses': statuses}})
+        metrics.append({'metadata': {'namespace': namespace, 'name': name}, 'containers': usage})
+    return(pods, metrics)
+
+
+pods, pod_metrics = generate(args.pods)
+
+
+# One page of items, continuing from the index the previous page's continue token names
+def page(items, query):
+    limit = int(query.get('limit', ['0'])[0])
+    start = int(query.get('continue', ['0'])[0] or 0)
+    metadata = {'resourceVersion': '1'}
+    if limit and start + limit < len(items):
+        metadata['continue'] = str(start + limit)
+        metadata['remainingItemCount'] = len(items) - start - limit
+        items = items[start:start + limit]
+    else:
+        items = items[start:]
+    return({'kind': 'List', 'apiVersion': 'v1', 'metadata': metadata, 'items': items})
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *log_args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path in ('/api/v1/pods', '/api/v1/namespaces//pods'):
+            body = page(pods, query)
+        elif url.path == '/apis/metrics.k8s.io/v1beta1/pods':
+            body = page(pod_metrics, query)
+        elif url.path == '/stats':
+            with stats_lock:
+                body = dict(stats)
+        else:
+            self.send_error(404)
+            return
+        data = json.dumps(body).encode()
+        compress = 'gzip' in self.headers.get('Accept-Encoding', '') and len(data) > gzip_min_bytes
+        if compress:
+            data = gzip.compress(data, 1)
+        if url.path != '/stats':
+            with stats_lock:
+                stats['requests'] += 1
+                stats['bytes_sent'] += len(data)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if compress:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+server = ThreadingHTTPServer(('127.0.0.1', args.port), Handler)
+print(f"Serving {len(pods)} pods on http://127.0.0.1:{args.port}", flush=True)
+server.serve_forever()
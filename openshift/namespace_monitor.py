@@ -8,51 +8,108 @@ output            :Nagios/Icinga2 format
 """
 
 import argparse
-import kubernetes
+import sys
+import time
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'common'))
+import monitor_shim  # noqa: E402,F401
+import kube_client  # noqa: E402
+import kube_count  # noqa: E402
+import ring_file  # noqa: E402
+import monitor_timings  # noqa: E402
+
 # Set Limits for our checks
 #
 max_namespaces = 10000
+# Number of (timestamp, count) samples kept in the forecast file
+forecast_slots = 256
+# Fewest samples in the window we will fit a growth rate to
+forecast_min_samples = 3
+
+
+# Least-squares growth rate (namespaces per second) of (timestamp, count) samples
+# Returns None if there are too few samples, or they were all taken at the same time
+def growth_rate(samples):
+    if len(samples) < forecast_min_samples:
+        return(None)
+    mean_time = sum(sample[0] for sample in samples) / len(samples)
+    mean_count = sum(sample[1] for sample in samples) / len(samples)
+    time_variance = sum((sample[0] - mean_time) ** 2 for sample in samples)
+    if time_variance == 0:
+        return(None)
+    return(sum((sample[0] - mean_time) * (sample[1] - mean_count) for sample in samples) / time_variance)
+
 
 parser = argparse.ArgumentParser(description='Monitor for count of OCP/K8s cluster namespaces against the engineering limit')
 parser.add_argument('-a', '--apiurl', help='address of the API e.g. "https://host.localdomain.com/api:4321"', required=True, type=str, dest='apiurl')
 parser.add_argument('-s', '--secret-file', help='file path containing the k8s secret for the API', required=True, type=str, dest='secret_path')
 parser.add_argument('-c', '--cacert', help='file path containing CA Cert for API', required=True, type=str, dest='cacert')
+parser.add_argument('--protobuf', help='LIST core resources as protobuf instead of JSON', required=False, action='store_true', dest='protobuf')
 parser.add_argument('-w', '--warning', help='number of namespaces in-use which constitutes warning status', required=True, type=int, dest='warningcount')
 parser.add_argument('-r', '--critical', help='number of namespaces in-use which constitutes critical status', required=True, type=int, dest='criticalcount')
 parser.add_argument('-m', '--max', help='engineering limit of the cluster - beyond this the cluster begins to fail', required=True, type=int, dest='maxcount')
+parser.add_argument('-f', '--forecast-file', help='file to keep recent namespace counts in, enables the growth forecast', required=False, type=str, dest='forecast_file')
+parser.add_argument('--forecast-window', help='seconds of recent counts to fit the growth rate to', required=False, type=int, dest='forecast_window', default=21600)
+parser.add_argument('--forecast-warning', help='warn when the max is forecast to be reached within this many seconds', required=False, type=int, dest='forecast_warning', default=86400)
+parser.add_argument('--forecast-critical', help='go critical when the max is forecast to be reached within this many seconds', required=False, type=int, dest='forecast_critical', default=14400)
+monitor_timings.add_arguments(parser)
 args = parser.parse_args()
+monitor_timings.start(args)
 
 # setup the client
-apikey = Path(args.secret_path).read_text()
-aConfig = kubernetes.client.Configuration()
-aConfig.api_key = {"authorization": "Bearer " + apikey}
-aConfig.host = args.apiurl
-aConfig.ssl_ca_cert = args.cacert
-aApiClient = kubernetes.client.ApiClient(aConfig)
+aApiClient = kube_client.api_client(args.apiurl, args.secret_path, args.cacert)
 # ocp_client = DynamicClient(aApiClient)
-custom_objects_api = kubernetes.client.CustomObjectsApi(aApiClient)
-v1 = kubernetes.client.CoreV1Api(aApiClient)
+monitor_timings.phase('evaluate')
 
-# Pull all resources required
+# Count the namespaces without pulling the namespace list
 #
-namespaces = v1.list_namespace().to_dict()["items"]
-namespacecount = len(namespaces)
+namespacecount = kube_count.count_objects(aApiClient, '/api/v1/namespaces', protobuf=args.protobuf)
+
+# Forecast when we will reach the max from the recent growth rate
+forecast_string = ""
+forecast_perfdata = ""
+forecast_state = 0
+if args.forecast_file:
+    now = time.time()
+    forecast_history = ring_file.RingFile(args.forecast_file, '<dI', forecast_slots)
+    forecast_history.append((now, namespacecount))
+    rate = growth_rate([sample for sample in forecast_history.read() if sample[0] >= now - args.forecast_window])
+    if rate is None:
+        forecast_string = " not enough samples for a growth forecast yet;"
+    elif rate <= 0 or namespacecount >= args.maxcount:
+        forecast_string = f" growth {rate * 3600:.1f}/h;"
+        forecast_perfdata = f" growth_per_hour={rate * 3600:.2f};;;;;"
+    else:
+        time_to_max = (args.maxcount - namespacecount) / rate
+        forecast_string = f" growth {rate * 3600:.1f}/h, {args.maxcount} max in {time_to_max / 3600:.1f}h;"
+        forecast_perfdata = f" growth_per_hour={rate * 3600:.2f};;;;; time_to_max={time_to_max:.0f}s;{args.forecast_warning}:;{args.forecast_critical}:;0;;"
+        if time_to_max < args.forecast_critical:
+            forecast_state = 2
+        elif time_to_max < args.forecast_warning:
+            forecast_state = 1
 
 if namespacecount >= args.maxcount:
-    exitstring = f"[CRITICAL FAILURE] maximum namespaces exceeded: at {namespacecount} with {args.maxcount} max; | namespaces={namespacecount};{args.warningcount};{args.criticalcount};0;{args.maxcount};"
-    print(exitstring)
-    exit(2)
+    exitcode = 2
+    exitstring = f"[CRITICAL FAILURE] maximum namespaces exceeded: at {namespacecount} with {args.maxcount} max;"
 elif namespacecount > args.criticalcount:
-    exitstring = f"[CRITICAL] namespaces above critical level: at {namespacecount} with {args.criticalcount} critical; | namespaces={namespacecount};{args.warningcount};{args.criticalcount};0;{args.maxcount};"
-    print(exitstring)
-    exit(2)
+    exitcode = 2
+    exitstring = f"[CRITICAL] namespaces above critical level: at {namespacecount} with {args.criticalcount} critical;"
 elif namespacecount > args.warningcount:
-    exitstring = f"[WARNING] namespaces above warning level: at {namespacecount} with {args.warningcount} warning; | namespaces={namespacecount};{args.warningcount};{args.criticalcount};0;{args.maxcount};"
-    print(exitstring)
-    exit(1)
+    exitcode = 1
+    exitstring = f"[WARNING] namespaces above warning level: at {namespacecount} with {args.warningcount} warning;"
 else:
-    exitstring = f"[OK] namespaces within normal range: {namespacecount} namespaces  | namespaces={namespacecount};{args.warningcount};{args.criticalcount};0;{args.maxcount};"
-    print(exitstring)
-    exit(0)
+    exitcode = 0
+    exitstring = f"[OK] namespaces within normal range: {namespacecount} namespaces "
+
+# A close projected exhaustion raises the state even while the count itself is fine
+if forecast_state > exitcode:
+    exitcode = forecast_state
+    if forecast_state == 2:
+        exitstring = f"[CRITICAL] namespaces forecast to reach the maximum soon: at {namespacecount} with {args.maxcount} max;"
+    else:
+        exitstring = f"[WARNING] namespaces forecast to reach the maximum: at {namespacecount} with {args.maxcount} max;"
+
+monitor_timings.phase('render')
+print(f"{exitstring}{forecast_string} | namespaces={namespacecount};{args.warningcount};{args.criticalcount};0;{args.maxcount};{forecast_perfdata}")
+exit(exitcode)
@@ -7,216 +7,429 @@
 ###
 
 import argparse
-import kubernetes
-import re
+import array
+import os
+import sys
+import time
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'common'))
+import monitor_shim  # noqa: E402,F401
+import numpy  # noqa: E402
+import kube_client  # noqa: E402
+import kube_protobuf  # noqa: E402
+import kube_quantity  # noqa: E402
+import monitor_timings  # noqa: E402
+
 pod_restarts_before_warning = 200
 
-# Pre-compile our unit-splitter for OCP
-# This should match "1.1Gi", "1K", or "1000343.343ABiC",
-# but not "1.Gi" and not "1,000Gi"
-# We will catch "1000343.343ABiC" in the functions
-unit_split_re = re.compile('^(\d+(?:\.\d+)?)([iA-Z]+)$')
+# Containers need at least this many usage samples before the sustained-pressure check applies
+sustained_min_samples = 3
 
+# Quantity strings outside of the Kubernetes grammar, which were left unknown rather than failing the check
+unreadable_quantities = set()
 
 # Functions required for this program
 
 
-def convert_ocp_container_memory_units_to_bytes(memory_string):
-    # Convert to a string, and then validate that this has numeric and alpha chars for the split
-    my_return_value = 0
-    unit_string = str(memory_string)
-    #
-    #
-    # Note, type Int, conversion is always 1 until changed, as 1 Byte = 1 Byte
-    # For the value, we're assuming the conversion of 1 Byte into the value
-    # (So 1 MegaByte (MB) = 1,000,000 Bytes, and 1 MebiByte (MiB) = 1,048,576)
-    # so the my_conversion_ratio would equal 1000000 or 1048567, respectively.
-    my_conversion_ratio = 1
-    #
-    # If the string has is not just a number, but has an alpha (e.g. attached units)
-    # NOTE: the walrus operator ':=" was brought in Py3.8, RHEL7/8 default to Py3.6
-    # if my_re_result := unit_split_re.match(unit_string)
-    #   instead we have to split it between lines
-    my_re_result = unit_split_re.match(unit_string)
-    if my_re_result:
-        my_unit_tuple = my_re_result.groups()
-        # In these, we're taking the suffix of the unit and converting it
-        if my_unit_tuple[1] == "Ki":
-            my_conversion_ratio = 1024
-        elif my_unit_tuple[1] == "K":
-            my_conversion_ratio = 1000
-        elif my_unit_tuple[1] == "Mi":
-            my_conversion_ratio = 1048576
-        elif my_unit_tuple[1] == "M":
-            my_conversion_ratio = 1000000
-        elif my_unit_tuple[1] == "Gi":
-            my_conversion_ratio = 1073741824
-        elif my_unit_tuple[1] == "G":
-            my_conversion_ratio = 1000000000
-        elif my_unit_tuple[1] == "Ti":
-            my_conversion_ratio = 1099511627776
-        elif my_unit_tuple[1] == "T":
-            my_conversion_ratio = 1000000000000
-        else:
-            print(f'WE HAVE A UNIT SUFFIX WE DO NOT UNDERSTAND: {my_unit_tuple[1]}')
-        my_return_value = float(my_unit_tuple[0]) * float(my_conversion_ratio)
-        #
-        #
-        # This is just an integer, assume it's already KiB
-    else:
-        my_return_value = int(memory_string)
-    return(int(my_return_value))
-
-
-def convert_ocp_container_cpu_units_to_milli(cpu_string):
-    # Convert to a string, and then validate that this has numeric and alpha chars for the split
-    my_return_value = 0
-    unit_string = str(cpu_string)
-    #
-    #
-    # Note, type Int, millis are in 1000th of a CPU unit
-    # In this function, we can hardcode this ratio for
-    # whole units of CPU
-    my_conversion_ratio = 1000
-    #
-    # If the string has is not just a number, but has an "m" at the end for "milli"
-    if unit_string[-1] == "m":
-        return(int(unit_string[:-1]))
-    else:
-        value = int(unit_string) * my_conversion_ratio
-        return(int(value))
+# Page through the cluster pod list without building kubernetes model objects.
+# Each page is decoded straight from the raw JSON and every pod is pruned down to
+# the fields this check reads, so only one page of full pod specs is ever held in
+# memory at a time.
+# Yields (namespace, name, node, containers, restarts) tuples, where containers is a
+# list of (container name, resources) and restarts maps container name to restartCount
+def iter_pruned_pods(api_client, page_size, protobuf=False):
+    continue_token = None
+    accept = kube_protobuf.protobuf_accept if protobuf else 'application/json'
+    while True:
+        query_params = [('limit', page_size)]
+        if continue_token:
+            query_params.append(('continue', continue_token))
+        # With protobuf only the fields below are decoded, the rest of each pod is skipped over
+        page = kube_protobuf.get_list(api_client, '/api/v1/pods', kube_protobuf.pod_resources_schema, query_params, accept=accept)
+        for item in page["items"]:
+            containers = []
+            for container in item["spec"]["containers"]:
+                containers.append((container["name"], container.get("resources", {})))
+            restarts = {}
+            for container_status in item.get("status", {}).get("containerStatuses", []):
+                restarts[container_status["name"]] = container_status.get("restartCount", 0)
+            yield (item["metadata"]["namespace"], item["metadata"]["name"], item["spec"].get("nodeName", ""), containers, restarts)
+        continue_token = page["metadata"].get("continue")
+        del(page)
+        if not continue_token:
+            break
+
+
+# Columnar store for every container in the cluster, one row per container.
+# Values live in typed arrays (8 bytes per value, no per-value Python objects) which
+# NumPy wraps without copying for the evaluation. Values which are not set (no limit,
+# no metrics) are NaN, so any comparison against them is simply False.
+# Rows are keyed by an interned (namespace, pod, container) tuple, so the strings of
+# a pod are shared by all of its containers and by the metrics join.
+class ContainerColumns(object):
+    value_columns = ("cpu_usage", "cpu_limit", "cpu_request", "mem_usage", "mem_limit", "mem_request")
+
+    def __init__(self):
+        self.rows = {}
+        self.keys = []
+        self.namespaces = {}
+        self.nodes = {}
+        self.namespace_codes = array.array('i')
+        self.node_codes = array.array('i')
+        self.restarts = array.array('q')
+        self.values = {column: array.array('d') for column in self.value_columns}
+
+    # Add a row for a container and return its record
+    def add(self, namespace, pod_name, node, container_name):
+        key = (sys.intern(namespace), sys.intern(pod_name), sys.intern(container_name))
+        row = len(self.keys)
+        self.rows[key] = row
+        self.keys.append(key)
+        self.namespace_codes.append(self.namespaces.setdefault(key[0], len(self.namespaces)))
+        self.node_codes.append(self.nodes.setdefault(node, len(self.nodes)))
+        self.restarts.append(0)
+        for column in self.value_columns:
+            self.values[column].append(numpy.nan)
+        return(ContainerRecord(self, row))
+
+    # Return the record for a container, or None if there is no row for it
+    def get(self, namespace, pod_name, container_name):
+        row = self.rows.get((namespace, pod_name, container_name))
+        if row is None:
+            return(None)
+        return(ContainerRecord(self, row))
+
+    def arrays(self):
+        arrays = {column: numpy.frombuffer(self.values[column], dtype=numpy.float64) for column in self.value_columns}
+        arrays["restarts"] = numpy.frombuffer(self.restarts, dtype=numpy.int64)
+        arrays["namespace_codes"] = numpy.frombuffer(self.namespace_codes, dtype=numpy.int32)
+        arrays["node_codes"] = numpy.frombuffer(self.node_codes, dtype=numpy.int32)
+        return(arrays)
+
+
+# Attribute access to one value column of a ContainerRecord's row
+def column_property(column):
+    def getter(record):
+        return(record.columns.values[column][record.row])
+
+    def setter(record, value):
+        record.columns.values[column][record.row] = value
+    return(property(getter, setter))
+
+
+# A single container: a slotted view of one row of a ContainerColumns store
+class ContainerRecord(object):
+    __slots__ = ("columns", "row")
+
+    def __init__(self, columns, row):
+        self.columns = columns
+        self.row = row
+
+    cpu_usage = column_property("cpu_usage")
+    cpu_limit = column_property("cpu_limit")
+    cpu_request = column_property("cpu_request")
+    mem_usage = column_property("mem_usage")
+    mem_limit = column_property("mem_limit")
+    mem_request = column_property("mem_request")
+
+    @property
+    def restarts(self):
+        return(self.columns.restarts[self.row])
+
+    @restarts.setter
+    def restarts(self, value):
+        self.columns.restarts[self.row] = value
+
+    @property
+    def name(self):
+        namespace, pod_name, container_name = self.columns.keys[self.row]
+        return(f"{namespace}:{pod_name}::{container_name}")
+
+
+# Fixed-size ring of cpu and memory usage samples for each container, used by the
+# sustained-pressure check. Every sample is written to the same slot for all rows,
+# so a container without metrics in a sample simply holds NaN there. The ring is
+# capped at max_tracked containers and window samples, so its size is bounded
+# however many containers the cluster runs, and it can be persisted between runs.
+class UsageHistory(object):
+    def __init__(self, keys, window, max_tracked):
+        self.keys = keys[:max_tracked]
+        self.window = window
+        self.cpu = numpy.full((len(self.keys), window), numpy.nan, dtype=numpy.float32)
+        self.mem = numpy.full((len(self.keys), window), numpy.nan, dtype=numpy.float32)
+        self.times = numpy.full(window, numpy.nan)
+        self.position = 0
+
+    # Carry over the samples of containers which still exist from a previous run
+    def load(self, path):
+        try:
+            saved = numpy.load(path)
+        except (OSError, ValueError):
+            return
+        with saved:
+            if saved["cpu"].shape[1] != self.window:
+                return
+            saved_rows = {key: row for row, key in enumerate(saved["keys"].tolist())}
+            current_rows = []
+            previous_rows = []
+            for row, key in enumerate(self.keys):
+                previous_row = saved_rows.get("\t".join(key))
+                if previous_row is not None:
+                    current_rows.append(row)
+                    previous_rows.append(previous_row)
+            self.cpu[current_rows] = saved["cpu"][previous_rows]
+            self.mem[current_rows] = saved["mem"][previous_rows]
+            self.times = saved["times"]
+            self.position = int(saved["position"])
+
+    # Saved readable by us only, like the other caches, as it holds usage for every namespace
+    def save(self, path):
+        temp_path = path + ".tmp"
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        # The mode only applies on creation, so also fix a temp file left behind by an older run
+        os.fchmod(fd, 0o600)
+        with os.fdopen(fd, "wb") as history_file:
+            numpy.savez(history_file, keys=numpy.array(["\t".join(key) for key in self.keys], dtype=str),
+                        cpu=self.cpu, mem=self.mem, times=self.times, position=self.position)
+        os.replace(temp_path, path)
+
+    # Record the current usage columns as one sample
+    def record(self, cpu_usage, mem_usage, timestamp):
+        slot = self.position % self.window
+        self.cpu[:, slot] = cpu_usage[:len(self.keys)]
+        self.mem[:, slot] = mem_usage[:len(self.keys)]
+        self.times[slot] = timestamp
+        self.position += 1
+
+    # Rolling mean, max and sample count per container over the samples newer than max_age
+    def stats(self, resource, now, max_age):
+        with numpy.errstate(invalid='ignore'):
+            samples = getattr(self, resource)[:, self.times >= now - max_age]
+            count = numpy.count_nonzero(~numpy.isnan(samples), axis=1)
+            with numpy.errstate(divide='ignore'):
+                mean = numpy.nansum(samples, axis=1) / count
+            if samples.shape[1] > 0:
+                maximum = numpy.fmax.reduce(samples, axis=1)
+            else:
+                maximum = numpy.full(len(self.keys), numpy.nan)
+        return(mean, maximum, count)
+
+
+# Pad a per-tracked-container array out to every row of the store
+def pad_rows(values, row_count, fill):
+    padded = numpy.full(row_count, fill, dtype=values.dtype)
+    padded[:len(values)] = values
+    return(padded)
+
+
+# Convert a quantity with one of the kube_quantity converters, leaving it unknown (NaN) when it can't be parsed
+def convert_quantity(converter, quantity):
+    try:
+        return(converter(quantity))
+    except ValueError:
+        unreadable_quantities.add(quantity)
+        return(numpy.nan)
+
+
+# Copy the usage from a metrics.k8s.io pod list into the container rows, skipping the
+# generic "POD" entry. Containers the pod list did not know about are added when add_missing is set
+def apply_pod_metrics(pod_columns, pod_metrics, add_missing):
+    for item in pod_metrics:
+        namespace = item["metadata"]["namespace"]
+        name = item["metadata"]["name"]
+        for container in item["containers"]:
+            if container["name"] != "POD":
+                # Now, test that the container in metrics actually exists (because we've had issues
+                # where the metrics API sees a container which the pod API doesn't apparently know about.)
+                record = pod_columns.get(namespace, name, container["name"])
+                if record is None:
+                    if not add_missing:
+                        continue
+                    record = pod_columns.add(namespace, name, "", container["name"])
+                # Now, update the cpu and mem usage for each container
+                record.cpu_usage = convert_quantity(kube_quantity.convert_ocp_container_cpu_units_to_milli, container["usage"]["cpu"])
+                record.mem_usage = convert_quantity(kube_quantity.convert_ocp_container_memory_units_to_bytes, container["usage"]["memory"])
+
+
+# Percentage of the limit in use for every row, NaN where either side is unknown or the limit is 0
+def percent_of_limit(usage, limit):
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        return(numpy.where(limit > 0, usage * 100.0 / limit, numpy.nan))
+
+
+# Percentile of the values within each group, for every group at once.
+# codes holds the group of each value and NaN values are ignored.
+# Returns an array indexed by group code, NaN for groups without any values
+def grouped_percentile(codes, values, group_count, percentile):
+    present = ~numpy.isnan(values)
+    codes = codes[present]
+    values = values[present]
+    values = values[numpy.lexsort((values, codes))]
+    counts = numpy.bincount(codes, minlength=group_count)
+    starts = numpy.cumsum(counts) - counts
+    has_values = counts > 0
+    position = starts[has_values] + (counts[has_values] - 1) * (percentile / 100.0)
+    lower = numpy.floor(position).astype(numpy.int64)
+    upper = numpy.ceil(position).astype(numpy.int64)
+    result = numpy.full(group_count, numpy.nan)
+    result[has_values] = values[lower] + (values[upper] - values[lower]) * (position - lower)
+    return(result)
+
+
+# Print the p50/p95 usage (as % of limit) of the top groups, ordered by p95 memory
+def print_rollup(title, codes, names, mem_pct, cpu_pct, top):
+    group_names = sorted(names, key=names.get)
+    rollup = {}
+    for resource, pct in (("mem", mem_pct), ("cpu", cpu_pct)):
+        for percentile in (50, 95):
+            rollup[f"{resource} p{percentile}"] = grouped_percentile(codes, pct, len(group_names), percentile)
+    order = numpy.argsort(-numpy.nan_to_num(rollup["mem p95"], nan=-1.0), kind='stable')[:top]
+    print(f"{title} rollup (% of limit, top {top} by mem p95):")
+    for code in order:
+        stats = " ".join(f"{label}:{rollup[label][code]:.1f}" for label in rollup)
+        print(f"\t{group_names[code] or '<unscheduled>'}: {stats}")
 
 
 parser = argparse.ArgumentParser(description='Monitor for OCP/K8s pod limits ')
 parser.add_argument('-a', '--apiurl', help='address of the API e.g. "https://host.localdomain.com/api:4321"', required=True, type=str, dest='apiurl')
 parser.add_argument('-s', '--secret-file', help='file path containing the k8s secret for the API', required=True, type=str, dest='secret_path')
 parser.add_argument('-c', '--cacert', help='file path containing CA Cert for API', required=True, type=str, dest='cacert')
+parser.add_argument('--protobuf', help='LIST core resources as protobuf instead of JSON', required=False, action='store_true', dest='protobuf')
+parser.add_argument('-n', '--near-limit', help='also report containers using at least this %% of a cpu or memory limit (0 disables)', required=False, type=float, dest='near_limit', default=0)
+parser.add_argument('-r', '--rollup', help='print p50/p95 usage rollups for this many of the busiest namespaces and nodes', required=False, type=int, dest='rollup', default=0)
+parser.add_argument('-p', '--page-size', help='number of pods to request per page of the pod list', required=False, type=int, dest='page_size', default=500)
+parser.add_argument('-u', '--sustained', help='report containers whose mean usage over the sampled window is at least this %% of a cpu or memory limit (0 disables)', required=False, type=float, dest='sustained', default=0)
+parser.add_argument('--samples', help='number of metrics samples to take during this run for the sustained check', required=False, type=int, dest='samples', default=1)
+parser.add_argument('--sample-interval', help='seconds between metrics samples during this run', required=False, type=float, dest='sample_interval', default=15)
+parser.add_argument('--history-file', help='file to keep the sustained check samples in between runs', required=False, type=str, dest='history_file')
+parser.add_argument('--history-size', help='number of samples kept per container for the sustained check', required=False, type=int, dest='history_size', default=12)
+parser.add_argument('--history-max-age', help='ignore sustained check samples older than this many seconds', required=False, type=float, dest='history_max_age', default=900)
+parser.add_argument('--max-tracked', help='maximum number of containers kept in the sustained check history', required=False, type=int, dest='max_tracked', default=200000)
+monitor_timings.add_arguments(parser)
 args = parser.parse_args()
+monitor_timings.start(args)
 
 # setup the client
-apikey = Path(args.secret_path).read_text()
-aConfig = kubernetes.client.Configuration()
-aConfig.api_key = {"authorization": "Bearer " + apikey}
-aConfig.host = args.apiurl
-aConfig.ssl_ca_cert = args.cacert
-aApiClient = kubernetes.client.ApiClient(aConfig)
+aApiClient = kube_client.api_client(args.apiurl, args.secret_path, args.cacert)
 # ocp_client = DynamicClient(aApiClient)
-custom_objects_api = kubernetes.client.CustomObjectsApi(aApiClient)
-v1 = kubernetes.client.CoreV1Api(aApiClient)
+monitor_timings.phase('evaluate')
 
-# Create list of all pods in the cluster
+# Create list of all pods in the cluster (pruned to the fields we check)
 # Create list of all Pod Metrics in the cluster
-pod_list = v1.list_namespaced_pod("").to_dict()["items"]
-
-pod_metrics = custom_objects_api.list_cluster_custom_object('metrics.k8s.io', 'v1beta1', 'pods')['items']
-
-# Prep the pod_usage data-structure
-# del(pod_usage)
-pod_usage = {}
-
-# Create the pod and then container blanks for each entity in the cluster.
-for item in pod_list:
-    pod_usage[item["metadata"]["namespace"] + ":" + item["metadata"]["name"]] = {}
-    #pod_usage[item["metadata"]["namespace"] + ":" + item["metadata"]["name"]]["POD"] = {"usage": {"cpu": None, "mem": None}, "limits": {"cpu": None, "mem": None}, "requests": {"cpu": None, "mem": None}, "restarts": 0}
-    # Iterate through the spec_containers and populate the counts
-    for container in item["spec"]["containers"]:
-        pod_usage[item["metadata"]["namespace"] + ":" + item["metadata"]["name"]][container["name"]] = {"usage": {"cpu": None, "mem": None}, "limits": {"cpu": None, "mem": None}, "requests": {"cpu": None, "mem": None}, "restarts": 0}
-        # Now, we iterate through each container, checking the limit and requests for both cpu and mem (4x try blocks) to populate the entry correctly
-        try:
-            useless = container["resources"]["limits"]["cpu"]
-        except Exception:
-            pass
-        else:
-            pod_usage[item["metadata"]["namespace"] + ":" + item["metadata"]["name"]][container["name"]]["limits"]["cpu"] = convert_ocp_container_cpu_units_to_milli(container["resources"]["limits"]["cpu"])
-        ##
-        try:
-            useless = container["resources"]["limits"]["memory"]
-        except Exception:
-            pass
-        else:
-            pod_usage[item["metadata"]["namespace"] + ":" + item["metadata"]["name"]][container["name"]]["limits"]["mem"] = convert_ocp_container_memory_units_to_bytes(container["resources"]["limits"]["memory"])
-        ##
-        try:
-            useless = container["resources"]["requests"]["cpu"]
-        except Exception:
-            pass
-        else:
-            pod_usage[item["metadata"]["namespace"] + ":" + item["metadata"]["name"]][container["name"]]["requests"]["cpu"] = convert_ocp_container_cpu_units_to_milli(container["resources"]["requests"]["cpu"])
-        ##
-        try:
-            useless = container["resources"]["requests"]["memory"]
-        except Exception:
-            pass
-        else:
-            pod_usage[item["metadata"]["namespace"] + ":" + item["metadata"]["name"]][container["name"]]["requests"]["mem"] = convert_ocp_container_memory_units_to_bytes(container["resources"]["requests"]["memory"])
-    # Now, pull the restart count of the Pod for some *very* basic error checking
-    try:
-        useless = item["status"]["container_statuses"][0]
-    except Exception:
-        pass
-    else:
-        for container_status in item["status"]["container_statuses"]:
-            pod_usage[item["metadata"]["namespace"] + ":" + item["metadata"]["name"]][container_status["name"]]["restarts"] = container_status["restart_count"]
+pod_list = iter_pruned_pods(aApiClient, args.page_size, args.protobuf)
+
+pod_metrics = kube_client.get_json(aApiClient, '/apis/metrics.k8s.io/v1beta1/pods')['items']
+
+# Prep the pod_columns data-structure
+pod_columns = ContainerColumns()
+
+# Create the container rows for each pod in the cluster.
+for namespace, name, node, containers, restarts in pod_list:
+    # Iterate through the spec_containers and populate the limits and requests
+    for container_name, resources in containers:
+        record = pod_columns.add(namespace, name, node, container_name)
+        limits = resources.get("limits", {})
+        requests = resources.get("requests", {})
+        if "cpu" in limits:
+            record.cpu_limit = convert_quantity(kube_quantity.convert_ocp_container_cpu_units_to_milli, limits["cpu"])
+        if "memory" in limits:
+            record.mem_limit = convert_quantity(kube_quantity.convert_ocp_container_memory_units_to_bytes, limits["memory"])
+        if "cpu" in requests:
+            record.cpu_request = convert_quantity(kube_quantity.convert_ocp_container_cpu_units_to_milli, requests["cpu"])
+        if "memory" in requests:
+            record.mem_request = convert_quantity(kube_quantity.convert_ocp_container_memory_units_to_bytes, requests["memory"])
+        # Now, pull the restart count of the container for some *very* basic error checking
+        record.restarts = restarts.get(container_name, 0)
 
 # Pod_list is no longer used - free the memory.
 del(pod_list)
 
-### Add in current usage metrics for each container (and the generic "POD" entry as provided by the metrics API)
-for item in pod_metrics:
-    for container in item["containers"]:
-        if container["name"] != "POD":
-            # Now, test that the container in metrics actually exists (because we've had issues 
-            # where the metrics API sees a container which the pod API doesn't apparently know about.)
-            try:
-                useless = pod_usage[item["metadata"]["namespace"] + ":" + item["metadata"]["name"]][container["name"]]
-            except Exception:
-                pod_usage[item["metadata"]["namespace"] + ":" + item["metadata"]["name"]][container["name"]] = {"usage": {"cpu": None, "mem": None}, "limits": {"cpu": None, "mem": None}, "requests": {"cpu": None, "mem": None}, "restarts": 0}
-            # Now, cycle through and update the cpu and mem usage for each container
-            pod_usage[item["metadata"]["namespace"] + ":" + item["metadata"]["name"]][container["name"]]["usage"]["cpu"] = convert_ocp_container_cpu_units_to_milli(container["usage"]["cpu"])
-            pod_usage[item["metadata"]["namespace"] + ":" + item["metadata"]["name"]][container["name"]]["usage"]["mem"] = convert_ocp_container_memory_units_to_bytes(container["usage"]["memory"])
+### Add in current usage metrics for each container
+apply_pod_metrics(pod_columns, pod_metrics, True)
 
 # Pod_metrics is no longer required - free the memory.
 del(pod_metrics)
-#
-# Data structure is
-# pod_restarts_before_warning
-monitor_output = {}
-for pod in pod_usage:
-    for container in pod_usage[pod]:
-        errorrestarts = False
-        errorcpu = False
-        errormem = False
-        if pod_usage[pod][container]["restarts"] is not None:
-            if pod_usage[pod][container]["restarts"] >= pod_restarts_before_warning:
-                errorrestarts = True
-        if pod_usage[pod][container]["usage"]["cpu"] is not None and pod_usage[pod][container]["limits"]["cpu"] is not None:
-            if pod_usage[pod][container]["usage"]["cpu"] > pod_usage[pod][container]["limits"]["cpu"]:
-                errorcpu = True
-        if pod_usage[pod][container]["usage"]["mem"] is not None and pod_usage[pod][container]["limits"]["mem"] is not None:
-            if pod_usage[pod][container]["usage"]["mem"] > pod_usage[pod][container]["limits"]["mem"]:    
-                errormem = True
-        if errorrestarts or errorcpu or errormem:
-            monitor_output[pod] = {}
-            monitor_output[pod][container] = {}
-            if errorrestarts:
-                monitor_output[pod][container]["restarts"] = f'Restarts at {pod_usage[pod][container]["restarts"]}'
-            if errorcpu:
-                monitor_output[pod][container]["cpu"] = f'CPU milli limit:{pod_usage[pod][container]["limits"]["cpu"]} usage:{pod_usage[pod][container]["usage"]["cpu"]}'
-            if errormem:
-                monitor_output[pod][container]["mem"] = f'RAM bytes limit:{pod_usage[pod][container]["limits"]["mem"]} usage:{pod_usage[pod][container]["usage"]["mem"]}'
-
-
-if len(monitor_output) == 0:
-    print("[OK] Pod resources show no errors;")
-    exit(0)
+
+# Sample usage into the per-container history for the sustained-pressure check
+history = None
+if args.sustained > 0:
+    history = UsageHistory(pod_columns.keys, args.history_size, args.max_tracked)
+    if args.history_file:
+        history.load(args.history_file)
+    cpu_usage = numpy.frombuffer(pod_columns.values["cpu_usage"], dtype=numpy.float64)
+    mem_usage = numpy.frombuffer(pod_columns.values["mem_usage"], dtype=numpy.float64)
+    history.record(cpu_usage, mem_usage, time.time())
+    for sample in range(1, args.samples):
+        time.sleep(args.sample_interval)
+        cpu_usage[:] = numpy.nan
+        mem_usage[:] = numpy.nan
+        apply_pod_metrics(pod_columns, kube_client.get_json(aApiClient, '/apis/metrics.k8s.io/v1beta1/pods')['items'], False)
+        history.record(cpu_usage, mem_usage, time.time())
+    del(cpu_usage, mem_usage)
+    if args.history_file:
+        history.save(args.history_file)
+
+# Evaluate every container at once
+columns = pod_columns.arrays()
+mem_pct = percent_of_limit(columns["mem_usage"], columns["mem_limit"])
+cpu_pct = percent_of_limit(columns["cpu_usage"], columns["cpu_limit"])
+error_restarts = columns["restarts"] >= pod_restarts_before_warning
+with numpy.errstate(invalid='ignore'):
+    error_cpu = columns["cpu_usage"] > columns["cpu_limit"]
+    error_mem = columns["mem_usage"] > columns["mem_limit"]
+    if args.near_limit > 0:
+        near_cpu = ~error_cpu & (cpu_pct >= args.near_limit)
+        near_mem = ~error_mem & (mem_pct >= args.near_limit)
+    else:
+        near_cpu = numpy.zeros_like(error_cpu)
+        near_mem = numpy.zeros_like(error_mem)
+    if history is not None:
+        row_count = len(pod_columns.keys)
+        now = time.time()
+        cpu_mean, cpu_max, cpu_count = history.stats("cpu", now, args.history_max_age)
+        mem_mean, mem_max, mem_count = history.stats("mem", now, args.history_max_age)
+        cpu_mean = pad_rows(cpu_mean, row_count, numpy.nan)
+        cpu_max = pad_rows(cpu_max, row_count, numpy.nan)
+        mem_mean = pad_rows(mem_mean, row_count, numpy.nan)
+        mem_max = pad_rows(mem_max, row_count, numpy.nan)
+        sample_count = pad_rows(numpy.minimum(cpu_count, mem_count), row_count, 0)
+        sustained_cpu = (sample_count >= sustained_min_samples) & (cpu_mean * 100.0 >= args.sustained * columns["cpu_limit"])
+        sustained_mem = (sample_count >= sustained_min_samples) & (mem_mean * 100.0 >= args.sustained * columns["mem_limit"])
+    else:
+        sustained_cpu = numpy.zeros_like(error_cpu)
+        sustained_mem = numpy.zeros_like(error_mem)
+flagged_rows = numpy.flatnonzero(error_restarts | error_cpu | error_mem | near_cpu | near_mem | sustained_cpu | sustained_mem)
+
+monitor_timings.phase('render')
+unreadable_string = ""
+if unreadable_quantities:
+    unreadable_string = " unreadable quantities left unchecked: " + ", ".join(sorted(map(str, unreadable_quantities))[:5]) + ";"
+if len(flagged_rows) == 0:
+    print("[OK] Pod resources show no errors;" + unreadable_string)
+    exit_code = 0
 else:
-    print("[WARNING] Pods with resource concerns found;")
-    for pod in monitor_output:
-        for container in monitor_output[pod]:
-            print(f"{pod}::{container}:")
-            for message in monitor_output[pod][container]:
-                print(f"\t{monitor_output[pod][container][message]}")
-    exit(1)
+    print("[WARNING] Pods with resource concerns found;" + unreadable_string)
+    for row in flagged_rows:
+        record = ContainerRecord(pod_columns, row)
+        print(f"{record.name}:")
+        if error_restarts[row]:
+            print(f"\tRestarts at {record.restarts}")
+        if error_cpu[row]:
+            print(f"\tCPU milli limit:{record.cpu_limit:.0f} usage:{record.cpu_usage:.0f}")
+        elif near_cpu[row]:
+            print(f"\tCPU milli near limit:{record.cpu_limit:.0f} usage:{record.cpu_usage:.0f}")
+        if sustained_cpu[row]:
+            print(f"\tCPU milli sustained limit:{record.cpu_limit:.0f} mean:{cpu_mean[row]:.0f} max:{cpu_max[row]:.0f} over {sample_count[row]} samples")
+        if error_mem[row]:
+            print(f"\tRAM bytes limit:{record.mem_limit:.0f} usage:{record.mem_usage:.0f}")
+        elif near_mem[row]:
+            print(f"\tRAM bytes near limit:{record.mem_limit:.0f} usage:{record.mem_usage:.0f}")
+        if sustained_mem[row]:
+            print(f"\tRAM bytes sustained limit:{record.mem_limit:.0f} mean:{mem_mean[row]:.0f} max:{mem_max[row]:.0f} over {sample_count[row]} samples")
+    exit_code = 1
 
+if args.rollup > 0:
+    print_rollup("Namespace", columns["namespace_codes"], pod_columns.namespaces, mem_pct, cpu_pct, args.rollup)
+    print_rollup("Node", columns["node_codes"], pod_columns.nodes, mem_pct, cpu_pct, args.rollup)
+exit(exit_code)
@@ -8,32 +8,35 @@ output            :Nagios/Icinga2 format
 """
 
 import argparse
-import kubernetes
+import sys
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'common'))
+import monitor_shim  # noqa: E402,F401
+import kube_client  # noqa: E402
+import kube_list_cache  # noqa: E402
+import monitor_timings  # noqa: E402
+
 
 parser = argparse.ArgumentParser(description='Monitor for Poolboy ResourceHandle data-integrity ')
 parser.add_argument('-a', '--apiurl', help='address of the API e.g. "https://host.localdomain.com/api:4321"', required=True, type=str, dest='apiurl')
 parser.add_argument('-s', '--secret-file', help='file path containing the k8s secret for the API', required=True, type=str, dest='secret_path')
 parser.add_argument('-c', '--cacert', help='file path containing CA Cert for API', required=True, type=str, dest='cacert')
+parser.add_argument('--list-cache-ttl', help='seconds a LIST may be shared with other monitors asking for the same one (0 disables)', required=False, type=int, dest='list_cache_ttl', default=kube_list_cache.default_ttl)
 parser.add_argument('-d', '--deeplink', help='where to link the output', required=False, type=str, dest='deeplink', default="https://my.babylonui.example.com/admin/resourcehandles/")
+monitor_timings.add_arguments(parser)
 args = parser.parse_args()
+monitor_timings.start(args)
 
 # setup the client
-apikey = Path(args.secret_path).read_text()
-aConfig = kubernetes.client.Configuration()
-aConfig.api_key = {"authorization": "Bearer " + apikey}
-aConfig.host = args.apiurl
-aConfig.ssl_ca_cert = args.cacert
-aApiClient = kubernetes.client.ApiClient(aConfig)
+aApiClient = kube_client.api_client(args.apiurl, args.secret_path, args.cacert)
 # ocp_client = DynamicClient(aApiClient)
-custom_objects_api = kubernetes.client.CustomObjectsApi(aApiClient)
-v1 = kubernetes.client.CoreV1Api(aApiClient)
+monitor_timings.phase('evaluate')
 
 # Prepare validation variables
 resourcehandles_in_error = []
 recovered = []
-resourcehandles = custom_objects_api.list_cluster_custom_object('poolboy.gpte.redhat.com', 'v1', 'resourcehandles')['items']
+resourcehandles = kube_list_cache.list_objects(aApiClient, 'poolboy.gpte.redhat.com', 'v1', 'resourcehandles', ttl=args.list_cache_ttl)['items']
 
 # Run validation loop
 for resourcehandle in resourcehandles:
@@ -48,6 +51,7 @@ for resourcehandle in resourcehandles:
         else:
             recovered.append(resourcehandle)
 
+monitor_timings.phase('render')
 # Nagios/Icinga output
 if len(resourcehandles_in_error) == 0:
     exitstring = "[OK] No Resource Handles in Error found; | resourcehandles={};;;;; errorresourcehandles={};;;;; recovered={};;;;; ".format(
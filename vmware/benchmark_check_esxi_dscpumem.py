@@ -0,0 +1,76 @@
+#! /usr/bin/python3
+
+"""
+description       :Runs check_esxi_dscpumem.py against fake_vsphere_soap.py at several inventory sizes and reports wall time,
+                   CPU time, peak RSS and the number of SOAP requests the check made at each size.
+license           :Apache License v2
+usage             :benchmark_check_esxi_dscpumem.py --sizes 10:20,500:2000,5000:20000 --check_args "--top_vms 5"
+"""
+
+import argparse
+import json
+import os
+import shlex
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+parser = argparse.ArgumentParser(description="Benchmark check_esxi_dscpumem.py against a fake vCenter.")
+parser.add_argument('--sizes', type=str, required=False, default='10:20,500:2000,5000:20000', help="Comma separated hosts:datastores inventory sizes to run at.")
+parser.add_argument('--runs', type=int, required=False, default=3, help="Runs of the check at each size, the best one is reported.")
+parser.add_argument('--port', type=int, required=False, default=18943, help="Port for the fake vCenter.")
+parser.add_argument('--check_args', type=str, required=False, default='', help="Extra arguments for the check, e.g. \"--top_vms 5\".")
+args = parser.parse_args()
+
+here = Path(__file__).resolve().parent
+unverified = ssl._create_unverified_context()
+
+
+def fake_stats():
+    with urllib.request.urlopen(f'https://127.0.0.1:{args.port}/stats', context=unverified) as response:
+        return json.load(response)
+
+
+# Run the check once, returning its exit code, wall seconds, CPU seconds and peak RSS in MB from wait4
+def run_check(secrets_path):
+    command = [sys.executable, str(here / 'check_esxi_dscpumem.py'), '--secrets', secrets_path,
+               '--datastore_warning', '80', '--datastore_critical', '90', '--cpu_warning', '80', '--cpu_critical', '90',
+               '--memory_warning', '80', '--memory_critical', '90'] + shlex.split(args.check_args)
+    # A CA bundle in the environment overrides the check's verify=False for the fake's self-signed certificate
+    environment = {name: value for name, value in os.environ.items() if name not in ('REQUESTS_CA_BUNDLE', 'CURL_CA_BUNDLE')}
+    started = time.monotonic()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=environment)
+    pid, status, usage = os.wait4(process.pid, 0)
+    wall = time.monotonic() - started
+    return os.WEXITSTATUS(status), wall, usage.ru_utime + usage.ru_stime, usage.ru_maxrss / 1024
+
+
+with tempfile.TemporaryDirectory() as work_directory:
+    secrets_path = os.path.join(work_directory, 'secrets.json')
+    Path(secrets_path).write_text(json.dumps({'vsphere_host': f'127.0.0.1:{args.port}', 'username': 'benchmark', 'password': 'benchmark'}))
+    print(f"{'hosts':>7} {'datastores':>10} {'exit':>4} {'wall s':>8} {'cpu s':>8} {'rss MB':>8} {'requests':>8} {'MB sent':>8}")
+    for size in args.sizes.split(','):
+        hosts, datastores = (int(count) for count in size.split(':'))
+        fake = subprocess.Popen([sys.executable, str(here / 'fake_vsphere_soap.py'), '--port', str(args.port), '--hosts', str(hosts), '--datastores', str(datastores)],
+                                stdout=subprocess.PIPE, universal_newlines=True)
+        try:
+            # The fake prints one line once it is listening
+            if not fake.stdout.readline():
+                sys.exit(f"fake_vsphere_soap.py did not start on port {args.port}")
+            best = None
+            for run in range(args.runs):
+                before = fake_stats()
+                exit_code, wall, cpu, rss = run_check(secrets_path)
+                after = fake_stats()
+                result = (wall, exit_code, cpu, rss, after['requests'] - before['requests'], (after['bytes_sent'] - before['bytes_sent']) / 1048576)
+                if best is None or result < best:
+                    best = result
+            wall, exit_code, cpu, rss, requests_made, sent = best
+            print(f"{hosts:>7} {datastores:>10} {exit_code:>4} {wall:>8.2f} {cpu:>8.2f} {rss:>8.1f} {requests_made:>8} {sent:>8.1f}")
+        finally:
+            fake.terminate()
+            fake.wait()
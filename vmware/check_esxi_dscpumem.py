@@ -7,15 +7,25 @@ license           :Apache License v2
 output            :Nagios/Icinga2 format
 """
 
+import heapq
+import os
+import socket
 import sys
+import time
 import json
-import requests
 import xml.etree.ElementTree as ET
 import argparse
+from pathlib import Path
 from pprint import pprint
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'common'))
+import monitor_shim  # noqa: E402,F401
+import monitor_metrics  # noqa: E402
+import monitor_timings  # noqa: E402
+import requests  # noqa: E402
+
 # Disable SSL warnings for self-signed certificates
-import urllib3
+import urllib3  # noqa: E402
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 # Parse command-line arguments
@@ -28,7 +38,22 @@ parser.add_argument('--cpu_warning', type=int, required=True, help="CPU usage wa
 parser.add_argument('--cpu_critical', type=int, required=True, help="CPU usage critical threshold in percentage.")
 parser.add_argument('--memory_warning', type=int, required=True, help="Memory usage warning threshold in percentage.")
 parser.add_argument('--memory_critical', type=int, required=True, help="Memory usage critical threshold in percentage.")
+parser.add_argument('--max_objects', type=int, required=False, default=1000, help="Most inventory objects vCenter should return in one page.")
+parser.add_argument('--perf', action='store_true', required=False, help="Judge hosts on PerformanceManager averages over recent 20 second samples instead of quickStats.")
+parser.add_argument('--perf_samples', type=int, required=False, default=15, help="Number of 20 second samples to average in --perf mode.")
+parser.add_argument('--perf_counter_cache', type=str, required=False, help="Path to a file to keep the resolved performance counter IDs in for --perf mode.")
+parser.add_argument('--ready_warning', type=float, required=False, default=5, help="CPU ready time warning threshold in percentage, for --perf mode.")
+parser.add_argument('--ready_critical', type=float, required=False, default=10, help="CPU ready time critical threshold in percentage, for --perf mode.")
+parser.add_argument('--latency_warning', type=float, required=False, default=20, help="Highest datastore latency warning threshold in milliseconds, for --perf mode.")
+parser.add_argument('--latency_critical', type=float, required=False, default=50, help="Highest datastore latency critical threshold in milliseconds, for --perf mode.")
+parser.add_argument('--top_vms', type=int, required=False, default=0, help="Also read the VMs in the same traversal and list this many top cpu and memory consumers under each warning or critical host.")
+parser.add_argument('--inventory_socket', type=str, required=False, help="Path to the socket of vsphere_inventory_daemon.py, to check its copy of the inventory instead of reading it from vCenter.")
+parser.add_argument('--inventory_max_age', type=int, required=False, default=300, help="Seconds since the inventory daemon last heard from vCenter before the check is UNKNOWN.")
+parser.add_argument('--inventory_timeout', type=float, required=False, default=10, help="Seconds to wait for the inventory daemon to answer.")
+parser.add_argument('--session_cache', type=str, required=False, help="Path to a file to keep the vSphere session in between runs, instead of logging in and out every time.")
+monitor_timings.add_arguments(parser)
 args = parser.parse_args()
+monitor_timings.start(args)
 
 # Load secrets from the provided file path
 with open(args.secrets, 'r') as f:
@@ -41,46 +66,96 @@ password = secrets['password']
 session = requests.Session()
 session.verify = False
 
+headers = {'Content-Type': 'text/xml', 'SOAPAction': 'urn:vim25/6.5'}
+url = f'https://{vsphere_host}/sdk'
+namespaces = {'soapenv': 'http://schemas.xmlsoap.org/soap/envelope/', 'urn': 'urn:vim25', 'vim25': 'urn:vim25'}
+returnval_tag = '{urn:vim25}returnval'
+objects_tag = '{urn:vim25}objects'
+token_tag = '{urn:vim25}token'
+obj_tag = '{urn:vim25}obj'
+prop_set_tag = '{urn:vim25}propSet'
+name_tag = '{urn:vim25}name'
+val_tag = '{urn:vim25}val'
+perf_counter_info_tag = '{urn:vim25}PerfCounterInfo'
+value_tag = '{urn:vim25}value'
+
+# Counters read in --perf mode, by their group.name.rollup names, and the realtime interval they are sampled at
+perf_counter_names = ('cpu.usage.average', 'mem.consumed.average', 'cpu.ready.summation', 'datastore.maxTotalLatency.latest')
+perf_interval = 20
+
+# Extra propSet and traversal for --top_vms, spliced into the inventory query
+vm_prop_set_xml = '''
+                <propSet>
+                   <type>VirtualMachine</type>
+                   <all>false</all>
+                   <pathSet>name</pathSet>
+                   <pathSet>runtime.host</pathSet>
+                   <pathSet>summary.quickStats.overallCpuUsage</pathSet>
+                   <pathSet>summary.quickStats.hostMemoryUsage</pathSet>
+                </propSet>'''
+vm_traversal_xml = '''
+                      <selectSet>
+                         <name>hToVm</name>
+                      </selectSet>'''
+vm_traversal_spec_xml = '''
+                   <selectSet xsi:type="urn:TraversalSpec">
+                      <name>hToVm</name>
+                      <type>HostSystem</type>
+                      <path>vm</path>
+                      <skip>false</skip>
+                   </selectSet>'''
+
+# Service content MoRefs used by the queries, filled in by login() or from the session cache
+service_content = {}
+# True once the session came from, or was saved to, the session cache - it is then left logged in for the next run
+session_cached = False
+
 # Function to send a SOAP request
+# A cached session may have expired on the vCenter side, in which case log in again once and resend
 
 
-def send_soap_request(url, headers, data):
-    response = session.post(url, headers=headers, data=data)
+def post_soap_request(url, headers, data, relogin=True, stream=False):
+    response = session.post(url, headers=headers, data=data, stream=stream)
+    if relogin and session_cached and response.status_code == 500 and 'NotAuthenticated' in response.text:
+        login()
+        response = session.post(url, headers=headers, data=data, stream=stream)
     response.raise_for_status()
-    return response.text
+    return response
 
-# Function to logout
 
+def send_soap_request(url, headers, data, relogin=True):
+    return post_soap_request(url, headers, data, relogin).text
 
-def logout():
-    logout_xml = '''
-    <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:urn="urn:vim25">
-       <soapenv:Header/>
-       <soapenv:Body>
-          <urn:Logout>
-             <_this type="SessionManager">SessionManager</_this>
-          </urn:Logout>
-       </soapenv:Body>
-    </soapenv:Envelope>
-    '''
-    try:
-        send_soap_request(url, headers, logout_xml)
-    except Exception as e:
-        print(f"Failed to logout: {e}")
-#   else:
-#       print("Logged out")
+# Function to stream a RetrievePropertiesEx/ContinueRetrievePropertiesEx response, handing each ObjectContent to
+# on_object as soon as it has been parsed and then dropping it, so memory does not grow with the page size.
+# Returns the continuation token, or None on the last page
 
 
-try:
-    # Convert thresholds to percentages
-    datastore_warning_pct = args.datastore_warning
-    datastore_critical_pct = args.datastore_critical
-    cpu_warning_pct = args.cpu_warning
-    cpu_critical_pct = args.cpu_critical
-    memory_warning_pct = args.memory_warning
-    memory_critical_pct = args.memory_critical
-
-    # Authenticate and get the session cookie
+def stream_inventory_page(data, on_object):
+    response = post_soap_request(url, headers, data, stream=True)
+    response.raw.decode_content = True
+    token = None
+    returnval = None
+    try:
+        for event, element in ET.iterparse(response.raw, events=('start', 'end')):
+            if event == 'start':
+                if element.tag == returnval_tag:
+                    returnval = element
+            elif element.tag == objects_tag:
+                on_object(element)
+                returnval.clear()
+            elif element.tag == token_tag:
+                token = element.text
+    finally:
+        response.close()
+    return token
+
+# Function to log in and look up the service content MoRefs, saving them to the session cache if one is in use
+
+
+def login():
+    # Drop any expired cached cookie so only the new session's one is sent
+    session.cookies.clear()
     login_xml = '''
     <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:urn="urn:vim25">
        <soapenv:Header/>
@@ -95,9 +170,7 @@ try:
     '''.format(username=username, password=password)
     # At this point I didn't think this was going to be so bad, these SOAP queries are simple and straightforward. Easy peasy - why do people hate SOAP???
 
-    headers = {'Content-Type': 'text/xml', 'SOAPAction': 'urn:vim25/6.5'}
-    url = f'https://{vsphere_host}/sdk'
-    response = send_soap_request(url, headers, login_xml)
+    send_soap_request(url, headers, login_xml, relogin=False)
 
     # Retrieve the root folder MoRef
     retrieve_service_content_xml = '''
@@ -112,381 +185,616 @@ try:
     '''
     # Easy queries, right?
 
-    response = send_soap_request(url, headers, retrieve_service_content_xml)
+    response = send_soap_request(url, headers, retrieve_service_content_xml, relogin=False)
     root = ET.fromstring(response)
-    # namespaces = {'soapenv': 'http://schemas.xmlsoap.org/soap/envelope/', 'urn': 'urn:vim25'}
-    namespaces = {'soapenv': 'http://schemas.xmlsoap.org/soap/envelope/', 'urn': 'urn:vim25', 'vim25': 'urn:vim25'}
-    root_folder_moref = root.find('.//urn:rootFolder', namespaces).text
+    for name in ('rootFolder', 'propertyCollector', 'sessionManager', 'perfManager'):
+        element = root.find('.//urn:' + name, namespaces)
+        if element is not None:
+            service_content[name] = element.text
+    if args.session_cache:
+        save_session_cache()
+
+# Function to restore the session cookie and service content from the session cache
+# The cache only applies to the vCenter and user it was saved for
+
+
+def load_session_cache():
+    global session_cached
+    try:
+        with open(args.session_cache, 'r') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if cache.get('vsphere_host') != vsphere_host or cache.get('username') != username or not cache.get('cookie'):
+        return False
+    session.cookies.set('vmware_soap_session', cache['cookie'])
+    service_content.update(cache['service_content'])
+    session_cached = True
+    return True
+
+# Function to save the session cookie and service content, readable only by the monitoring user
+
+
+def save_session_cache():
+    global session_cached
+    cache = {
+        'vsphere_host': vsphere_host,
+        'username': username,
+        'cookie': session.cookies.get('vmware_soap_session'),
+        'service_content': service_content,
+    }
+    temporary_path = args.session_cache + '.tmp'
+    fd = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(cache, f)
+    os.replace(temporary_path, args.session_cache)
+    session_cached = True
+
+# Function to file one ObjectContent from the inventory by type
+# Hosts are kept per parent cluster, as the cluster to check is only known once every page has been read
+
+
+def store_inventory_object(obj_content, cluster_names, datastore_info, hosts_by_cluster, vm_heaps):
+    obj = None
+    props = {}
+    for child in obj_content:
+        if child.tag == prop_set_tag:
+            prop_name = prop_value = None
+            for field in child:
+                if field.tag == name_tag:
+                    prop_name = field.text
+                elif field.tag == val_tag:
+                    prop_value = field.text
+            props[prop_name] = prop_value
+        elif child.tag == obj_tag:
+            obj = child
+    store_inventory_props(obj.get('type'), obj.text, props, cluster_names, datastore_info, hosts_by_cluster, vm_heaps)
+
+# Function to file one object's properties, given as the text vCenter sent them, by type
+
+
+def store_inventory_props(object_type, object_moref, props, cluster_names, datastore_info, hosts_by_cluster, vm_heaps):
     if args.debug:
-        print(f"Root Folder MoRef: {root_folder_moref}")
+        pprint((object_moref, props))
+
+    if object_type == 'ClusterComputeResource':
+        cluster_names[object_moref] = props.get('name', object_moref)
+    elif object_type == 'Datastore':
+        if 'summary.name' in props and 'summary.capacity' in props and 'summary.freeSpace' in props:
+            datastore = {'object_moref': object_moref, 'name': props['summary.name'], 'capacity': int(props['summary.capacity']), 'freeSpace': int(props['summary.freeSpace'])}
+            datastore['used'] = int(datastore['capacity'] - datastore['freeSpace'])
+            datastore['used_pct'] = float((datastore['used'] / datastore['capacity']) * 100)
+            datastore_info[object_moref] = datastore
+    elif object_type == 'HostSystem':
+        if 'name' in props and 'hardware.memorySize' in props and 'summary.hardware.cpuMhz' in props and 'summary.hardware.numCpuCores' in props:
+            host_data = {
+                'name': str(props['name']),
+                'memorySize': int(props['hardware.memorySize']),
+                # overallMemoryUsage is in MB, unlike hardware.memorySize
+                'memoryUsage': int(props.get('summary.quickStats.overallMemoryUsage') or 0) * 1048576,
+                'cpuMhz': int(props['summary.hardware.cpuMhz']),
+                'numCpuCores': int(props['summary.hardware.numCpuCores']),
+                'cpuUsage': int(props.get('summary.quickStats.overallCpuUsage') or 0),
+            }
+            host_data['cpuTotalMhz'] = int(host_data['cpuMhz'] * host_data['numCpuCores'])
+            host_data['cpu_usage_pct'] = float((host_data['cpuUsage'] / host_data['cpuTotalMhz']) * 100)
+            host_data['memory_usage_pct'] = float((host_data['memoryUsage'] / host_data['memorySize']) * 100)
+            hosts_by_cluster.setdefault(props.get('parent'), {})[object_moref] = host_data
+    elif object_type == 'VirtualMachine' and args.top_vms:
+        # Keep only the top_vms biggest consumers per host, smallest first so it is the one pushed out
+        heaps = vm_heaps.setdefault(props.get('runtime.host'), {'cpu': [], 'mem': []})
+        for resource, prop_name in (('cpu', 'summary.quickStats.overallCpuUsage'), ('mem', 'summary.quickStats.hostMemoryUsage')):
+            entry = (int(props.get(prop_name) or 0), props.get('name', object_moref))
+            if len(heaps[resource]) < args.top_vms:
+                heapq.heappush(heaps[resource], entry)
+            else:
+                heapq.heappushpop(heaps[resource], entry)
+
+# Function to get the counter IDs for perf_counter_names, from the counter cache when it has them all for this vCenter
+# Counter IDs are fixed for a vCenter, so the full counter list only has to be read once
 
-    # Retrieve the cluster MoRef
-    retrieve_clusters_xml = '''
+
+def get_perf_counters():
+    if args.perf_counter_cache:
+        try:
+            with open(args.perf_counter_cache, 'r') as f:
+                cache = json.load(f)
+            if cache.get('vsphere_host') == vsphere_host and all(name in cache['counters'] for name in perf_counter_names):
+                return cache['counters']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    retrieve_perf_counters_xml = '''
     <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:urn="urn:vim25">
        <soapenv:Header/>
        <soapenv:Body>
           <urn:RetrieveProperties>
-             <_this type="PropertyCollector">propertyCollector</_this>
+             <_this type="PropertyCollector">{property_collector_moref}</_this>
              <specSet>
                 <propSet>
-                   <type>ClusterComputeResource</type>
+                   <type>PerformanceManager</type>
                    <all>false</all>
-                   <pathSet>name</pathSet>
+                   <pathSet>perfCounter</pathSet>
                 </propSet>
                 <objectSet>
-                   <obj type="Folder">group-d1</obj>
+                   <obj type="PerformanceManager">{perf_manager_moref}</obj>
                    <skip>false</skip>
-                   <selectSet xsi:type="urn:TraversalSpec" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
-                      <name>visitFolders</name>
-                      <type>Folder</type>
-                      <path>childEntity</path>
-                      <skip>false</skip>
-                      <selectSet>
-                         <name>visitFolders</name>
-                      </selectSet>
-                      <selectSet xsi:type="urn:TraversalSpec">
-                         <name>dcToHf</name>
-                         <type>Datacenter</type>
-                         <path>hostFolder</path>
-                         <skip>false</skip>
-                         <selectSet>
-                            <name>visitFolders</name>
-                         </selectSet>
-                      </selectSet>
-                      <selectSet xsi:type="urn:TraversalSpec">
-                         <name>crToH</name>
-                         <type>ComputeResource</type>
-                         <path>host</path>
-                         <skip>false</skip>
-                      </selectSet>
-                      <selectSet xsi:type="urn:TraversalSpec">
-                         <name>crToRp</name>
-                         <type>ComputeResource</type>
-                         <path>resourcePool</path>
-                         <skip>false</skip>
-                         <selectSet>
-                            <name>rpToRp</name>
-                         </selectSet>
-                      </selectSet>
-                      <selectSet xsi:type="urn:TraversalSpec">
-                         <name>rpToRp</name>
-                         <type>ResourcePool</type>
-                         <path>resourcePool</path>
-                         <skip>false</skip>
-                         <selectSet>
-                            <name>rpToRp</name>
-                         </selectSet>
-                      </selectSet>
-                   </selectSet>
                 </objectSet>
              </specSet>
           </urn:RetrieveProperties>
        </soapenv:Body>
     </soapenv:Envelope>
-    '''
-    # Oh.  This is why people hate SOAP.  I also hate SOAP - I consider the risks of remaining unwashed for weeks on end after this query.
+    '''.format(property_collector_moref=service_content['propertyCollector'], perf_manager_moref=service_content['perfManager'])
 
-    response = send_soap_request(url, headers, retrieve_clusters_xml)
-    root = ET.fromstring(response)
-    cluster_moref = None
+    counters = {}
+    response = post_soap_request(url, headers, retrieve_perf_counters_xml, stream=True)
+    response.raw.decode_content = True
+    try:
+        for event, element in ET.iterparse(response.raw, events=('end',)):
+            if element.tag == perf_counter_info_tag:
+                name = '.'.join((element.findtext('urn:groupInfo/urn:key', '', namespaces), element.findtext('urn:nameInfo/urn:key', '', namespaces), element.findtext('urn:rollupType', '', namespaces)))
+                if name in perf_counter_names:
+                    counters[name] = int(element.findtext('urn:key', '', namespaces))
+                element.clear()
+    finally:
+        response.close()
+    missing = [name for name in perf_counter_names if name not in counters]
+    if missing:
+        raise Exception(f"vCenter has no performance counters {', '.join(missing)}")
+
+    if args.perf_counter_cache:
+        temporary_path = args.perf_counter_cache + '.tmp'
+        fd = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'vsphere_host': vsphere_host, 'counters': counters}, f)
+        os.replace(temporary_path, args.perf_counter_cache)
+    return counters
+
+# Function to average the last perf_samples realtime samples of each counter for every host, in one QueryPerf call
+# Returns {host moref: {counter name: average}}, leaving out counters a host had no samples for
+
+
+def query_host_perf(host_morefs, counters):
+    metric_ids = ''.join(f'<metricId><counterId>{counters[name]}</counterId><instance></instance></metricId>' for name in perf_counter_names)
+    query_specs = ''.join(f'<querySpec><entity type="HostSystem">{moref}</entity><maxSample>{args.perf_samples}</maxSample>{metric_ids}<intervalId>{perf_interval}</intervalId><format>csv</format></querySpec>' for moref in host_morefs)
+    query_perf_xml = '''
+    <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:urn="urn:vim25">
+       <soapenv:Header/>
+       <soapenv:Body>
+          <urn:QueryPerf>
+             <_this type="PerformanceManager">{perf_manager_moref}</_this>
+             {query_specs}
+          </urn:QueryPerf>
+       </soapenv:Body>
+    </soapenv:Envelope>
+    '''.format(perf_manager_moref=service_content['perfManager'], query_specs=query_specs)
 
-    for obj_content in root.findall('.//vim25:returnval/vim25:obj', namespaces):
-        cluster_moref = obj_content.text
-        if args.debug:
-            print(f"Cluster MoRef: {cluster_moref}")
-        break
+    counter_names = {counter_id: name for name, counter_id in counters.items()}
+    host_perf = {}
+    response = post_soap_request(url, headers, query_perf_xml, stream=True)
+    response.raw.decode_content = True
+    try:
+        for event, element in ET.iterparse(response.raw, events=('end',)):
+            if element.tag != returnval_tag:
+                continue
+            averages = {}
+            for child in element:
+                if child.tag != value_tag:
+                    continue
+                name = counter_names.get(int(child.findtext('urn:id/urn:counterId', '0', namespaces)))
+                # -1 marks a sample vCenter has no value for
+                samples = [int(sample) for sample in (child.findtext('urn:value', '', namespaces) or '').split(',') if sample and int(sample) >= 0]
+                if name and samples:
+                    averages[name] = sum(samples) / len(samples)
+            host_perf[element.findtext('urn:entity', '', namespaces)] = averages
+            element.clear()
+    finally:
+        response.close()
+    return host_perf
 
-    if not cluster_moref:
-        print("No cluster found.")
-        sys.exit(1)
+# Function to logout
 
-    # Retrieve datastore details
-    retrieve_datastore_xml = '''
-    <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:urn="urn:vim25" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+
+def logout():
+    logout_xml = '''
+    <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:urn="urn:vim25">
        <soapenv:Header/>
        <soapenv:Body>
-          <urn:RetrieveProperties>
-             <_this type="PropertyCollector">propertyCollector</_this>
-             <specSet>
-                <propSet>
-                   <type>Datastore</type>
-                   <all>false</all>
-                   <pathSet>summary.name</pathSet>
-                   <pathSet>summary.capacity</pathSet>
-                   <pathSet>summary.freeSpace</pathSet>
-                </propSet>
-                <objectSet>
-                   <obj type="Folder">{root_folder_moref}</obj>
-                   <skip>false</skip>
-                   <selectSet xsi:type="urn:TraversalSpec">
-                      <name>visitFolders</name>
-                      <type>Folder</type>
-                      <path>childEntity</path>
-                      <skip>false</skip>
-                      <selectSet xsi:type="urn:TraversalSpec">
-                         <name>dcToDs</name>
-                         <type>Datacenter</type>
-                         <path>datastore</path>
-                         <skip>false</skip>
-                      </selectSet>
-                   </selectSet>
-                </objectSet>
-             </specSet>
-          </urn:RetrieveProperties>
+          <urn:Logout>
+             <_this type="SessionManager">{session_manager}</_this>
+          </urn:Logout>
        </soapenv:Body>
     </soapenv:Envelope>
-    '''.format(root_folder_moref=root_folder_moref)
-    # Please God, no!  NO NO! _Author begins crying into his water
+    '''.format(session_manager=service_content.get('sessionManager', 'SessionManager'))
+    try:
+        send_soap_request(url, headers, logout_xml, relogin=False)
+    except Exception as e:
+        print(f"Failed to logout: {e}")
+#   else:
+#       print("Logged out")
 
-    response = send_soap_request(url, headers, retrieve_datastore_xml)
-    if args.debug:
-        print("datastore response:")
-        pprint(response)
-    # Parse the response
-    root = ET.fromstring(response)
 
-    # Find all returnval elements
-    datastores = root.findall('.//urn:returnval', namespaces)
+# Function to authenticate and get the session cookie, unless the session cache has one for us
 
-    # Dictionary to store datastore information
-    datastore_info = {}
 
-    # Extract capacity and used values
-    for ds in datastores:
-        datastore = {}
-        name = None
-
-        # Get object_moref
-        object_moref = ds.find('urn:obj', namespaces).text
-        datastore['object_moref'] = object_moref
-        for prop in ds.findall('urn:propSet', namespaces):
-            prop_name = prop.find('urn:name', namespaces).text
-            prop_value = prop.find('urn:val', namespaces).text
-            if args.debug:
-                pprint(prop_name + " " + prop_value)
-                print("----------------")
-            if prop_name == 'summary.name':
-                datastore['name'] = prop_value
-            elif prop_name == 'summary.capacity': 
-                datastore['capacity'] = int(prop_value)
-            elif prop_name == 'summary.freeSpace':
-                datastore['freeSpace'] = int(prop_value)
-
-            if 'name' in datastore and 'capacity' in datastore and 'freeSpace' in datastore:
-                datastore['used'] = int(datastore['capacity'] - datastore['freeSpace'])
-                datastore['used_pct'] = float((datastore['used'] / datastore['capacity']) * 100)
-                if args.debug:
-                    pprint(datastore)
-                datastore_info[object_moref] = datastore
-                if args.debug:
-                    print("----------------")
-        if args.debug:
-            print("--------b2--------")
-        # Print the datastore information
-        if args.debug:
-            for name, info in datastore_info.items():
-                print(f"Datastore Name: {name}")
-                print(f"Object MoRef: {info['object_moref']}")
-                print(f"Total Capacity: {info['capacity']} bytes")
-                print(f"Free Space: {info['freeSpace']} bytes")
-                print(f"Used Space: {info['used']} bytes")
-                print("----------------------------")
-    if args.debug:            
-        pprint(datastore_info)
+def connect():
+    if not (args.session_cache and load_session_cache()):
+        login()
+
+# Function to read clusters, datastores and hosts straight from vCenter
 
-    # Retrieve host details
-    retrieve_hosts_xml = '''
+
+def retrieve_inventory(cluster_names, datastore_info, hosts_by_cluster, vm_heaps):
+    root_folder_moref = service_content['rootFolder']
+    property_collector_moref = service_content['propertyCollector']
+    if args.debug:
+        print(f"Root Folder MoRef: {root_folder_moref}")
+
+    # Retrieve clusters, datastores and hosts in one traversal of the inventory, a page of maxObjects at a time
+    retrieve_inventory_xml = '''
     <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:urn="urn:vim25" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
        <soapenv:Header/>
        <soapenv:Body>
-          <urn:RetrieveProperties>
-             <_this type="PropertyCollector">propertyCollector</_this>
+          <urn:RetrievePropertiesEx>
+             <_this type="PropertyCollector">{property_collector_moref}</_this>
              <specSet>
+                <propSet>
+                   <type>ClusterComputeResource</type>
+                   <all>false</all>
+                   <pathSet>name</pathSet>
+                </propSet>
+                <propSet>
+                   <type>Datastore</type>
+                   <all>false</all>
+                   <pathSet>summary.name</pathSet>
+                   <pathSet>summary.capacity</pathSet>
+                   <pathSet>summary.freeSpace</pathSet>
+                </propSet>
                 <propSet>
                    <type>HostSystem</type>
                    <all>false</all>
                    <pathSet>name</pathSet>
+                   <pathSet>parent</pathSet>
                    <pathSet>hardware.memorySize</pathSet>
                    <pathSet>summary.quickStats.overallMemoryUsage</pathSet>
                    <pathSet>summary.hardware.cpuMhz</pathSet>
                    <pathSet>summary.hardware.numCpuCores</pathSet>
                    <pathSet>summary.quickStats.overallCpuUsage</pathSet>
-                </propSet>
+                </propSet>{vm_prop_set}
                 <objectSet>
-                   <obj type="ComputeResource">{cluster_moref}</obj>
+                   <obj type="Folder">{root_folder_moref}</obj>
                    <skip>false</skip>
+                   <selectSet xsi:type="urn:TraversalSpec">
+                      <name>visitFolders</name>
+                      <type>Folder</type>
+                      <path>childEntity</path>
+                      <skip>false</skip>
+                      <selectSet>
+                         <name>visitFolders</name>
+                      </selectSet>
+                      <selectSet>
+                         <name>dcToHf</name>
+                      </selectSet>
+                      <selectSet>
+                         <name>dcToDs</name>
+                      </selectSet>
+                      <selectSet>
+                         <name>crToH</name>
+                      </selectSet>
+                   </selectSet>
+                   <selectSet xsi:type="urn:TraversalSpec">
+                      <name>dcToHf</name>
+                      <type>Datacenter</type>
+                      <path>hostFolder</path>
+                      <skip>false</skip>
+                      <selectSet>
+                         <name>visitFolders</name>
+                      </selectSet>
+                   </selectSet>
+                   <selectSet xsi:type="urn:TraversalSpec">
+                      <name>dcToDs</name>
+                      <type>Datacenter</type>
+                      <path>datastore</path>
+                      <skip>false</skip>
+                   </selectSet>
                    <selectSet xsi:type="urn:TraversalSpec">
                       <name>crToH</name>
                       <type>ComputeResource</type>
                       <path>host</path>
-                      <skip>false</skip>
-                   </selectSet>
+                      <skip>false</skip>{vm_traversal}
+                   </selectSet>{vm_traversal_spec}
                 </objectSet>
              </specSet>
-          </urn:RetrieveProperties>
+             <options>
+                <maxObjects>{max_objects}</maxObjects>
+             </options>
+          </urn:RetrievePropertiesEx>
        </soapenv:Body>
     </soapenv:Envelope>
-    '''.format(cluster_moref=cluster_moref)
+    '''.format(root_folder_moref=root_folder_moref, property_collector_moref=property_collector_moref, max_objects=args.max_objects,
+               vm_prop_set=vm_prop_set_xml if args.top_vms else '', vm_traversal=vm_traversal_xml if args.top_vms else '', vm_traversal_spec=vm_traversal_spec_xml if args.top_vms else '')
+    # Oh.  This is why people hate SOAP.  I also hate SOAP - I consider the risks of remaining unwashed for weeks on end after this query.
     #  This query took DAYS to figure out.  I began to hate life.  Waking up was sweet releif, because only XML/SOAP haunted my dreams.
     #  I began eyeing dull spoons from the flatware drawer and my family watched me with concern.
     #  Stabbing a leg with one dulls the pain, did you know that? Mostly because it takes forever and does minimal damage with maximum pain!
 
-    response = send_soap_request(url, headers, retrieve_hosts_xml)
-    # Parse the response
-    root = ET.fromstring(response)
-    # Find all returnval elements
-    hosts = root.findall('.//urn:returnval', namespaces)
-    # Dictionary to store host information
-    host_info = {}
+    continue_inventory_xml = '''
+    <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:urn="urn:vim25">
+       <soapenv:Header/>
+       <soapenv:Body>
+          <urn:ContinueRetrievePropertiesEx>
+             <_this type="PropertyCollector">{property_collector_moref}</_this>
+             <token>{token}</token>
+          </urn:ContinueRetrievePropertiesEx>
+       </soapenv:Body>
+    </soapenv:Envelope>
+    '''
+
+    def on_inventory_object(obj_content):
+        store_inventory_object(obj_content, cluster_names, datastore_info, hosts_by_cluster, vm_heaps)
+
+    token = stream_inventory_page(retrieve_inventory_xml, on_inventory_object)
+    while token is not None:
+        token = stream_inventory_page(continue_inventory_xml.format(property_collector_moref=property_collector_moref, token=token), on_inventory_object)
+
+# Function to read clusters, datastores and hosts from vsphere_inventory_daemon.py instead of vCenter
+# The daemon keeps answering from its last known inventory when it loses vCenter, so an old one is reported as UNKNOWN
+
+
+def read_inventory_socket(cluster_names, datastore_info, hosts_by_cluster, vm_heaps):
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as inventory_socket:
+            inventory_socket.settimeout(args.inventory_timeout)
+            inventory_socket.connect(args.inventory_socket)
+            chunks = []
+            while True:
+                chunk = inventory_socket.recv(1048576)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        inventory = json.loads(b''.join(chunks))
+    except (OSError, ValueError) as e:
+        print(f"[UNKNOWN] Could not read the vSphere inventory from {args.inventory_socket}: {e}")
+        sys.exit(3)
+    if inventory['synced_at'] is None:
+        print(f"[UNKNOWN] vSphere inventory daemon has not synced with {inventory['vsphere_host']} yet: {inventory['error'] or 'starting'}")
+        sys.exit(3)
+    age = time.time() - inventory['synced_at']
+    if age > args.inventory_max_age:
+        print(f"[UNKNOWN] vSphere inventory is {age:.0f}s stale, last synced with {inventory['vsphere_host']} at {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(inventory['synced_at']))}: {inventory['error'] or 'no updates'}")
+        sys.exit(3)
+    for object_moref, (object_type, props) in inventory['objects'].items():
+        store_inventory_props(object_type, object_moref, props, cluster_names, datastore_info, hosts_by_cluster, vm_heaps)
+
+
+try:
+    # Convert thresholds to percentages
+    datastore_warning_pct = args.datastore_warning
+    datastore_critical_pct = args.datastore_critical
+    cpu_warning_pct = args.cpu_warning
+    cpu_critical_pct = args.cpu_critical
+    memory_warning_pct = args.memory_warning
+    memory_critical_pct = args.memory_critical
+
+    # Cluster names in the order vCenter returned them, datastores, and hosts grouped by the cluster they are in
+    cluster_names = {}
+    datastore_info = {}
+    hosts_by_cluster = {}
+    # Per host heaps of the biggest VM consumers, for --top_vms
+    vm_heaps = {}
+    # Responses are parsed as they stream in, so parsing them counts as fetch time
+    if args.inventory_socket:
+        monitor_timings.phase('fetch')
+        read_inventory_socket(cluster_names, datastore_info, hosts_by_cluster, vm_heaps)
+    else:
+        connect()
+        monitor_timings.phase('fetch')
+        retrieve_inventory(cluster_names, datastore_info, hosts_by_cluster, vm_heaps)
+    monitor_timings.phase('evaluate')
 
-    # Extract host details
-    for host in hosts:
-        host_data = {}
-        name = None
-        # Get object_moref
-        object_moref = host.find('urn:obj', namespaces).text
-        #host_data['object_moref'] = object_moref
+    # Every cluster's hosts are checked, hosts outside a cluster are not
+    if not cluster_names:
+        print("No cluster found.")
+        sys.exit(1)
+    host_info = {}
+    for cluster_moref in cluster_names:
+        host_info.update(hosts_by_cluster.get(cluster_moref, {}))
+    if args.debug:
+        pprint(cluster_names)
+        pprint(datastore_info)
+        pprint(host_info)
+
+    # Replace the instantaneous quickStats with short-window averages, and add ready time and datastore latency
+    if args.perf:
+        if not service_content:
+            monitor_timings.phase('connect')
+            connect()
+        monitor_timings.phase('fetch')
+        host_perf = query_host_perf(list(host_info), get_perf_counters())
+        monitor_timings.phase('evaluate')
+        for moref, info in host_info.items():
+            perf = host_perf.get(moref, {})
+            if 'cpu.usage.average' in perf:
+                # Percent in hundredths
+                info['cpu_usage_pct'] = perf['cpu.usage.average'] / 100
+                info['cpuUsage'] = int(info['cpuTotalMhz'] * info['cpu_usage_pct'] / 100)
+            if 'mem.consumed.average' in perf:
+                # KB
+                info['memoryUsage'] = int(perf['mem.consumed.average'] * 1024)
+                info['memory_usage_pct'] = float((info['memoryUsage'] / info['memorySize']) * 100)
+            # Milliseconds ready per sample interval, summed over all the host's VMs, as a share of the host's cores
+            info['ready_pct'] = perf.get('cpu.ready.summation', 0) / (perf_interval * 1000 * info['numCpuCores']) * 100
+            info['latency_ms'] = perf.get('datastore.maxTotalLatency.latest', 0)
         if args.debug:
-            print(object_moref)
-        for prop in host.findall('urn:propSet', namespaces):
-            prop_name = prop.find('urn:name', namespaces).text
-            prop_value = prop.find('urn:val', namespaces).text
-            if args.debug:
-                pprint(prop_name + " :  " + prop_value)
-
-            if prop_name == 'name':
-                host_data['name'] = str(prop_value)
-            elif prop_name == 'hardware.memorySize':
-                host_data['memorySize'] = int(prop_value)
-            elif prop_name == 'summary.quickStats.overallMemoryUsage':
-                host_data['memoryUsage'] = int(prop_value)
-            elif prop_name == 'summary.hardware.cpuMhz':
-                host_data['cpuMhz'] = int(prop_value)
-            elif prop_name == 'summary.hardware.numCpuCores':
-                host_data['numCpuCores'] = int(prop_value)
-            elif prop_name == 'summary.quickStats.overallCpuUsage':
-                host_data['cpuUsage'] = int(prop_value)
+            pprint(host_perf)
+
+    # Step 6: Calculate all Values needed for State Check vs Expected and Prepare Nagios Output datastructure.
+    global_critical_state = 0
+    global_warning_state = 0
+    output = {}
+    output["Hosts"] = {}
+    for name, info in host_info.items():
+        output["Hosts"][name] = {}
+        output["Hosts"][name]["commonname"] = {info['name']}
+        output["Hosts"][name]["cpu"] = {}
+        output["Hosts"][name]["cpu"]["pct"] = '%.3f'%float(info['cpu_usage_pct'])
+        output["Hosts"][name]["cpu"]["total"] = info['cpuTotalMhz']
+        output["Hosts"][name]["cpu"]["used"] = info['cpuUsage']
+        output["Hosts"][name]["cpu"]["status"] = "[OK]"  # Default to Good Status
+        output["Hosts"][name]["mem"] = {}
+        output["Hosts"][name]["mem"]["pct"] = '%.5f'%float(info['memory_usage_pct'])
+        output["Hosts"][name]["mem"]["total"] = '%.2f'%float(info['memorySize'] / 1073741824)
+        output["Hosts"][name]["mem"]["used"] = '%.2f'%float(info['memoryUsage'] / 1073741824)
+        output["Hosts"][name]["mem"]["status"] = "[OK]"  # Default to Good Status
+        # Per host gauges for monitor_exporter.py
+        monitor_metrics.gauge('vsphere_host_cpu_usage_percent', info['cpu_usage_pct'], host=info['name'])
+        monitor_metrics.gauge('vsphere_host_memory_usage_percent', info['memory_usage_pct'], host=info['name'])
+        if args.perf:
+            monitor_metrics.gauge('vsphere_host_cpu_ready_percent', info['ready_pct'], host=info['name'])
+            monitor_metrics.gauge('vsphere_host_datastore_latency_seconds', info['latency_ms'] / 1000, host=info['name'])
 
         if args.debug:
-            pprint(host_data)
-            print("---3----")
-        if 'name' in host_data and 'memorySize' in host_data and 'cpuMhz' in host_data and 'numCpuCores' in host_data:
+            print("----7----")
+            print(f"Host ObjMoref: {name}")
+            print(f"Host Name: {info['name']}")
+            print(f"Total Memory: {info['memorySize']} bytes")
+            print(f"Memory Usage: {info['memoryUsage']} bytes")
+            print(f"Total CPU: {info['cpuTotalMhz']} MHz")
+            print(f"CPU Usage: {info['cpuUsage']} MHz")
+            print(f"CPU Usage Pct: {info['cpu_usage_pct']}")
+            print(f"Mem Usage Pct: {info['memory_usage_pct']}")
+            print("----------------------------")
+            print("----8----")
+
+        if info['cpu_usage_pct'] > cpu_critical_pct:
             if args.debug:
-                print("---4----")
-            host_data['cpuTotalMhz'] = int(host_data['cpuMhz'] * host_data['numCpuCores'])
-            host_data['cpu_usage_pct'] = float((host_data['cpuUsage'] / host_data['cpuTotalMhz']) * 100)
-            host_data['memory_usage_pct'] = float((host_data['memoryUsage'] / host_data['memorySize']) * 100)
-            host_info[object_moref] = host_data
-        if args.debug:
-            pprint(host_info)
-            print("---5----")
-            pprint(host_info)
-            print("---6----")
-            # Print the host information
-
-# Step 6: Calculate all Values needed for State Check vs Expected and Prepare Nagios Output datastructure.
-        global_critical_state = 0
-        global_warning_state = 0
-        output = {}
-        output["Hosts"] = {}
-        for name, info in host_info.items():
-            output["Hosts"][name] = {}
-            output["Hosts"][name]["commonname"] = {info['name']}
-            output["Hosts"][name]["cpu"] = {}
-            output["Hosts"][name]["cpu"]["pct"] = '%.3f'%float(info['cpu_usage_pct'])
-            output["Hosts"][name]["cpu"]["total"] = info['cpuTotalMhz']
-            output["Hosts"][name]["cpu"]["used"] = info['cpuUsage']
-            output["Hosts"][name]["cpu"]["status"] = "[OK]"  # Default to Good Status
-            output["Hosts"][name]["mem"] = {}
-            output["Hosts"][name]["mem"]["pct"] = '%.5f'%float(info['memory_usage_pct'])
-            output["Hosts"][name]["mem"]["total"] = '%.2f'%float(info['memorySize'] / 1073741824)
-            output["Hosts"][name]["mem"]["used"] = '%.2f'%float(info['memoryUsage'] / 1073741824)
-            output["Hosts"][name]["mem"]["status"] = "[OK]"  # Default to Good Status
+                print("ccritical")
+            output["Hosts"][name]["cpu"]["status"] = "[CRITICAL]"
+            global_critical_state = 1
+        elif info['cpu_usage_pct'] > cpu_warning_pct:
+            if args.debug:
+                print("cwarn")
+            output["Hosts"][name]["cpu"]["status"] = "[WARNING]"
+            global_warning_state = 1
+        else:
+            if args.debug:
+                print("cok")
 
+        if info['memory_usage_pct'] > memory_critical_pct:
+            if args.debug:
+                print("mcritical")
+            output["Hosts"][name]["mem"]["status"] = "[CRITICAL]"
+            global_critical_state = 1
+        elif info['memory_usage_pct'] > memory_warning_pct:
+            if args.debug:
+                print("mwarn")
+            output["Hosts"][name]["mem"]["status"] = "[WARNING]"
+            global_warning_state = 1
+        else:
             if args.debug:
-                print("----7----")
-                print(f"Host ObjMoref: {name}")
-                print(f"Host Name: {info['name']}")
-                print(f"Total Memory: {info['memorySize']} bytes")
-                print(f"Memory Usage: {info['memoryUsage']} bytes")
-                print(f"Total CPU: {info['cpuTotalMhz']} MHz")
-                print(f"CPU Usage: {info['cpuUsage']} MHz")
-                print(f"CPU Usage Pct: {info['cpu_usage_pct']}")
-                print(f"Mem Usage Pct: {info['memory_usage_pct']}")
-                print("----------------------------")
-                print("----8----")
-
-            if info['cpu_usage_pct'] > cpu_critical_pct:
-                if args.debug:
-                    print("ccritical")
-                output["Hosts"][name]["cpu"]["status"] = "[CRITICAL]"
+                print("mok")
+        if args.perf:
+            output["Hosts"][name]["ready"] = {"pct": '%.3f' % float(info['ready_pct']), "status": "[OK]"}
+            output["Hosts"][name]["latency"] = {"ms": '%.0f' % float(info['latency_ms']), "status": "[OK]"}
+            if info['ready_pct'] > args.ready_critical:
+                output["Hosts"][name]["ready"]["status"] = "[CRITICAL]"
                 global_critical_state = 1
-            elif info['cpu_usage_pct'] > cpu_warning_pct:
-                if args.debug:
-                    print("cwarn")
-                output["Hosts"][name]["cpu"]["status"] = "[WARNING]"
+            elif info['ready_pct'] > args.ready_warning:
+                output["Hosts"][name]["ready"]["status"] = "[WARNING]"
                 global_warning_state = 1
-            else:
-                if args.debug:
-                    print("cok")
-
-            if info['memory_usage_pct'] > memory_critical_pct:
-                if args.debug:
-                    print("mcritical")
-                output["Hosts"][name]["mem"]["status"] = "[CRITICAL]"
+            if info['latency_ms'] > args.latency_critical:
+                output["Hosts"][name]["latency"]["status"] = "[CRITICAL]"
                 global_critical_state = 1
-            elif info['memory_usage_pct'] > memory_warning_pct:
-                if args.debug:
-                    print("mwarn")
-                output["Hosts"][name]["mem"]["status"] = "[WARNING]"
+            elif info['latency_ms'] > args.latency_warning:
+                output["Hosts"][name]["latency"]["status"] = "[WARNING]"
                 global_warning_state = 1
-            else:
-                if args.debug:
-                    print("mok")
-            if output["Hosts"][name]["mem"]["status"] == "[CRITICAL]" or output["Hosts"][name]["cpu"]["status"] == "[CRITICAL]":
-                output["Hosts"][name]["status"] = "[CRITICAL]"
-            elif output["Hosts"][name]["mem"]["status"] == "[WARNING]" or output["Hosts"][name]["cpu"]["status"] == "[WARNING]":
-                output["Hosts"][name]["status"] = "[WARNING]"
-            else:
-                output["Hosts"][name]["status"] = "[OK]"
-        if args.debug:
-            pprint(hosts)
-            pprint("-----nagiosstring-----")
-            pprint(output)
-            print("----9----")
+        host_statuses = [output["Hosts"][name][check]["status"] for check in ("cpu", "mem", "ready", "latency") if check in output["Hosts"][name]]
+        if "[CRITICAL]" in host_statuses:
+            output["Hosts"][name]["status"] = "[CRITICAL]"
+        elif "[WARNING]" in host_statuses:
+            output["Hosts"][name]["status"] = "[WARNING]"
+        else:
+            output["Hosts"][name]["status"] = "[OK]"
+        # Name the VMs most likely responsible on hosts that are not OK
+        if output["Hosts"][name]["status"] != "[OK]" and name in vm_heaps:
+            output["Hosts"][name]["top_vms"] = {resource: sorted(heap, reverse=True) for resource, heap in vm_heaps[name].items()}
+    if args.debug:
+        pprint(host_info)
+        pprint("-----nagiosstring-----")
+        pprint(output)
+        print("----9----")
+
+    # Check aggregate cluster headroom against the same thresholds as the hosts
+    output["Clusters"] = {}
+    for cluster_moref, cluster_name in cluster_names.items():
+        cluster_hosts = hosts_by_cluster.get(cluster_moref, {}).values()
+        cpu_total = sum(info['cpuTotalMhz'] for info in cluster_hosts)
+        cpu_used = sum(info['cpuUsage'] for info in cluster_hosts)
+        mem_total = sum(info['memorySize'] for info in cluster_hosts)
+        mem_used = sum(info['memoryUsage'] for info in cluster_hosts)
+        cpu_pct = float(cpu_used / cpu_total * 100) if cpu_total else 0.0
+        mem_pct = float(mem_used / mem_total * 100) if mem_total else 0.0
+        cluster = output["Clusters"][cluster_moref] = {}
+        cluster["commonname"] = cluster_name
+        cluster["hosts"] = len(cluster_hosts)
+        cluster["cpu"] = {"total": cpu_total, "free": cpu_total - cpu_used, "pct": '%.3f' % cpu_pct, "status": "[OK]"}
+        cluster["mem"] = {"total": '%.2f' % float(mem_total / 1073741824), "free": '%.2f' % float((mem_total - mem_used) / 1073741824), "pct": '%.3f' % mem_pct, "status": "[OK]"}
+        monitor_metrics.gauge('vsphere_cluster_cpu_usage_percent', cpu_pct, cluster=cluster_name)
+        monitor_metrics.gauge('vsphere_cluster_memory_usage_percent', mem_pct, cluster=cluster_name)
+        if cpu_pct > cpu_critical_pct:
+            cluster["cpu"]["status"] = "[CRITICAL]"
+            global_critical_state = 1
+        elif cpu_pct > cpu_warning_pct:
+            cluster["cpu"]["status"] = "[WARNING]"
+            global_warning_state = 1
+        if mem_pct > memory_critical_pct:
+            cluster["mem"]["status"] = "[CRITICAL]"
+            global_critical_state = 1
+        elif mem_pct > memory_warning_pct:
+            cluster["mem"]["status"] = "[WARNING]"
+            global_warning_state = 1
+        if "[CRITICAL]" in (cluster["cpu"]["status"], cluster["mem"]["status"]):
+            cluster["status"] = "[CRITICAL]"
+        elif "[WARNING]" in (cluster["cpu"]["status"], cluster["mem"]["status"]):
+            cluster["status"] = "[WARNING]"
+        else:
+            cluster["status"] = "[OK]"
+    if args.debug:
+        pprint(output["Clusters"])
 
     # Check datastore statuses
-        output["Datastores"] = {}
-        for ds in datastore_info:
-            moref = datastore_info[ds]['object_moref']
-            output["Datastores"][moref] = {}
-            output["Datastores"][moref]["commonname"] = datastore_info[ds]['name']
-            output["Datastores"][moref]["totalGB"] = '%.1f' % float(datastore_info[ds]['capacity'] / 1073741824)  # Covert bytes to GB 
-            output["Datastores"][moref]["usedGB"] = '%.1f' % float(datastore_info[ds]['used'] / 1073741824)  # Covert bytes to GB 
-            output["Datastores"][moref]["pct"] = '%.3f' % (float(datastore_info[ds]['used_pct']))
-            output["Datastores"][moref]["freeGB"] = '%.1f' % float(datastore_info[ds]['freeSpace'] / 1073741824)  # Covert bytes to GB 
-            output["Datastores"][moref]["status"] = "[OK]"  # Default to Good Status
-            if args.debug:
-                print("--------b--------")
-                print(ds)
-                pprint(output)
-                print("--------c--------")
-            if datastore_info[ds]['used_pct'] > datastore_critical_pct:
-                output["Datastores"][moref]["status"] = "[CRITICAL]"  # Default to Good Status
-                datastore_status = "CRITICAL"
-                global_critical_state = 1
-            elif datastore_info[ds]['used_pct'] > datastore_warning_pct:
-                output["Datastores"][moref]["status"] = "[WARNING]"  # Default to Good Status
-                datastore_status = "WARNING"
-                global_warning_state = 1
-            else:
-                if args.debug:
-                    print("ds status OK")
-        # Print Nagios-style output
+    output["Datastores"] = {}
+    for ds in datastore_info:
+        moref = datastore_info[ds]['object_moref']
+        output["Datastores"][moref] = {}
+        output["Datastores"][moref]["commonname"] = datastore_info[ds]['name']
+        output["Datastores"][moref]["totalGB"] = '%.1f' % float(datastore_info[ds]['capacity'] / 1073741824)  # Covert bytes to GB 
+        output["Datastores"][moref]["usedGB"] = '%.1f' % float(datastore_info[ds]['used'] / 1073741824)  # Covert bytes to GB 
+        output["Datastores"][moref]["pct"] = '%.3f' % (float(datastore_info[ds]['used_pct']))
+        output["Datastores"][moref]["freeGB"] = '%.1f' % float(datastore_info[ds]['freeSpace'] / 1073741824)  # Covert bytes to GB 
+        output["Datastores"][moref]["status"] = "[OK]"  # Default to Good Status
+        monitor_metrics.gauge('vsphere_datastore_used_percent', datastore_info[ds]['used_pct'], datastore=datastore_info[ds]['name'])
         if args.debug:
-            print("----finaloutput------")
+            print("--------b--------")
+            print(ds)
             pprint(output)
-            print("----finaloutput------")
+            print("--------c--------")
+        if datastore_info[ds]['used_pct'] > datastore_critical_pct:
+            output["Datastores"][moref]["status"] = "[CRITICAL]"  # Default to Good Status
+            datastore_status = "CRITICAL"
+            global_critical_state = 1
+        elif datastore_info[ds]['used_pct'] > datastore_warning_pct:
+            output["Datastores"][moref]["status"] = "[WARNING]"  # Default to Good Status
+            datastore_status = "WARNING"
+            global_warning_state = 1
+        else:
+            if args.debug:
+                print("ds status OK")
+    # Print Nagios-style output
+    if args.debug:
+        print("----finaloutput------")
+        pprint(output)
+        print("----finaloutput------")
     if global_critical_state:
         global_status = "[CRITICAL]"
         the_exit_code = 2
@@ -498,7 +806,8 @@ try:
         the_exit_code = 0
 
     # Print out the Nagios status-string
-    print(f"{global_status} for VSphere/ESXi cluster")
+    monitor_timings.phase('render')
+    print(f"{global_status} for VSphere/ESXi clusters")
     print("--------------")
     for category in output:
         print(category + ":")
@@ -507,6 +816,16 @@ try:
             if category == "Hosts":
                 print("\t\tcpu: " + str(output[category][entity]["cpu"]["status"]) + " " + str(output[category][entity]["cpu"]["total"]) + " Mhz, " + str(output[category][entity]["cpu"]["pct"]) + "% used")
                 print("\t\tmem: " + str(output[category][entity]["mem"]["status"]) + " " + str(output[category][entity]["mem"]["total"]) + " GiB, " + str(output[category][entity]["mem"]["pct"]) + "% used")
+                if "top_vms" in output[category][entity]:
+                    print("\t\ttop cpu: " + ", ".join(vm_name + " " + str(usage) + " Mhz" for usage, vm_name in output[category][entity]["top_vms"]["cpu"]))
+                    print("\t\ttop mem: " + ", ".join(vm_name + " " + '%.2f' % float(usage / 1024) + " GiB" for usage, vm_name in output[category][entity]["top_vms"]["mem"]))
+                if "ready" in output[category][entity]:
+                    print("\t\tready: " + str(output[category][entity]["ready"]["status"]) + " " + str(output[category][entity]["ready"]["pct"]) + "% of cpu time")
+                    print("\t\tlatency: " + str(output[category][entity]["latency"]["status"]) + " " + str(output[category][entity]["latency"]["ms"]) + " ms highest datastore latency")
+            elif category == "Clusters":
+                print("\t\t" + str(output[category][entity]["commonname"]) + ": " + str(output[category][entity]["hosts"]) + " hosts")
+                print("\t\tcpu: " + str(output[category][entity]["cpu"]["status"]) + " " + str(output[category][entity]["cpu"]["free"]) + " of " + str(output[category][entity]["cpu"]["total"]) + " Mhz free, " + str(output[category][entity]["cpu"]["pct"]) + "% used")
+                print("\t\tmem: " + str(output[category][entity]["mem"]["status"]) + " " + str(output[category][entity]["mem"]["free"]) + " of " + str(output[category][entity]["mem"]["total"]) + " GiB free, " + str(output[category][entity]["mem"]["pct"]) + "% used")
             else:
                 print("\t\t" + str(output[category][entity]["commonname"]) + ": " + str(output[category][entity]["totalGB"]) + " GiB, " + str(output[category][entity]["usedGB"]) + " GiB Used, " + str(output[category][entity]["pct"]) + "% used")
 
@@ -517,5 +836,7 @@ except Exception as e:
     sys.exit(1)
 
 finally:
-    logout()
+    # A cached session is kept for the next run, and answering from the inventory daemon never logs in
+    if service_content and not session_cached:
+        logout()
 # I hate SOAP.
@@ -0,0 +1,277 @@
+#! /usr/bin/python3
+
+"""
+description       :Local stand-in for the vCenter SOAP endpoint, serving a generated inventory of clusters, hosts, datastores and VMs,
+                   so check_esxi_dscpumem.py and vsphere_inventory_daemon.py can be tried and benchmarked without a real vCenter.
+                   Answers Login, RetrieveServiceContent, RetrieveProperties, RetrievePropertiesEx, ContinueRetrievePropertiesEx,
+                   QueryPerf, CreateFilter, WaitForUpdatesEx and Logout, and counts requests at GET /stats.
+                   Any username and password are accepted. A self-signed certificate is made with openssl when none is given.
+license           :Apache License v2
+usage             :fake_vsphere_soap.py --port 8443 --hosts 500 --datastores 2000 ; then point the check's secrets at 127.0.0.1:8443
+"""
+
+import argparse
+import json
+import os
+import random
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+import xml.etree.ElementTree as ET
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from xml.sax.saxutils import escape
+
+parser = argparse.ArgumentParser(description="Fake vCenter SOAP endpoint with a generated inventory.")
+parser.add_argument('--port', type=int, required=False, default=8443, help="Port to listen on, on 127.0.0.1.")
+parser.add_argument('--clusters', type=int, required=False, default=4, help="Number of clusters the hosts are spread over.")
+parser.add_argument('--hosts', type=int, required=False, default=10, help="Number of hosts.")
+parser.add_argument('--datastores', type=int, required=False, default=20, help="Number of datastores.")
+parser.add_argument('--vms_per_host', type=int, required=False, default=5, help="Number of VMs on each host.")
+parser.add_argument('--update_interval', type=float, required=False, default=5, help="Seconds between the changes WaitForUpdatesEx reports.")
+parser.add_argument('--certfile', type=str, required=False, help="PEM certificate to serve, generated when not given.")
+parser.add_argument('--keyfile', type=str, required=False, help="PEM key for --certfile.")
+args = parser.parse_args()
+
+soap_namespace = '{http://schemas.xmlsoap.org/soap/envelope/}'
+vim_namespace = '{urn:vim25}'
+envelope = ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+            '<soapenv:Body>{body}</soapenv:Body></soapenv:Envelope>')
+not_authenticated_fault = ('<soapenv:Fault><faultcode>ServerFaultCode</faultcode><faultstring>The session is not authenticated.</faultstring>'
+                           '<detail><NotAuthenticatedFault xmlns="urn:vim25" xsi:type="NotAuthenticated"><object type="Folder">group-d1</object>'
+                           '<privilegeId>System.View</privilegeId></NotAuthenticatedFault></detail></soapenv:Fault>')
+service_content = ('<rootFolder type="Folder">group-d1</rootFolder><propertyCollector type="PropertyCollector">propertyCollector</propertyCollector>'
+                   '<sessionManager type="SessionManager">SessionManager</sessionManager><perfManager type="PerformanceManager">PerfMgr</perfManager>')
+
+# Performance counters: the ones the check asks for, among a few hundred it does not
+perf_counters = {key: ('sys', f'counter{key}', 'average') for key in range(1, 600)}
+perf_counters.update({2: ('cpu', 'usage', 'average'), 12: ('cpu', 'ready', 'summation'), 98: ('mem', 'consumed', 'average'), 187: ('datastore', 'maxTotalLatency', 'latest')})
+
+# Generated inventory: MoRef -> (type, {property path: value}), with MoRef values as (type, MoRef) tuples.
+# Usage figures vary from object to object, so some hosts and datastores breach usual thresholds.
+inventory = {}
+cluster_morefs = [f'domain-c{cluster + 1}' for cluster in range(args.clusters)]
+for cluster, moref in enumerate(cluster_morefs):
+    inventory[moref] = ('ClusterComputeResource', {'name': f'cluster-{cluster + 1}'})
+for host in range(args.hosts):
+    inventory[f'host-{host + 1}'] = ('HostSystem', {
+        'name': f'esx{host + 1}.example.com',
+        'parent': ('ClusterComputeResource', cluster_morefs[host % args.clusters]),
+        'hardware.memorySize': 549755813888,
+        'summary.quickStats.overallMemoryUsage': 100000 + 2000 * (host % 200),
+        'summary.hardware.cpuMhz': 2600,
+        'summary.hardware.numCpuCores': 32,
+        'summary.quickStats.overallCpuUsage': 10000 + 600 * (host % 120),
+    })
+for datastore in range(args.datastores):
+    inventory[f'datastore-{datastore + 1}'] = ('Datastore', {
+        'summary.name': f'datastore-{datastore + 1}',
+        'summary.capacity': 10995116277760,
+        'summary.freeSpace': 10995116277760 * (5 + datastore % 90) // 100,
+    })
+for vm in range(args.hosts * args.vms_per_host):
+    inventory[f'vm-{vm + 1}'] = ('VirtualMachine', {
+        'name': f'vm-{vm + 1}',
+        'runtime.host': ('HostSystem', f'host-{vm % args.hosts + 1}'),
+        'summary.quickStats.overallCpuUsage': (vm * 37) % 4000,
+        'summary.quickStats.hostMemoryUsage': (vm * 59) % 16384,
+    })
+morefs_by_type = {}
+for moref, (object_type, props) in inventory.items():
+    morefs_by_type.setdefault(object_type, []).append(moref)
+
+sessions = set()
+# Per session property filter, and RetrievePropertiesEx results still to be continued, by token
+session_filters = {}
+continuations = {}
+stats = {'requests': 0, 'bytes_sent': 0, 'methods': {}}
+state_lock = threading.Lock()
+
+
+def val_xml(value, tag='val'):
+    if isinstance(value, tuple):
+        return f'<{tag} type="{value[0]}" xsi:type="ManagedObjectReference">{value[1]}</{tag}>'
+    return f'<{tag} xsi:type="{"xsd:long" if isinstance(value, int) else "xsd:string"}">{escape(str(value))}</{tag}>'
+
+
+def object_content_xml(tag, moref, paths):
+    object_type, props = inventory[moref]
+    prop_sets = ''.join(f'<propSet><name>{path}</name>{val_xml(props[path])}</propSet>' for path in paths if path in props)
+    return f'<{tag}><obj type="{object_type}">{moref}</obj>{prop_sets}</{tag}>'
+
+
+# Objects and paths a PropertyFilterSpec selects. Traversal specs are not followed literally: hosts below a
+# ComputeResource starting object are that cluster's hosts, otherwise every object of each propSet type is selected.
+def select_objects(spec):
+    start = spec.find('objectSet/obj')
+    selected = []
+    for prop_set in spec.findall('propSet'):
+        object_type = prop_set.findtext('type')
+        paths = [path.text for path in prop_set.findall('pathSet')]
+        morefs = morefs_by_type.get(object_type, [])
+        if object_type == 'HostSystem' and start is not None and start.get('type') in ('ComputeResource', 'ClusterComputeResource'):
+            morefs = [moref for moref in morefs if inventory[moref][1]['parent'][1] == start.text]
+        selected.extend((moref, paths) for moref in morefs)
+    return selected
+
+
+# A page of RetrievePropertiesEx results, keeping the rest under a new continuation token
+def retrieve_page(method, selected, page_size, offset):
+    token = ''
+    if offset + page_size < len(selected):
+        token_value = uuid.uuid4().hex
+        with state_lock:
+            continuations[token_value] = (selected, page_size, offset + page_size)
+        token = f'<token>{token_value}</token>'
+    objects = ''.join(object_content_xml('objects', moref, paths) for moref, paths in selected[offset:offset + page_size])
+    return f'<{method}Response xmlns="urn:vim25"><returnval>{token}{objects}</returnval></{method}Response>'
+
+
+def perf_counters_xml():
+    infos = ''.join(f'<PerfCounterInfo xsi:type="PerfCounterInfo"><key>{key}</key><nameInfo><label>{name}</label><summary>{name}</summary><key>{name}</key></nameInfo>'
+                    f'<groupInfo><label>{group}</label><summary>{group}</summary><key>{group}</key></groupInfo><unitInfo><label>-</label><summary>-</summary><key>number</key></unitInfo>'
+                    f'<rollupType>{rollup}</rollupType><statsType>rate</statsType><level>1</level></PerfCounterInfo>'
+                    for key, (group, name, rollup) in perf_counters.items())
+    return (f'<RetrievePropertiesResponse xmlns="urn:vim25"><returnval><obj type="PerformanceManager">PerfMgr</obj>'
+            f'<propSet><name>perfCounter</name><val xsi:type="ArrayOfPerfCounterInfo">{infos}</val></propSet></returnval></RetrievePropertiesResponse>')
+
+
+# CSV samples for every requested counter of every requested host, the last sample missing as vCenter does for the current interval
+def query_perf_xml(request):
+    results = []
+    for spec in request.findall('querySpec'):
+        entity = spec.findtext('entity')
+        host = int(entity.split('-')[-1])
+        samples = int(spec.findtext('maxSample') or 1)
+        values = ''
+        for metric_id in spec.findall('metricId'):
+            counter_id = int(metric_id.findtext('counterId'))
+            base = {'usage': 1500 + 60 * (host % 120), 'consumed': 200000000 + 1000000 * (host % 300), 'ready': 2000 + 500 * (host % 40), 'maxTotalLatency': 2 + host % 40}.get(perf_counters[counter_id][1], 0)
+            csv = ','.join([str(base + (sample % 3) * 10) for sample in range(samples - 1)] + ['-1'])
+            values += f'<value xsi:type="PerfMetricSeriesCSV"><id><counterId>{counter_id}</counterId><instance></instance></id><value>{csv}</value></value>'
+        results.append(f'<returnval xsi:type="PerfEntityMetricCSV"><entity type="HostSystem">{entity}</entity><sampleInfoCSV>20,1970-01-01T00:00:00Z</sampleInfoCSV>{values}</returnval>')
+    return '<QueryPerfResponse xmlns="urn:vim25">' + ''.join(results) + '</QueryPerfResponse>'
+
+
+# The whole filter as entering objects for the first call, then a few hosts' CPU usage changing every update_interval
+def wait_for_updates_xml(request, selected):
+    version = int(request.findtext('version') or 0)
+    if version == 0:
+        updates = [(moref, paths) for moref, paths in selected]
+        kind = 'enter'
+    else:
+        max_wait = float(request.findtext('options/maxWaitSeconds') or args.update_interval)
+        time.sleep(min(max_wait, args.update_interval))
+        if max_wait < args.update_interval:
+            return '<WaitForUpdatesExResponse xmlns="urn:vim25"></WaitForUpdatesExResponse>'
+        hosts = [moref for moref, paths in selected if inventory[moref][0] == 'HostSystem']
+        updates = [(moref, ['summary.quickStats.overallCpuUsage']) for moref in random.sample(hosts, min(3, len(hosts)))]
+        for moref, paths in updates:
+            inventory[moref][1]['summary.quickStats.overallCpuUsage'] = random.randint(1000, 80000)
+        kind = 'modify'
+    object_sets = ''.join(f'<objectSet><kind>{kind}</kind><obj type="{inventory[moref][0]}">{moref}</obj>'
+                          + ''.join(f'<changeSet><name>{path}</name><op>assign</op>{val_xml(inventory[moref][1][path])}</changeSet>' for path in paths if path in inventory[moref][1])
+                          + '</objectSet>' for moref, paths in updates)
+    return (f'<WaitForUpdatesExResponse xmlns="urn:vim25"><returnval><version>{version + 1}</version>'
+            f'<filterSet><filter type="PropertyFilter">session[fake]filter</filter>{object_sets}</filterSet></returnval></WaitForUpdatesExResponse>')
+
+
+class SoapHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *log_args):
+        pass
+
+    def reply(self, code, body, content_type='text/xml; charset=utf-8', cookie=None):
+        data = body.encode()
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        if cookie:
+            self.send_header('Set-Cookie', f'vmware_soap_session="{cookie}"; Path=/; HttpOnly; Secure;')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        with state_lock:
+            stats['bytes_sent'] += len(data)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            with state_lock:
+                answer = json.dumps(stats)
+            self.reply(200, answer, 'application/json')
+        else:
+            self.reply(404, '', 'text/plain')
+
+    def do_POST(self):
+        root = ET.fromstring(self.rfile.read(int(self.headers['Content-Length'])))
+        # Clients qualify only some elements with urn:vim25, so compare local names throughout
+        for element in root.iter():
+            if element.tag.startswith(vim_namespace):
+                element.tag = element.tag[len(vim_namespace):]
+        request = list(root.find(soap_namespace + 'Body'))[0]
+        method = request.tag
+        with state_lock:
+            stats['requests'] += 1
+            stats['methods'][method] = stats['methods'].get(method, 0) + 1
+        session = None
+        for cookie in (self.headers.get('Cookie') or '').split(';'):
+            name, _, value = cookie.strip().partition('=')
+            if name == 'vmware_soap_session':
+                session = value.strip('"')
+
+        if method == 'Login':
+            session = uuid.uuid4().hex
+            with state_lock:
+                sessions.add(session)
+            return self.reply(200, envelope.format(body='<LoginResponse xmlns="urn:vim25"><returnval><key>fake</key><userName>fake</userName></returnval></LoginResponse>'), cookie=session)
+        if method == 'RetrieveServiceContent':
+            return self.reply(200, envelope.format(body=f'<RetrieveServiceContentResponse xmlns="urn:vim25"><returnval>{service_content}</returnval></RetrieveServiceContentResponse>'))
+        if session not in sessions:
+            return self.reply(500, envelope.format(body=not_authenticated_fault))
+        if method == 'Logout':
+            with state_lock:
+                sessions.discard(session)
+                session_filters.pop(session, None)
+            return self.reply(200, envelope.format(body='<LogoutResponse xmlns="urn:vim25"></LogoutResponse>'))
+        if method == 'RetrieveProperties':
+            if request.findtext('specSet/propSet/type') == 'PerformanceManager':
+                return self.reply(200, envelope.format(body=perf_counters_xml()))
+            selected = [item for spec in request.findall('specSet') for item in select_objects(spec)]
+            objects = ''.join(object_content_xml('returnval', moref, paths) for moref, paths in selected)
+            return self.reply(200, envelope.format(body=f'<RetrievePropertiesResponse xmlns="urn:vim25">{objects}</RetrievePropertiesResponse>'))
+        if method == 'RetrievePropertiesEx':
+            selected = [item for spec in request.findall('specSet') for item in select_objects(spec)]
+            return self.reply(200, envelope.format(body=retrieve_page(method, selected, int(request.findtext('options/maxObjects') or 100), 0)))
+        if method == 'ContinueRetrievePropertiesEx':
+            with state_lock:
+                selected, page_size, offset = continuations.pop(request.findtext('token'))
+            return self.reply(200, envelope.format(body=retrieve_page(method, selected, page_size, offset)))
+        if method == 'QueryPerf':
+            return self.reply(200, envelope.format(body=query_perf_xml(request)))
+        if method == 'CreateFilter':
+            with state_lock:
+                session_filters[session] = select_objects(request.find('spec'))
+            return self.reply(200, envelope.format(body='<CreateFilterResponse xmlns="urn:vim25"><returnval type="PropertyFilter">session[fake]filter</returnval></CreateFilterResponse>'))
+        if method == 'WaitForUpdatesEx':
+            return self.reply(200, envelope.format(body=wait_for_updates_xml(request, session_filters.get(session, []))))
+        return self.reply(500, envelope.format(body=f'<soapenv:Fault><faultcode>ServerFaultCode</faultcode><faultstring>{method} is not implemented here</faultstring></soapenv:Fault>'))
+
+
+certfile, keyfile = args.certfile, args.keyfile
+if not certfile:
+    certificate_directory = tempfile.mkdtemp()
+    certfile = os.path.join(certificate_directory, 'cert.pem')
+    keyfile = os.path.join(certificate_directory, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=127.0.0.1', '-keyout', keyfile, '-out', certfile],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+server = ThreadingHTTPServer(('127.0.0.1', args.port), SoapHandler)
+server.daemon_threads = True
+tls = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+tls.load_cert_chain(certfile, keyfile)
+server.socket = tls.wrap_socket(server.socket, server_side=True)
+print(f"Serving {args.clusters} clusters, {args.hosts} hosts, {args.datastores} datastores and {args.hosts * args.vms_per_host} VMs on https://127.0.0.1:{args.port}/sdk", flush=True)
+server.serve_forever()
@@ -0,0 +1,320 @@
+#! /usr/bin/python3
+
+"""
+description       :Keeps a copy of the vSphere cluster, host and datastore inventory in memory, following changes with
+                   WaitForUpdatesEx instead of re-reading the inventory, and hands it to check_esxi_dscpumem.py --inventory_socket
+                   over a local Unix socket. Every answer carries the time vCenter was last heard from, so the check can go
+                   UNKNOWN when the copy is stale.
+license           :Apache License v2
+usage             :vsphere_inventory_daemon.py --secrets /etc/nagios/vsphere.json --socket /run/rhdp-monitoring/vsphere-inventory.sock
+"""
+
+import argparse
+import json
+import os
+import signal
+import socketserver
+import sys
+import threading
+import time
+import requests
+import xml.etree.ElementTree as ET
+from pprint import pprint
+
+# Disable SSL warnings for self-signed certificates
+import urllib3
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+parser = argparse.ArgumentParser(description="Follow the vSphere inventory and serve it to check_esxi_dscpumem.py.")
+parser.add_argument('--secrets', type=str, required=True, help="Path to the secrets JSON file.")
+parser.add_argument('--socket', type=str, required=True, help="Path of the Unix socket to serve the inventory on.")
+parser.add_argument('--max_wait', type=int, required=False, default=60, help="Seconds vCenter may hold a WaitForUpdatesEx call open when nothing changes.")
+parser.add_argument('--retry_interval', type=int, required=False, default=30, help="Seconds to wait before logging in again after losing vCenter.")
+parser.add_argument('--vms', action='store_true', required=False, help="Also follow VMs, for check_esxi_dscpumem.py --top_vms.")
+parser.add_argument('--debug', action='store_true', required=False, help="Enable Debug output.")
+args = parser.parse_args()
+
+with open(args.secrets, 'r') as f:
+    secrets = json.load(f)
+
+vsphere_host = secrets['vsphere_host']
+username = secrets['username']
+password = secrets['password']
+
+headers = {'Content-Type': 'text/xml', 'SOAPAction': 'urn:vim25/6.5'}
+url = f'https://{vsphere_host}/sdk'
+namespaces = {'soapenv': 'http://schemas.xmlsoap.org/soap/envelope/', 'urn': 'urn:vim25'}
+object_set_tag = '{urn:vim25}objectSet'
+returnval_tag = '{urn:vim25}returnval'
+
+soap_envelope = '''
+    <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:urn="urn:vim25" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+       <soapenv:Header/>
+       <soapenv:Body>
+          {body}
+       </soapenv:Body>
+    </soapenv:Envelope>
+    '''
+
+# The same objects and properties check_esxi_dscpumem.py reads with RetrievePropertiesEx, VMs only with --vms
+inventory_spec = '''
+             <spec>
+                <propSet>
+                   <type>ClusterComputeResource</type>
+                   <all>false</all>
+                   <pathSet>name</pathSet>
+                </propSet>
+                <propSet>
+                   <type>Datastore</type>
+                   <all>false</all>
+                   <pathSet>summary.name</pathSet>
+                   <pathSet>summary.capacity</pathSet>
+                   <pathSet>summary.freeSpace</pathSet>
+                </propSet>
+                <propSet>
+                   <type>HostSystem</type>
+                   <all>false</all>
+                   <pathSet>name</pathSet>
+                   <pathSet>parent</pathSet>
+                   <pathSet>hardware.memorySize</pathSet>
+                   <pathSet>summary.quickStats.overallMemoryUsage</pathSet>
+                   <pathSet>summary.hardware.cpuMhz</pathSet>
+                   <pathSet>summary.hardware.numCpuCores</pathSet>
+                   <pathSet>summary.quickStats.overallCpuUsage</pathSet>
+                </propSet>{vm_prop_set}
+                <objectSet>
+                   <obj type="Folder">{root_folder_moref}</obj>
+                   <skip>false</skip>
+                   <selectSet xsi:type="urn:TraversalSpec">
+                      <name>visitFolders</name>
+                      <type>Folder</type>
+                      <path>childEntity</path>
+                      <skip>false</skip>
+                      <selectSet>
+                         <name>visitFolders</name>
+                      </selectSet>
+                      <selectSet>
+                         <name>dcToHf</name>
+                      </selectSet>
+                      <selectSet>
+                         <name>dcToDs</name>
+                      </selectSet>
+                      <selectSet>
+                         <name>crToH</name>
+                      </selectSet>
+                   </selectSet>
+                   <selectSet xsi:type="urn:TraversalSpec">
+                      <name>dcToHf</name>
+                      <type>Datacenter</type>
+                      <path>hostFolder</path>
+                      <skip>false</skip>
+                      <selectSet>
+                         <name>visitFolders</name>
+                      </selectSet>
+                   </selectSet>
+                   <selectSet xsi:type="urn:TraversalSpec">
+                      <name>dcToDs</name>
+                      <type>Datacenter</type>
+                      <path>datastore</path>
+                      <skip>false</skip>
+                   </selectSet>
+                   <selectSet xsi:type="urn:TraversalSpec">
+                      <name>crToH</name>
+                      <type>ComputeResource</type>
+                      <path>host</path>
+                      <skip>false</skip>{vm_traversal}
+                   </selectSet>{vm_traversal_spec}
+                </objectSet>
+             </spec>
+'''
+
+# Extra propSet and traversal for --vms
+vm_prop_set_xml = '''
+                <propSet>
+                   <type>VirtualMachine</type>
+                   <all>false</all>
+                   <pathSet>name</pathSet>
+                   <pathSet>runtime.host</pathSet>
+                   <pathSet>summary.quickStats.overallCpuUsage</pathSet>
+                   <pathSet>summary.quickStats.hostMemoryUsage</pathSet>
+                </propSet>'''
+vm_traversal_xml = '''
+                      <selectSet>
+                         <name>hToVm</name>
+                      </selectSet>'''
+vm_traversal_spec_xml = '''
+                   <selectSet xsi:type="urn:TraversalSpec">
+                      <name>hToVm</name>
+                      <type>HostSystem</type>
+                      <path>vm</path>
+                      <skip>false</skip>
+                   </selectSet>'''
+
+# What the socket serves: objects maps each MoRef to [type, {property path: value text}], as vCenter sent them.
+# synced_at is when vCenter last answered, None until the first full copy has been read.
+inventory = {'vsphere_host': vsphere_host, 'synced_at': None, 'error': None, 'objects': {}}
+inventory_lock = threading.Lock()
+
+
+# Send one SOAP body over the session and return the response, streamed if asked
+def send_soap_request(session, body, stream=False, timeout=60):
+    response = session.post(url, headers=headers, data=soap_envelope.format(body=body), stream=stream, timeout=timeout)
+    response.raise_for_status()
+    return response
+
+
+# Log in and create a filter on the property collector for the inventory, returning the collector's MoRef
+def start_session(session):
+    send_soap_request(session, '''<urn:Login>
+             <_this type="SessionManager">SessionManager</_this>
+             <userName>{username}</userName>
+             <password>{password}</password>
+          </urn:Login>'''.format(username=username, password=password))
+    root = ET.fromstring(send_soap_request(session, '''<urn:RetrieveServiceContent>
+             <_this type="ServiceInstance">ServiceInstance</_this>
+          </urn:RetrieveServiceContent>''').text)
+    property_collector_moref = root.find('.//urn:propertyCollector', namespaces).text
+    root_folder_moref = root.find('.//urn:rootFolder', namespaces).text
+    send_soap_request(session, '''<urn:CreateFilter>
+             <_this type="PropertyCollector">{property_collector_moref}</_this>
+             {spec}
+             <partialUpdates>false</partialUpdates>
+          </urn:CreateFilter>'''.format(property_collector_moref=property_collector_moref, spec=inventory_spec.format(
+        root_folder_moref=root_folder_moref, vm_prop_set=vm_prop_set_xml if args.vms else '', vm_traversal=vm_traversal_xml if args.vms else '', vm_traversal_spec=vm_traversal_spec_xml if args.vms else '')))
+    return property_collector_moref
+
+
+# Log out of a session which is being given up on, so vCenter isn't left holding it until it times out
+def end_session(session):
+    try:
+        send_soap_request(session, '''<urn:Logout>
+             <_this type="SessionManager">SessionManager</_this>
+          </urn:Logout>''', timeout=10)
+    except requests.exceptions.RequestException:
+        pass
+    finally:
+        session.close()
+
+
+# Read one ObjectUpdate as (kind, MoRef, type, [(op, property path, value text), ...])
+def read_object_update(object_update):
+    obj = object_update.find('urn:obj', namespaces)
+    changes = [(change.findtext('urn:op', '', namespaces), change.findtext('urn:name', '', namespaces), change.findtext('urn:val', None, namespaces))
+               for change in object_update.findall('urn:changeSet', namespaces)]
+    return (object_update.findtext('urn:kind', '', namespaces), obj.text, obj.get('type'), changes)
+
+
+# Apply one ObjectUpdate (enter, modify or leave, with its property changes) to the objects
+def apply_object_update(objects, update):
+    kind, moref, object_type, changes = update
+    if kind == 'leave':
+        objects.pop(moref, None)
+        return
+    props = objects.setdefault(moref, [object_type, {}])[1]
+    for op, name, value in changes:
+        if op in ('remove', 'indirectRemove'):
+            props.pop(name, None)
+        else:
+            props[name] = value
+
+
+# Wait for the next set of changes and apply them, returning the new version and whether
+# vCenter truncated the update set and has more to send straight away.
+# Returns the version unchanged when vCenter had nothing to report within max_wait.
+# The response is read and parsed without holding inventory_lock, so clients are never kept waiting on vCenter.
+# Objects not served yet (a first copy being read) are updated as the changes stream in. Served objects get
+# the changes once they have all been read, under the lock.
+def wait_for_updates(session, property_collector_moref, version, objects, served):
+    version_xml = f'<version>{version}</version>' if version else ''
+    response = send_soap_request(session, '''<urn:WaitForUpdatesEx>
+             <_this type="PropertyCollector">{property_collector_moref}</_this>
+             {version_xml}
+             <options>
+                <maxWaitSeconds>{max_wait}</maxWaitSeconds>
+             </options>
+          </urn:WaitForUpdatesEx>'''.format(property_collector_moref=property_collector_moref, version_xml=version_xml, max_wait=args.max_wait),
+        stream=True, timeout=args.max_wait + 60)
+    response.raw.decode_content = True
+    truncated = False
+    pending = []
+    try:
+        for event, element in ET.iterparse(response.raw, events=('end',)):
+            if element.tag == object_set_tag:
+                update = read_object_update(element)
+                if served:
+                    pending.append(update)
+                else:
+                    apply_object_update(objects, update)
+                element.clear()
+            elif element.tag == returnval_tag:
+                version = element.findtext('urn:version', version, namespaces)
+                truncated = element.findtext('urn:truncated', 'false', namespaces) == 'true'
+    finally:
+        response.close()
+    if pending:
+        with inventory_lock:
+            for update in pending:
+                apply_object_update(objects, update)
+    return(version, truncated)
+
+
+# Follow vCenter for as long as the session lasts, logging out of it when it is given up on.
+# A new session starts over with a fresh copy, which only replaces the served one once it is complete.
+def follow_inventory():
+    session = requests.Session()
+    session.verify = False
+    try:
+        property_collector_moref = start_session(session)
+        objects = {}
+        version = ''
+        synced = False
+        while True:
+            version, truncated = wait_for_updates(session, property_collector_moref, version, objects, synced)
+            if truncated:
+                continue
+            with inventory_lock:
+                if not synced:
+                    inventory['objects'] = objects
+                    synced = True
+                inventory['synced_at'] = time.time()
+                inventory['error'] = None
+            if args.debug:
+                print(f"version {version}, {len(objects)} objects")
+    finally:
+        end_session(session)
+
+
+# Hand each client the current inventory as JSON and close
+class InventoryHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        with inventory_lock:
+            answer = json.dumps(inventory).encode()
+        self.request.sendall(answer)
+
+
+def stop(signum, frame):
+    sys.exit(0)
+
+
+if os.path.exists(args.socket):
+    os.unlink(args.socket)
+# Only the owner and group (the monitoring user) may connect
+os.umask(0o117)
+server = socketserver.ThreadingUnixStreamServer(args.socket, InventoryHandler)
+server.daemon_threads = True
+threading.Thread(target=server.serve_forever, daemon=True).start()
+signal.signal(signal.SIGTERM, stop)
+
+try:
+    while True:
+        try:
+            follow_inventory()
+        except Exception as e:
+            with inventory_lock:
+                inventory['error'] = str(e)
+            if args.debug:
+                pprint(inventory['error'])
+            time.sleep(args.retry_interval)
+finally:
+    server.server_close()
+    os.unlink(args.socket)